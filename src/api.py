@@ -0,0 +1,164 @@
+"""
+Copyright 2022 PandaAwAke
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import collections
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from config import engine_config
+from config.engine_config import EngineSettings
+from config.optimization_config import OptimizationSettings, read_optimization_settings
+from model import handle_error
+from model.stats import Stats
+from pipeline.dockerfile_optimizer import DockerfileOptimizer
+from pipeline.dockerfile_reader import DockerfileReader
+from pipeline.pipeline_context import PipelineContext
+
+_load_lock = threading.Lock()   # Guards _loaded_settings
+# The settings read by optimize_text(), private to this module. Key: the path of "settings.yaml";
+# Value: the OptimizationSettings
+_loaded_settings = {}
+
+
+class OptimizeResult:
+    """
+    The result of optimizing one dockerfile with optimize_text().
+
+    -   name: the name of the dockerfile.
+    -   text: the optimized dockerfile, or the input text if it is not optimized.
+    -   outcome: Stats.SUCCESSFUL, Stats.UNCHANGED or Stats.FAILED.
+    -   reason: why the dockerfile is not optimized, or None if it is optimized.
+    -   strategies: a list of the applied OptimizationStrategies of every stage.
+    -   stats: the numbers of modifications, a dict with the keys
+        "add_cache", "insert_before", "remove_command", "remove_option" and "syntax_change".
+    """
+
+    def __init__(self, name: str, text: str, outcome: str, reason: str, strategies: list, stats: dict):
+        self.name = name
+        self.text = text
+        self.outcome = outcome
+        self.reason = reason
+        self.strategies = strategies
+        self.stats = stats
+
+    @property
+    def changed(self) -> bool:
+        return self.outcome == Stats.SUCCESSFUL
+
+    def __repr__(self):
+        return 'OptimizeResult(name={0!r}, outcome={1!r}, stats={2!r})'.format(self.name, self.outcome, self.stats)
+
+
+def optimize_text(text: str, settings: EngineSettings = None, name: str = '<memory>',
+                  optimization_settings: OptimizationSettings = None) -> OptimizeResult:
+    """
+    Optimize the content of one dockerfile in memory.
+
+    Unlike Engine, no global state is touched: the statistics of the engine (model.stats.stats) and the loaded
+    settings of config.optimization_config are not changed, logging is not configured (errors are only emitted
+    to the loggers of the pipeline modules), and no file is written.
+    If optimization_settings is not provided, "settings.yaml" is read by the first call (without its snapshot),
+    and kept inside this module for the next calls.
+    Every call has its own PipelineContext, so optimize_text() can be called by different threads at the same time.
+
+    :param text: the content of the dockerfile.
+    :param settings: the EngineSettings to use (only remove_command_with_true and prefilter are used).
+            If not provided, the default settings are used rather than the ones from the command line.
+    :param name: the name of the dockerfile, only used by the result.
+    :param optimization_settings: the OptimizationSettings to use, such as from
+            config.optimization_config.read_optimization_settings().
+    :return: the OptimizeResult.
+    :raise config.optimization_config.SettingsError: if "settings.yaml" cannot be read or is illegal.
+    """
+    if settings is None:
+        settings = EngineSettings()
+    if optimization_settings is None:
+        optimization_settings = _load_settings()
+
+    file_stats = Stats()
+    context = PipelineContext.create(settings=settings, stats=file_stats, optimization_settings=optimization_settings)
+    content = text.encode('utf-8')
+    if settings.prefilter and len(content) > 0 and \
+            context.global_opt_settings.prefilter_re.search(content) is None:
+        return _result(name, text, Stats.UNCHANGED, DockerfileOptimizer.NOTHING_TO_OPTIMIZE, [], file_stats)
+
+    optimizer = DockerfileOptimizer(context)
+    try:
+        new_stages_lines, strategies, reason = optimizer.optimize(DockerfileReader(content=content))
+    except handle_error.HandleError:
+        return _result(name, text, Stats.FAILED, 'The dockerfile cannot be handled.', [], file_stats)
+    if new_stages_lines is None:
+        return _result(name, text, Stats.UNCHANGED, reason, strategies, file_stats)
+    new_text = ''.join(line for stage_lines in new_stages_lines for line in stage_lines)
+    return _result(name, new_text, Stats.SUCCESSFUL, None, strategies, file_stats)
+
+
+def optimize_many(texts, settings: EngineSettings = None, jobs: int = 1,
+                  optimization_settings: OptimizationSettings = None):
+    """
+    Optimize dockerfiles in memory, see optimize_text().
+
+    :param texts: an iterable of the contents of the dockerfiles, or of (name, content) tuples.
+            It is consumed lazily.
+    :param settings: the EngineSettings to use, see optimize_text().
+    :param jobs: the number of threads. If jobs > 1, at most 2 * jobs dockerfiles are optimized ahead
+            of the consumer.
+    :param optimization_settings: the OptimizationSettings to use, see optimize_text().
+    :return: a generator of OptimizeResults, in the order of texts.
+    """
+    if settings is None:
+        settings = EngineSettings()
+    if optimization_settings is None:
+        optimization_settings = _load_settings()
+    tasks = (_named_text(index, item) for index, item in enumerate(texts))
+    if jobs <= 1:
+        for name, text in tasks:
+            yield optimize_text(text, settings=settings, name=name, optimization_settings=optimization_settings)
+        return
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = collections.deque()
+        for name, text in tasks:
+            pending.append(executor.submit(optimize_text, text, settings, name, optimization_settings))
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().result()
+        while len(pending) > 0:
+            yield pending.popleft().result()
+
+
+def _load_settings() -> OptimizationSettings:
+    path = engine_config.global_settings.pm_settings_path
+    with _load_lock:
+        if path not in _loaded_settings:
+            _loaded_settings[path] = read_optimization_settings(path)
+        return _loaded_settings[path]
+
+
+def _named_text(index: int, item) -> tuple:
+    if isinstance(item, str):
+        return '<memory-{0}>'.format(index), item
+    return item
+
+
+def _result(name: str, text: str, outcome: str, reason, strategies: list, file_stats: Stats) -> OptimizeResult:
+    add_cache_num, insert_before_num, remove_command_num, remove_option_num, syntax_change_num = \
+        file_stats.one_file_tuple()
+    return OptimizeResult(name=name, text=text, outcome=outcome, reason=reason, strategies=strategies, stats={
+        'add_cache': add_cache_num,
+        'insert_before': insert_before_num,
+        'remove_command': remove_command_num,
+        'remove_option': remove_option_num,
+        'syntax_change': syntax_change_num,
+    })
@@ -1,34 +1,207 @@
 import getopt
 import logging
+import os
 import sys
 
 from config.engine_config import engine_settings
+from util import file_util
 
 
 def print_usage():
     usage = """\
 Usage: python src/main.py [OPTIONS] [INPUT]
-If INPUT is a directory, all files (including subdirectories) in it will be optimized.
+       python src/main.py serve [OPTIONS]   (see "python src/main.py serve -h")
+       python src/main.py merge-stats [OPTIONS] DUMP...   (see "python src/main.py merge-stats -h")
+If INPUT is a directory, all dockerfiles (including subdirectories) in it will be optimized.
+If INPUT is an archive (.tar, .tar.gz, .tgz or .zip), all dockerfiles in it will be optimized without
+being extracted, and written into an archive OUTPUT (INPUT with SUFFIX inserted before '.tar' by default),
+together with the other members of INPUT copied as they are.
 A logging file named 'DPMO.log' and a result file named 'DPMO_stats.txt' will be generated.
 
 Options:
   -f FAIL_FILE  Output all dockerfiles that are failed to optimize into FAIL_FILE
                 FAIL_FILE is './DPMO_failures.txt' by default
   -h            Display this help message and exit
+  -j, --jobs N  Optimize the files inside a directory INPUT with N worker processes,
+                default to 1 (no worker processes)
   -n            If specified, DPMO will remove the commands to remove (and the connector after
                 it if the connector exists) when optimizing. By default they will be substituted
                 with 'true'.
   -o OUTPUT     Optimized output dockerfile path, default to INPUT + SUFFIX
                 (SUFFIX is ".optimized" by default, so this will be "INPUT.optimized" by default)
                 If INPUT is a directory, then OUTPUT should be a directory too
+                If INPUT is an archive, then OUTPUT should be an archive too (of any supported format)
   -s SUFFIX     Set the prefix of the output file, default to ".optimized"
                 If INPUT and OUTPUT both are directories, then SUFFIX will be ignored
   -S            Show optimization statistics for each file
   -w            Only show warning and error messages in the console
+  --cache-dir DIR
+                Cache the optimization results in DIR, default to '~/.cache/dpmo'
+                An input file is not optimized again if neither it nor the settings have changed
+  --cache-size MB
+                Limit the size of the cache directory to MB megabytes, default to 1024
+                The least recently used results are removed when the cache is full
+  --no-cache    Do not use the result cache
+  --dedup       Optimize the files inside a directory INPUT which are identical (ignoring line endings
+                and trailing whitespaces) only once, and copy the output to the other identical files.
+                Files differing in line endings or whitespaces get the same statistics, but keep their own
+                content, or are optimized by themselves when the output is changed
+  --dedup-link  The same as --dedup, but hard-link the output instead of copying it when possible
+  --include GLOB
+                Only optimize the files matching GLOB inside a directory INPUT (case-insensitive),
+                can be specified multiple times. A GLOB containing '/' is matched with the relative
+                path, or else the filename. Default to 'Dockerfile*', '*.Dockerfile' and 'Containerfile'
+  --exclude GLOB
+                Skip the files and directories matching GLOB inside a directory INPUT, can be
+                specified multiple times. '.git', '.hg', '.svn', 'node_modules' and '__pycache__'
+                are always skipped
+  --max-size KB Skip the files larger than KB kilobytes inside a directory INPUT, default to 1024
+                0 means no limit. Binary files are always skipped
+  --journal FILE
+                Record every finished file into the journal FILE, so an interrupted run can be resumed
+  --resume      Used with --journal, skip the files recorded in the journal and restore their statistics
+  --no-prefilter
+                Do not skip the files without any package manager executable before parsing them
+  --watch       After optimizing a directory INPUT, keep watching it (until Ctrl+C): the files added
+                or modified are optimized again, and the outputs of the deleted files are removed
+  --watch-interval SECONDS
+                Check the files watched by --watch every SECONDS seconds, default to 1
+  --shard K/N   Only optimize the K-th of N shards (1 <= K <= N) of a directory or archive INPUT. Files are
+                assigned to shards by the hash of their relative paths, so N runs (such as on N hosts) with
+                K = 1..N optimize every file exactly once. Implies --stats-json './DPMO_stats.shard-K-of-N.json'
+  --stats-json FILE
+                Also write the statistics into FILE as JSON, which can be combined by "merge-stats"
+  --stats-max-files N
+                Only record the first N filenames of every kind of optimization in the statistics
+                (the numbers of files are still exact), default to 0 (no limit)
+  --timings FILE
+                Time every phase (parse, simulate, optimize, global_optimize, write) of every file, and write
+                the durations into FILE as JSON lines. The percentiles of the durations of files and the
+                slowest files are added to the statistics
+  --profile FILE
+                Profile the pipeline of every file with cProfile, and write the profile of all files
+                (including the ones processed by worker processes) into FILE, which can be read by pstats.
+                The collapsed stacks for flamegraph tools are written into FILE.collapsed
+  --profile-min-ms MS
+                Only profile the files whose pipeline takes at least MS milliseconds (while being
+                profiled), default to 0 (all files)
+  --memtrace
+                Trace the memory allocated by every phase of every file with tracemalloc, and write the
+                peak memory of files and the top allocation sites of every phase into ./DPMO_memtrace.txt.
+                It slows the run down a lot. With --timings, the peak memory of every file is written into
+                the timings file as well
 """
     print(usage)
 
 
+def print_merge_stats_usage():
+    usage = """\
+Usage: python src/main.py merge-stats [OPTIONS] DUMP...
+Combine the statistics written by --stats-json (such as by the runs of every --shard) into one report.
+The report is the same as the one of a single run optimizing all files, and is written into 'DPMO_stats.txt'.
+
+Options:
+  -h            Display this help message and exit
+  --stats-json FILE
+                Also write the combined statistics into FILE as JSON
+  --stats-max-files N
+                The same as --stats-max-files of optimizing files
+"""
+    print(usage)
+
+
+def init_merge_stats_by_argv(argv):
+    """
+    Parse the command-line arguments of "merge-stats", and then set the engine settings (in engine_config.py).
+
+    :param argv: command-line arguments after "merge-stats" (sys.argv[2:])
+    :return: None
+    """
+    try:
+        opts, args = getopt.getopt(argv, 'h', ['stats-json=', 'stats-max-files='])
+    except getopt.GetoptError as e:
+        logging.error('Invalid option: "{0}"'.format(e.opt))
+        sys.exit(-1)
+    if len(opts) > 0 and opts[0][0] == '-h':
+        print_merge_stats_usage()
+        sys.exit(0)
+    if len(args) == 0:
+        logging.error('No stats dump to merge!')
+        sys.exit(-1)
+
+    engine_settings.merge_dump_files = args
+    for option, value in opts:
+        if option == '--stats-json':
+            engine_settings.stats_dump_file = value
+        elif option == '--stats-max-files':
+            engine_settings.stats_max_files = _parse_stats_max_files(value)
+
+    try:
+        engine_settings.stat_fileobj = open(file='./DPMO_stats.txt', mode='w', encoding='utf-8')
+    except Exception as e:  # Including: IOError
+        logging.error(e)
+        sys.exit(-1)
+
+    init_logger()
+
+
+def print_serve_usage():
+    usage = """\
+Usage: python src/main.py serve [OPTIONS]
+Serve optimize requests over a local Unix socket, with the settings loaded once.
+'settings.yaml' is reloaded when it changes. A logging file named 'DPMO.log' will be generated.
+
+Every request is a line of JSON: {"id": ..., "content": DOCKERFILE, "name": NAME} ("id" and "name"
+are optional), and the response is a line of JSON: {"id": ..., "outcome": ..., "stats": [...],
+"content": OPTIMIZED_DOCKERFILE}, or {"id": ..., "error": ...}.
+
+Options:
+  -h            Display this help message and exit
+  -j, --jobs N  Optimize with N worker processes, default to 1
+  -n            The same as -n of optimizing files
+  -w            Only show warning and error messages in the console
+  --socket PATH Serve on the Unix socket PATH, default to './dpmo.sock'
+  --no-prefilter
+                The same as --no-prefilter of optimizing files
+"""
+    print(usage)
+
+
+def init_serve_by_argv(argv):
+    """
+    Parse the command-line arguments of "serve", and then set the engine settings (in engine_config.py).
+
+    :param argv: command-line arguments after "serve" (sys.argv[2:])
+    :return: None
+    """
+    try:
+        opts, args = getopt.getopt(argv, 'hj:nw', ['jobs=', 'socket=', 'no-prefilter'])
+    except getopt.GetoptError as e:
+        logging.error('Invalid option: "{0}"'.format(e.opt))
+        sys.exit(-1)
+    if len(opts) > 0 and opts[0][0] == '-h':
+        print_serve_usage()
+        sys.exit(0)
+
+    engine_settings.use_cache = False   # The results are not saved as files
+    for option, value in opts:
+        if option in ('-j', '--jobs'):
+            if not value.isdigit() or int(value) < 1:
+                logging.error('Invalid number of jobs: "{0}"'.format(value))
+                sys.exit(-1)
+            engine_settings.jobs = int(value)
+        elif option == '-n':
+            engine_settings.remove_command_with_true = False
+        elif option == '-w':
+            engine_settings.logging_level = logging.WARNING
+        elif option == '--socket':
+            engine_settings.socket_path = value
+        elif option == '--no-prefilter':
+            engine_settings.prefilter = False
+
+    init_logger()
+
+
 def init_by_argv(argv):
     """
     Parse the command-line arguments, and then set the engine settings (in engine_config.py).
@@ -37,7 +210,13 @@ def init_by_argv(argv):
     :return: None
     """
     try:
-        opts, args = getopt.getopt(argv, 'ho:s:Sf:wn')
+        opts, args = getopt.getopt(argv, 'ho:s:Sf:wnj:', ['jobs=', 'cache-dir=', 'cache-size=', 'no-cache',
+                                                          'dedup', 'dedup-link', 'include=', 'exclude=',
+                                                          'max-size=', 'journal=', 'resume',
+                                                          'no-prefilter', 'watch', 'watch-interval=',
+                                                          'shard=', 'stats-json=', 'stats-max-files=',
+                                                          'timings=', 'profile=', 'profile-min-ms=',
+                                                          'memtrace'])
     except getopt.GetoptError as e:
         logging.error('Invalid option: "{0}"'.format(e.opt))
         sys.exit(-1)
@@ -50,6 +229,7 @@ def init_by_argv(argv):
 
     engine_settings.input_file = args[0]
 
+    include_globs = []
     for option, value in opts:
         if option == '-o':
             engine_settings.output_file = value
@@ -63,6 +243,101 @@ def init_by_argv(argv):
             engine_settings.logging_level = logging.WARNING
         elif option == '-n':
             engine_settings.remove_command_with_true = False
+        elif option in ('-j', '--jobs'):
+            if not value.isdigit() or int(value) < 1:
+                logging.error('Invalid number of jobs: "{0}"'.format(value))
+                sys.exit(-1)
+            engine_settings.jobs = int(value)
+        elif option == '--cache-dir':
+            engine_settings.cache_dir = value
+        elif option == '--cache-size':
+            if not value.isdigit():
+                logging.error('Invalid cache size: "{0}"'.format(value))
+                sys.exit(-1)
+            engine_settings.cache_max_size = int(value) * 1024 * 1024
+        elif option == '--no-cache':
+            engine_settings.use_cache = False
+        elif option == '--dedup':
+            engine_settings.dedup = True
+        elif option == '--dedup-link':
+            engine_settings.dedup = True
+            engine_settings.dedup_link = True
+        elif option == '--include':
+            include_globs.append(value)
+        elif option == '--exclude':
+            engine_settings.exclude_globs.append(value)
+        elif option == '--max-size':
+            if not value.isdigit():
+                logging.error('Invalid file size: "{0}"'.format(value))
+                sys.exit(-1)
+            engine_settings.max_file_size = int(value) * 1024
+        elif option == '--journal':
+            engine_settings.journal_file = value
+        elif option == '--resume':
+            engine_settings.resume = True
+        elif option == '--no-prefilter':
+            engine_settings.prefilter = False
+        elif option == '--watch':
+            engine_settings.watch = True
+        elif option == '--watch-interval':
+            try:
+                engine_settings.watch_interval = float(value)
+            except ValueError:
+                engine_settings.watch_interval = -1
+            if not engine_settings.watch_interval > 0:
+                logging.error('Invalid watch interval: "{0}"'.format(value))
+                sys.exit(-1)
+        elif option == '--shard':
+            index, _, count = value.partition('/')
+            if not index.isdigit() or not count.isdigit() or not 1 <= int(index) <= int(count):
+                logging.error('Invalid shard: "{0}", it should be K/N (1 <= K <= N)'.format(value))
+                sys.exit(-1)
+            engine_settings.shard = (int(index), int(count))
+        elif option == '--stats-json':
+            engine_settings.stats_dump_file = value
+        elif option == '--stats-max-files':
+            engine_settings.stats_max_files = _parse_stats_max_files(value)
+        elif option == '--timings':
+            engine_settings.timings_file = value
+        elif option == '--profile':
+            engine_settings.profile_file = value
+        elif option == '--profile-min-ms':
+            try:
+                engine_settings.profile_min_duration = float(value) / 1000
+            except ValueError:
+                engine_settings.profile_min_duration = -1
+            if not engine_settings.profile_min_duration >= 0:
+                logging.error('Invalid duration: "{0}"'.format(value))
+                sys.exit(-1)
+        elif option == '--memtrace':
+            engine_settings.memtrace = True
+    if len(include_globs) > 0:
+        engine_settings.include_globs = include_globs
+    if engine_settings.resume and engine_settings.journal_file is None:
+        logging.error('--resume needs a journal, please specify it with --journal!')
+        sys.exit(-1)
+    if engine_settings.watch and not os.path.isdir(engine_settings.input_file):
+        logging.error('--watch needs a directory INPUT!')
+        sys.exit(-1)
+    if engine_settings.watch and engine_settings.dedup:
+        logging.error('--watch cannot be used with --dedup!')
+        sys.exit(-1)
+    if engine_settings.profile_min_duration > 0 and engine_settings.profile_file is None:
+        logging.error('--profile-min-ms needs a profile, please specify it with --profile!')
+        sys.exit(-1)
+    if engine_settings.shard is not None:
+        if not os.path.isdir(engine_settings.input_file) and not file_util.is_archive(engine_settings.input_file):
+            logging.error('--shard needs a directory or archive INPUT!')
+            sys.exit(-1)
+        if engine_settings.stats_dump_file is None:
+            engine_settings.stats_dump_file = './DPMO_stats.shard-{0}-of-{1}.json'.format(*engine_settings.shard)
+    if file_util.is_archive(engine_settings.input_file) and os.path.isfile(engine_settings.input_file):
+        if engine_settings.output_file is not None and not file_util.is_archive(engine_settings.output_file):
+            logging.error('INPUT is an archive, but OUTPUT isn\'t!')
+            sys.exit(-1)
+        if engine_settings.dedup or engine_settings.resume:
+            logging.error('--dedup and --resume cannot be used with an archive INPUT!')
+            sys.exit(-1)
 
     try:
         engine_settings.fail_fileobj = open(file=engine_settings.fail_file, mode='w', encoding='utf-8')
@@ -74,6 +349,13 @@ def init_by_argv(argv):
     init_logger()
 
 
+def _parse_stats_max_files(value: str) -> int:
+    if not value.isdigit():
+        logging.error('Invalid number of files: "{0}"'.format(value))
+        sys.exit(-1)
+    return int(value)
+
+
 def init_logger():
     logger = logging.getLogger()
     logger.setLevel(logging.DEBUG)
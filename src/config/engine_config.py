@@ -1,4 +1,7 @@
 import logging
+import os
+
+from util import file_util
 
 
 class GlobalSettings(object):
@@ -28,6 +31,37 @@ class EngineSettings(object):
         self.stat_fileobj = None
         self.remove_command_with_true = True
         self.logging_level = logging.INFO
+        self.jobs = 1
+        self.use_cache = True
+        self.cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'dpmo')
+        self.cache_max_size = 1024 * 1024 * 1024   # 1 GiB
+        self.dedup = False
+        self.dedup_link = False
+        self.include_globs = list(file_util.DEFAULT_INCLUDE_GLOBS)
+        self.exclude_globs = []     # Besides file_util.DEFAULT_EXCLUDE_GLOBS
+        self.max_file_size = 1024 * 1024   # 1 MiB
+        self.journal_file = None
+        self.resume = False
+        self.prefilter = True
+        self.watch = False
+        self.watch_interval = 1.0   # In seconds
+        self.shard = None   # (index, count) of --shard, the index is from 1 to count
+        self.stats_dump_file = None
+        self.timings_file = None
+        self.profile_file = None
+        self.profile_min_duration = 0.0     # In seconds
+        self.memtrace = False
+        self.memtrace_file = './DPMO_memtrace.txt'
+        self.stats_max_files = 0    # Maximum number of filenames in the statistics for every tuple, 0 means no limit
+        self.merge_dump_files = []  # Input stats dumps of "merge-stats"
+        self.socket_path = './dpmo.sock'
+
+    def __getstate__(self):
+        # File objects belong to the process that opened them, so they are not sent to worker processes
+        state = dict(vars(self))
+        state['fail_fileobj'] = None
+        state['stat_fileobj'] = None
+        return state
 
 
 global_settings = GlobalSettings()
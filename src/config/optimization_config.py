@@ -1,10 +1,62 @@
+import hashlib
+import json
 import logging
-
-import yaml
+import os
+import pickle
+import re
 import sys
 
 from config.engine_config import global_settings
 
+logger = logging.getLogger(__name__)
+
+# Version of the settings snapshot (see _load_snapshot()), increase it when the pickled classes are changed
+SNAPSHOT_VERSION = 1
+
+
+class RegexSet(object):
+    """
+    A set of regular expressions, which are matched (re.match) against a string in one scan.
+
+    All patterns are combined into one alternation with a named group for each pattern:
+    "(?P<_0>pattern0)|(?P<_1>pattern1)|...". If they cannot be combined (for example, a pattern
+    uses backreferences, whose group numbers would change), the patterns are matched one by one.
+    """
+
+    _backreference_re = re.compile(r'\\[1-9]|\(\?P=')
+
+    def __init__(self, patterns: list):
+        """
+        Compile the patterns.
+
+        :param patterns: a list of regular expression strings.
+        :raise re.error: if a pattern is illegal.
+        """
+        self.patterns = patterns
+        self.compiled_patterns = [re.compile(pattern) for pattern in patterns]
+        self.combined_re = None
+        if len(patterns) > 0 and not any(self._backreference_re.search(pattern) for pattern in patterns):
+            try:
+                self.combined_re = re.compile('|'.join('(?P<_{0}>{1})'.format(index, pattern)
+                                                       for index, pattern in enumerate(patterns)))
+            except re.error:    # Such as global flags not at the start of the expression
+                self.combined_re = None
+
+    def match(self, s: str):
+        """
+        Match s with all patterns.
+
+        :param s: the string to match.
+        :return: the first pattern which matches s, or None if no pattern matches.
+        """
+        if self.combined_re is not None:
+            match_result = self.combined_re.match(s)
+            return self.patterns[int(match_result.lastgroup[1:])] if match_result else None
+        for pattern, compiled_pattern in zip(self.patterns, self.compiled_patterns):
+            if compiled_pattern.match(s):
+                return pattern
+        return None
+
 
 class PMSetting(object):
     """
@@ -36,6 +88,10 @@ class PMSetting(object):
         self.additional_pre_commands = additional_pre_commands
         self.anti_cache_options = anti_cache_options
 
+        # Compiled regular expressions
+        self.commands_re_run = RegexSet(commands_regex_run)
+        self.commands_re_modify_cache_dir = [re.compile(regex) for regex in commands_regex_modify_cache_dir or []]
+
 
 class GlobalOptimizationSettings(object):
     """
@@ -51,50 +107,292 @@ class GlobalOptimizationSettings(object):
         if anti_cache_commands_regex is None:
             anti_cache_commands_regex = []
         self.anti_cache_commands_regex = anti_cache_commands_regex
+        self.anti_cache_commands_re = RegexSet(anti_cache_commands_regex)
+        self.prefilter_re = None    # Built by build_prefilter_re()
+
+
+def _regex_literal_prefix(regex: str) -> str:
+    """
+    Get the literal prefix which every string matching the regex (re.match) starts with,
+    for example "apt" for "^apt(-get)?\\s+clean".
+
+    :param regex: the regular expression.
+    :return: the literal prefix, maybe empty.
+    """
+    depth = 0
+    escaped = False
+    for c in regex:     # A top-level alternation has no common prefix
+        if escaped:
+            escaped = False
+        elif c == '\\':
+            escaped = True
+        elif c in '([':
+            depth += 1
+        elif c in ')]':
+            depth -= 1
+        elif c == '|' and depth == 0:
+            return ''
+    prefix = ''
+    for i, c in enumerate(regex):
+        if c == '^' and i == 0:
+            continue
+        if c in '.^$*+?{}[]|()\\':
+            if c in '*?{' and len(prefix) > 0:
+                prefix = prefix[:-1]    # The last character is optional
+            break
+        prefix += c
+    return prefix
+
+
+def build_prefilter_re(pm_executables: dict, global_opt_settings: GlobalOptimizationSettings):
+    """
+    Build global_opt_settings.prefilter_re: a bytes regular expression searching for every PM executable
+    (as a whole word) and the literal prefix of every anti-cache command regex in the raw dockerfile.
+    A dockerfile without any hit has no package manager command, so nothing can be optimized.
+
+    :param pm_executables: the index of all PM executables.
+    :param global_opt_settings: the GlobalOptimizationSettings to build prefilter_re for.
+    :return: None
+    """
+    words = set(pm_executables.keys())
+    for regex in global_opt_settings.anti_cache_commands_regex:
+        prefix = _regex_literal_prefix(regex).strip()
+        # Anti-cache commands are only removed in optimizable dockerfiles, which need a PM executable.
+        # So a regex without a literal prefix can be ignored here.
+        if prefix != '':
+            words.add(prefix)
+    alternation = b'|'.join(re.escape(word.encode('utf-8')) for word in sorted(words, key=len, reverse=True))
+    global_opt_settings.prefilter_re = re.compile(b'(?<![\\w.-])(?:' + alternation + b')(?![\\w.-])')
+
+
+class SettingsError(Exception):
+    """
+    An exception class, raised when "settings.yaml" cannot be read or is illegal.
+    """
+
+
+class OptimizationSettings(object):
+    """
+    The settings loaded from "settings.yaml", see parse_optimization_settings().
+
+    -   pm_settings: the settings of all PMs. Key: PM's name; Value: a PMSetting object.
+    -   pm_executables: the index of all PM executables. Key: the executable; Value: PM's name.
+    -   global_opt_settings: the GlobalOptimizationSettings.
+    -   settings_digest: the digest of the parsed "settings.yaml".
+    """
+
+    def __init__(self, pm_settings: dict, pm_executables: dict, global_opt_settings: GlobalOptimizationSettings,
+                 settings_digest: str):
+        self.pm_settings = pm_settings
+        self.pm_executables = pm_executables
+        self.global_opt_settings = global_opt_settings
+        self.settings_digest = settings_digest
+
+
+def parse_optimization_settings(settings_bytes: bytes) -> OptimizationSettings:
+    """
+    Parse the content of "settings.yaml" into a new OptimizationSettings. No global state is changed.
+
+    :param settings_bytes: the content of "settings.yaml".
+    :return: the OptimizationSettings.
+    :raise SettingsError: if the settings are illegal.
+    """
+    import yaml     # Imported lazily, the snapshot makes it unnecessary for most runs
+
+    try:
+        pm_yaml_settings = yaml.load(settings_bytes, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+    except yaml.YAMLError as e:
+        raise SettingsError(e)
+
+    loaded_settings_digest = hashlib.sha256(
+        json.dumps(pm_yaml_settings, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    try:
+        loaded_global_opt_settings = GlobalOptimizationSettings(
+            anti_cache_commands_regex=pm_yaml_settings['anti-cache-commands-regex'])
+        pm_yaml_settings: dict = pm_yaml_settings['packageManagers']
+        pm_names = list(pm_yaml_settings.keys())
+    except re.error as e:
+        raise SettingsError('Illegal anti-cache-commands-regex: {0}'.format(e))
+    except (KeyError, TypeError, AttributeError) as e:
+        raise SettingsError('Illegal settings: {0!r}'.format(e))
+
+    loaded_pm_settings = {}
+    loaded_pm_executables = {}
+    for pm_name in pm_names:
+        pm_yaml_dict: dict = pm_yaml_settings[pm_name]
+
+        try:
+            pm_setting = PMSetting(
+                executables=pm_yaml_dict.get('executables') or [pm_name],
+                commands_regex_run=pm_yaml_dict.get('commands-regex-run') or [],
+                default_cache_dirs=pm_yaml_dict.get('default-cache-dirs') or [],
+                commands_regex_modify_cache_dir=pm_yaml_dict.get('commands-regex-modify-cache-dir') or [],
+                additional_pre_commands=pm_yaml_dict.get('additional-pre-commands') or [],
+                anti_cache_options=pm_yaml_dict.get('anti-cache-options') or [],
+            )
+        except re.error as e:
+            raise SettingsError('Illegal regular expression for "{0}": {1}'.format(pm_name, e))
+        except AttributeError:
+            raise SettingsError('Illegal settings for "{0}"!'.format(pm_name))
+
+        if len(pm_setting.commands_regex_run) == 0:
+            raise SettingsError('commands-regex-run is not set for "{0}"!'.format(pm_name))
+        if len(pm_setting.default_cache_dirs) == 0:
+            raise SettingsError('default-cache-dirs is not set for "{0}"!'.format(pm_name))
+        loaded_pm_settings[pm_name] = pm_setting
+        for executable in pm_setting.executables:
+            loaded_pm_executables.setdefault(executable, pm_name)  # The first PM in "settings.yaml" wins
+
+    build_prefilter_re(loaded_pm_executables, loaded_global_opt_settings)
+    return OptimizationSettings(pm_settings=loaded_pm_settings, pm_executables=loaded_pm_executables,
+                                global_opt_settings=loaded_global_opt_settings,
+                                settings_digest=loaded_settings_digest)
+
+
+def read_optimization_settings(path: str = None) -> OptimizationSettings:
+    """
+    Read "settings.yaml" into a new OptimizationSettings, such as for api.optimize_text().
+    Unlike load_optimization_settings(), no global state is changed and the snapshot is neither read nor written.
+
+    :param path: the path of "settings.yaml", global_settings.pm_settings_path by default.
+    :return: the OptimizationSettings.
+    :raise SettingsError: if the settings cannot be read or are illegal.
+    """
+    try:
+        with open(file=path or global_settings.pm_settings_path, mode='rb') as f:
+            settings_bytes = f.read()
+    except OSError as e:
+        raise SettingsError(e)
+    return parse_optimization_settings(settings_bytes)
 
 
 def load_optimization_settings():
     """
     Load all PM settings from "settings.yaml" into pm_settings and global_opt_settings.
+    The compiled settings are saved into a snapshot next to "settings.yaml", which is loaded instead
+    by the next runs until "settings.yaml" is changed (see _load_snapshot()).
+    Exits if the settings cannot be read or are illegal.
 
     :return: None
     """
+    global global_opt_settings, settings_digest
     if len(pm_settings) > 0:
         return
     try:
-        f = open(file=global_settings.pm_settings_path, mode='r', encoding='utf-8')
-        pm_yaml_settings = yaml.safe_load(f)
-    except Exception as e:  # Including: IOError, yaml.YAMLError
-        logging.error(e)
+        with open(file=global_settings.pm_settings_path, mode='rb') as f:
+            settings_bytes = f.read()
+            settings_stat = os.fstat(f.fileno())
+        if _load_snapshot(settings_bytes, settings_stat):
+            return
+        loaded_settings = parse_optimization_settings(settings_bytes)
+    except (OSError, SettingsError) as e:
+        logger.error(e)
         sys.exit(-1)
 
-    global global_opt_settings
-    global_opt_settings = GlobalOptimizationSettings()
-    global_opt_settings.anti_cache_commands_regex = pm_yaml_settings['anti-cache-commands-regex']
+    install_optimization_settings(loaded_settings)
+    _write_snapshot(settings_bytes, settings_stat)
 
-    pm_yaml_settings: dict = pm_yaml_settings['packageManagers']
-    for pm_name in pm_yaml_settings.keys():
-        pm_yaml_dict: dict = pm_yaml_settings[pm_name]
 
-        pm_setting = PMSetting(
-            executables=pm_yaml_dict.get('executables') or [pm_name],
-            commands_regex_run=pm_yaml_dict.get('commands-regex-run') or [],
-            default_cache_dirs=pm_yaml_dict.get('default-cache-dirs') or [],
-            commands_regex_modify_cache_dir=pm_yaml_dict.get('commands-regex-modify-cache-dir') or [],
-            additional_pre_commands=pm_yaml_dict.get('additional-pre-commands') or [],
-            anti_cache_options=pm_yaml_dict.get('anti-cache-options') or [],
-        )
+def install_optimization_settings(loaded_settings: OptimizationSettings):
+    """
+    Replace pm_settings, pm_executables, global_opt_settings and settings_digest with loaded_settings.
 
-        if len(pm_setting.commands_regex_run) == 0:
-            logging.error('commands-regex-run is not set for "{0}"!'.format(pm_name))
-            sys.exit(-1)
-        if len(pm_setting.default_cache_dirs) == 0:
-            logging.error('default-cache-dirs is not set for "{0}"!'.format(pm_name))
-            sys.exit(-1)
-        pm_settings[pm_name] = pm_setting
-    f.close()
+    :param loaded_settings: the OptimizationSettings, such as from read_optimization_settings().
+    :return: None
+    """
+    global global_opt_settings, settings_digest
+    pm_settings.clear()
+    pm_settings.update(loaded_settings.pm_settings)
+    pm_executables.clear()
+    pm_executables.update(loaded_settings.pm_executables)
+    global_opt_settings = loaded_settings.global_opt_settings
+    settings_digest = loaded_settings.settings_digest
+
+
+def _snapshot_path() -> str:
+    settings_dir, settings_name = os.path.split(global_settings.pm_settings_path)
+    return os.path.join(settings_dir, '.' + settings_name + '.snapshot')
+
+
+def _snapshot_key(settings_bytes: bytes, settings_stat) -> tuple:
+    return (SNAPSHOT_VERSION, sys.version_info[:2], settings_stat.st_mtime_ns, settings_stat.st_size,
+            hashlib.sha256(settings_bytes).hexdigest())
+
+
+def _load_snapshot(settings_bytes: bytes, settings_stat) -> bool:
+    """
+    Load the compiled settings from the snapshot next to "settings.yaml", which saves importing yaml,
+    parsing "settings.yaml" and building the settings objects.
+    The snapshot is only used if its version, and the mtime, size and hash of "settings.yaml" are unchanged.
+
+    :param settings_bytes: the content of "settings.yaml".
+    :param settings_stat: the os.stat_result of "settings.yaml".
+    :return: True if the settings were loaded from the snapshot, or else False.
+    """
+    global global_opt_settings, settings_digest
+    try:
+        with open(file=_snapshot_path(), mode='rb') as f:
+            snapshot = pickle.load(f)
+        if snapshot['key'] != _snapshot_key(settings_bytes, settings_stat):
+            return False
+        snapshot_pm_settings, snapshot_pm_executables, snapshot_global_opt_settings, snapshot_settings_digest = \
+            snapshot['settings']
+    except FileNotFoundError:
+        return False
+    except Exception as e:  # Including: pickle.UnpicklingError, a snapshot of changed classes
+        logger.debug('Ignored the settings snapshot "{0}": {1!r}'.format(_snapshot_path(), e))
+        return False
+    pm_settings.update(snapshot_pm_settings)
+    pm_executables.update(snapshot_pm_executables)
+    global_opt_settings, settings_digest = snapshot_global_opt_settings, snapshot_settings_digest
+    return True
+
+
+def _write_snapshot(settings_bytes: bytes, settings_stat):
+    """
+    Write the loaded settings into the snapshot, see _load_snapshot().
+    The snapshot is written atomically, and it's fine if it cannot be written.
+
+    :param settings_bytes: the content of "settings.yaml".
+    :param settings_stat: the os.stat_result of "settings.yaml".
+    :return: None
+    """
+    snapshot_path = _snapshot_path()
+    tmp_path = '{0}.{1}.tmp'.format(snapshot_path, os.getpid())
+    snapshot = {
+        'key': _snapshot_key(settings_bytes, settings_stat),
+        'settings': (dict(pm_settings), dict(pm_executables), global_opt_settings, settings_digest),
+    }
+    try:
+        with open(file=tmp_path, mode='wb') as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, snapshot_path)
+    except OSError as e:
+        logger.debug('Cannot write the settings snapshot "{0}": {1}'.format(snapshot_path, e))
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def reload_optimization_settings() -> bool:
+    """
+    Load the settings from "settings.yaml" again, for example when it was changed.
+    If the new settings cannot be read or are illegal, the loaded settings are kept.
+    The snapshot is not written, see read_optimization_settings().
+
+    :return: True if the settings were reloaded, or else False.
+    """
+    try:
+        loaded_settings = read_optimization_settings()
+    except SettingsError as e:
+        logger.error(e)
+        return False
+    install_optimization_settings(loaded_settings)
+    return True
 
 
 pm_settings = {}    # All PM's settings. Key: PM's name; Value: a PMSetting object.
+pm_executables = {}     # The index of all PM executables. Key: the executable; Value: PM's name.
 global_opt_settings: GlobalOptimizationSettings
+settings_digest: str     # The digest of the parsed "settings.yaml", used by the result cache
 
@@ -15,22 +15,32 @@ limitations under the License.
 """
 
 
+import collections
+import filecmp
+import glob
+import hashlib
+import io
 import logging
+import mmap
 import os
+import shutil
 import sys
+import time
 
-from dockerfile_parse import DockerfileParser
-
+from config import args_handler, optimization_config
 from config.engine_config import engine_settings
 from config.optimization_config import load_optimization_settings
 from model import handle_error
-from model.optimization_strategy import AddCacheStrategy
-from model.stats import stats
+from model.stats import Stats, stats
+from pipeline.dockerfile_optimizer import DockerfileOptimizer
+from pipeline.dockerfile_reader import DockerfileReader
 from pipeline.dockerfile_writer import DockerfileWriter
-from pipeline.global_optimizer import GlobalOptimizer
-from pipeline.stage_optimizer import StageOptimizer
-from pipeline.stage_simulator import StageSimulator
-from pipeline.stage_splitter import StageSplitter
+from pipeline.pipeline_context import PipelineContext
+from util import file_util
+from util.journal import Journal, JsonLinesLog
+from util.phase_timer import PhaseTimer
+from util.profiler import PipelineProfiler
+from util.result_cache import ResultCache
 
 
 class Engine(object):
@@ -69,8 +79,44 @@ class Engine(object):
         global changes to the whole dockerfile.
     """
 
-    def __init__(self):
+    def __init__(self, result_cache_salt: bytes = None):
+        """
+        Initialize the engine.
+
+        :param result_cache_salt: the salt of the result cache keys, computed by _result_cache_salt() if None.
+                Worker processes get the salt computed by the parent process (see _init_worker()).
+        """
         load_optimization_settings()
+        stats.total_optimization_files.max_files = engine_settings.stats_max_files
+        self.result_cache = None
+        if engine_settings.use_cache:
+            self.result_cache = ResultCache(cache_dir=engine_settings.cache_dir,
+                                            max_size=engine_settings.cache_max_size,
+                                            salt=result_cache_salt if result_cache_salt is not None
+                                            else _result_cache_salt())
+        self.journal = None
+        if engine_settings.journal_file is not None:
+            self.journal = Journal(engine_settings.journal_file)
+        # The files finished by a previous run, see --resume. Key: the absolute path; Value: (outcome, stat_tuple)
+        self.journaled_files = {}
+        # The phases of every file are measured only with --timings or --memtrace, so there's no cost without them
+        self.timer = None
+        self.timings_log = None
+        self.memory_tracer = None
+        if engine_settings.memtrace:
+            from util.memory_tracer import MemoryTracer     # Imported lazily, it is only needed by --memtrace
+
+            # The memory tracer times the phases as well
+            self.memory_tracer = MemoryTracer()
+            self.memory_tracer.start_tracing()
+            self.timer = self.memory_tracer
+        elif engine_settings.timings_file is not None:
+            self.timer = PhaseTimer()
+        if engine_settings.timings_file is not None:
+            self.timings_log = JsonLinesLog(engine_settings.timings_file)
+        self.profiler = None
+        if engine_settings.profile_file is not None:
+            self.profiler = PipelineProfiler(min_duration=engine_settings.profile_min_duration)
 
     def run(self):
         """
@@ -78,14 +124,29 @@ class Engine(object):
 
         :return: None
         """
-        if os.path.isdir(engine_settings.input_file):   # Input is a directory
+        if self.journal is not None:
+            if engine_settings.resume:
+                self._restore_journal()
+            else:
+                self.journal.clear()
+        if self.timings_log is not None:
+            self.timings_log.clear()
+
+        if file_util.is_archive(engine_settings.input_file) and os.path.isfile(engine_settings.input_file):
+            self._optimize_archive()
+        elif os.path.isdir(engine_settings.input_file):   # Input is a directory
             if engine_settings.output_file is not None:
                 if os.path.exists(engine_settings.output_file) and \
                         not os.path.isdir(engine_settings.output_file):
                     logging.error("INPUT is a directory, but OUTPUT isn't!")
                     sys.exit(-1)
                 self._create_output_directory(engine_settings.output_file)
-            self._optimize_directory()
+            if engine_settings.watch:
+                self._watch_directory()
+            else:
+                self._optimize_directory()
+        elif self._is_journaled(engine_settings.input_file):
+            logging.info("Resumed - {0} - Finished by the previous run.".format(engine_settings.input_file))
         else:       # Input is a file
             if engine_settings.output_file is not None:
                 if os.path.isdir(engine_settings.output_file):
@@ -99,85 +160,293 @@ class Engine(object):
             else:
                 self._run_one_file(engine_settings.input_file, engine_settings.input_file + engine_settings.suffix)
 
+        if self.result_cache is not None:
+            self.result_cache.prune()
+        if self.journal is not None:
+            self.journal.close()
+        if self.timings_log is not None:
+            self.timings_log.close()
+        if self.profiler is not None:
+            self._write_profile()
+        if self.memory_tracer is not None:
+            self._write_memory_report()
+
+        self._write_stats()
+
+    @staticmethod
+    def _write_stats():
+        """
+        Log the statistics of all files, and write them into the stat file (replacing its content),
+        and into the stats dump (see --stats-json) if needed.
+
+        :return: None
+        """
         logging.warning(stats.total_str())
+        engine_settings.stat_fileobj.seek(0)
+        engine_settings.stat_fileobj.truncate()
         stats.optimization_dict_write_stat_file()
+        if engine_settings.stats_dump_file is not None:
+            try:
+                stats.write_dump(engine_settings.stats_dump_file)
+            except OSError as e:
+                logging.error('Cannot write the stats dump "{0}": {1}'.format(engine_settings.stats_dump_file, e))
 
-    @staticmethod
-    def _run_one_file(input_file: str, output_file: str):
+    def _write_profile(self):
+        """
+        Write the aggregated profile of all files (see --profile).
+        Nothing is written if no file is profiled, since pstats cannot read an empty profile.
+
+        :return: None
+        """
+        if self.profiler.profiled_files == 0:
+            logging.warning('No file is profiled, the profile "{0}" is not written.'.format(
+                engine_settings.profile_file))
+            return
+        try:
+            self.profiler.write(engine_settings.profile_file)
+        except OSError as e:
+            logging.error('Cannot write the profile "{0}": {1}'.format(engine_settings.profile_file, e))
+            return
+        logging.info('Profiled {0} files - {1}'.format(self.profiler.profiled_files, engine_settings.profile_file))
+
+    def _write_memory_report(self):
+        """
+        Write the memory report of all files (see --memtrace), and stop tracing the memory.
+
+        :return: None
+        """
+        self.memory_tracer.stop_tracing()
+        try:
+            self.memory_tracer.write_report(engine_settings.memtrace_file)
+        except OSError as e:
+            logging.error('Cannot write the memory report "{0}": {1}'.format(engine_settings.memtrace_file, e))
+            return
+        logging.info('{0} - {1}'.format(self.memory_tracer.peaks_str(), engine_settings.memtrace_file))
+
+    def _run_one_file(self, input_file: str, output_file: str):
         """
-        Process one dockerfile, and execute the pipeline.
+        Process one dockerfile, and execute the pipeline (see _process_one_file()).
 
         :param input_file: the path of the dockerfile to be optimized.
         :param output_file: the path of the result to be saved.
-        :return: None
+        :return: (outcome, stat_tuple). outcome is the outcome of this file (Stats.SUCCESSFUL, Stats.UNCHANGED
+                or Stats.FAILED), or None when the file cannot be opened. stat_tuple is the statistics
+                tuple of this file (Stats.one_file_tuple()).
         """
+        start_time = time.perf_counter()
         try:
             f_in = open(file=input_file, mode='rb')
-            f_out = open(file=output_file, mode='wb')
-
-            # TODO: Add build-args support
-            dockerfile_in = DockerfileParser(fileobj=f_in)
-            dockerfile_out = DockerfileParser(fileobj=f_out)
+            if engine_settings.dedup_link and os.path.lexists(output_file):
+                os.remove(output_file)     # It may be hard-linked to other outputs by a previous run
+            f_out = open(file=output_file, mode='w+b')     # Read back when the result is stored into the cache
         except Exception as e:  # Including: IOError
             logging.error(e)
-            return
+            return None, stats.one_file_tuple()
+
+        with f_in, f_out:
+            return self._process_one_file(input_file, output_file, f_in, f_out, start_time,
+                                          journal_path=os.path.abspath(input_file))
 
-        valid_dockerfile = True
+    def _process_one_file(self, input_file: str, output_file: str, f_in, f_out, start_time: float,
+                          journal_path: str):
+        """
+        Execute the pipeline for one opened dockerfile, together with the bookkeeping of every file:
+        the result cache, the statistics, the journal, the memory tracer and the timings.
+        If the result of the same input is inside the result cache, the cached output is written
+        and the statistics are restored without executing the pipeline. Files skipped by the pre-filter
+        (see _prefilter()) are neither looked up nor stored in the result cache.
+
+        :param input_file: the path of the dockerfile to be optimized, or the name of an archive member.
+        :param output_file: the path of the result to be saved, or the name of an archive member.
+        :param f_in: the opened input file (binary mode), or an in-memory file such as io.BytesIO.
+        :param f_out: the opened output file (binary mode, readable), or an in-memory file.
+        :param start_time: the time when the file is started (time.perf_counter()).
+        :param journal_path: the path recorded into the journal.
+        :return: (outcome, stat_tuple), see _run_one_file().
+        """
+        if self.timer is not None:
+            self.timer.start()
+
+        cache_key = None
+        outcome = None
+        try:
+            may_optimize = not engine_settings.prefilter or Engine._prefilter(f_in)
+            if self.result_cache is not None and may_optimize:
+                cache_key = self.result_cache.get_key(f_in.read())
+                f_in.seek(0)
+                cached_result = self.result_cache.load(cache_key, f_out)
+                if cached_result is not None:
+                    outcome, stat_tuple = cached_result
+                    cache_key = None    # No need to store it again
+                    self._restore_one_file(input_file, outcome, stat_tuple)
+                    logging.info("Cached - {0} - {1}".format(input_file, outcome))
+
+            if outcome is None and self.profiler is not None:
+                outcome = self.profiler.call(self._optimize_one_file, input_file, output_file, f_in, f_out,
+                                             may_optimize)
+            elif outcome is None:
+                outcome = self._optimize_one_file(input_file, output_file, f_in, f_out, may_optimize)
+
+        finally:
+            stat_tuple = stats.one_file_tuple()
+            if cache_key is not None and outcome is not None:
+                f_out.seek(0)
+                self.result_cache.store(cache_key, f_out, outcome, stat_tuple)
+
+            if engine_settings.show_stats:
+                logging.info(stats.one_file_str())
+
+            stats.finished_one_file(input_file)
+
+            duration = time.perf_counter() - start_time
+            if self.journal is not None and outcome is not None:
+                self.journal.record(journal_path, outcome, stat_tuple, duration)
+            if self.memory_tracer is not None and outcome is not None:
+                self.memory_tracer.finish(input_file)
+            elif self.memory_tracer is not None:    # Interrupted by an exception
+                self.memory_tracer.reset()
+            if self.timings_log is not None and outcome is not None:
+                self._record_timings(input_file, outcome, duration)
+
+        return outcome, stat_tuple
+
+    def _restore_journal(self):
+        """
+        Restore the statistics and the failure records of the files finished by a previous run from the journal,
+        and remember them to skip them in this run.
+
+        :return: None
+        """
+        input_path = os.path.abspath(engine_settings.input_file)
+        records = self.journal.load()
+        for path, (outcome, stat_tuple, _) in records.items():
+            # The journal records absolute paths, the statistics and the failure records use the paths
+            # as this run walks them, so they are the same whatever the working directory of the previous run is
+            path = os.path.abspath(path)
+            if path == input_path:
+                input_file = engine_settings.input_file
+            elif path.startswith(os.path.join(input_path, '')):
+                input_file = os.path.join(engine_settings.input_file, os.path.relpath(path, input_path))
+            else:
+                input_file = path
+            self._restore_one_file(input_file, outcome, stat_tuple)
+            stats.finished_one_file(input_file)
+            self.journaled_files[path] = (outcome, stat_tuple)
+        logging.info("Resumed {0} files from the journal \"{1}\".".format(len(records), self.journal.path))
+
+    def _is_journaled(self, input_file: str) -> bool:
+        return os.path.abspath(input_file) in self.journaled_files
+
+    @staticmethod
+    def _restore_one_file(input_file: str, outcome: str, stat_tuple: tuple):
+        """
+        Restore the statistics and the failure record of a file whose result was not computed by the pipeline,
+        such as a result from the result cache.
+
+        :param input_file: the path of the dockerfile.
+        :param outcome: the outcome of the file.
+        :param stat_tuple: the statistics tuple of the file.
+        :return: None
+        """
+        stats.restore_one_file(stat_tuple, outcome)
+        if outcome == Stats.FAILED:
+            engine_settings.fail_fileobj.write(input_file + '\n')
+
+    def optimize_content(self, content: bytes, name: str = '<memory>'):
+        """
+        Process the content of one dockerfile in memory, and execute the pipeline.
+        The statistics are accounted as _run_one_file(), but the result cache is not used.
+
+        :param content: the bytes of the dockerfile to be optimized.
+        :param name: the name of the dockerfile, used in logs and statistics.
+        :return: (output, outcome, stat_tuple). output is the bytes of the result,
+                outcome and stat_tuple are the same as _run_one_file().
+        """
+        f_out = io.BytesIO()
+        outcome = None
+        if self.timer is not None:
+            self.timer.start()
+        try:
+            outcome = self._optimize_one_file(name, name, io.BytesIO(content), f_out)
+        finally:
+            if self.memory_tracer is not None:  # The memory of a single content is not reported
+                self.memory_tracer.reset()
+            stat_tuple = stats.one_file_tuple()
+            if engine_settings.show_stats:
+                logging.info(stats.one_file_str())
+            stats.finished_one_file(name)
+        return f_out.getvalue(), outcome, stat_tuple
+
+    def _record_timings(self, input_file: str, outcome: str, duration: float):
+        """
+        Record the duration of a file into the statistics, and its durations of every phase (see PhaseTimer)
+        into the timings file as a JSON line: {"path": ..., "outcome": ..., "duration": ..., "parse": ..., ...}.
+        The phases of a file which doesn't go through the pipeline (such as a cached file) are 0.
+        With --memtrace, the peak memory of the file in bytes is added as "peak_memory".
+
+        :param input_file: the path of the dockerfile.
+        :param outcome: the outcome of the file.
+        :param duration: the time to process the file, in seconds.
+        :return: None
+        """
+        stats.timed_one_file(input_file, duration)
+        record = {'path': input_file, 'outcome': outcome, 'duration': round(duration, 6)}
+        for phase, phase_duration in self.timer.durations.items():
+            record[phase] = round(phase_duration, 6)
+        if self.memory_tracer is not None:
+            record['peak_memory'] = self.memory_tracer.file_peak
+        self.timings_log.append(record)
+
+    def _optimize_one_file(self, input_file: str, output_file: str, f_in, f_out, may_optimize: bool = None):
+        """
+        Execute the pipeline for one dockerfile. The phases are measured by self.timer if it's set,
+        which should be started by the caller.
+
+        :param input_file: the path of the dockerfile to be optimized.
+        :param output_file: the path of the result to be saved.
+        :param f_in: the opened input file (binary mode), or an in-memory file such as io.BytesIO.
+        :param f_out: the opened output file (binary mode), or an in-memory file.
+        :param may_optimize: the result of the pre-filter (see _prefilter()) if the caller has run it,
+                or None to run it here.
+        :return: the outcome of this file (Stats.SUCCESSFUL, Stats.UNCHANGED or Stats.FAILED).
+        """
+        if may_optimize is None:
+            may_optimize = not engine_settings.prefilter or Engine._prefilter(f_in)
+        if not may_optimize:
+            # No package manager command, skip the pipeline
+            stats.unchanged_one_file()
+            logging.info("Unchanged - {0} - Nothing can be optimized.".format(input_file))
+            shutil.copyfileobj(f_in, f_out)
+            return Stats.UNCHANGED
+
+        # TODO: Add build-args support
+        dockerfile_in = DockerfileReader(fileobj=f_in)
 
         try:
             logging.info("Optimizing - {0}".format(input_file))
 
-            splitter = StageSplitter(dockerfile=dockerfile_in)
-            stages = splitter.get_stages()  # list of (instructions, contexts)
-            if len(stages) == 0:
-                logging.error("Unchanged - {0} - No stage was found! Is it correct?".format(input_file))
-                valid_dockerfile = False
-
-            if len(stages[0][0]) == 0:
-                logging.info("Unchanged - {0} - Encountered an empty file.".format(input_file))
-                valid_dockerfile = False
-
-            global_optimizer = GlobalOptimizer()
-            if valid_dockerfile:
-                if not global_optimizer.optimizable(stages):
-                    logging.error("Unchanged - {0} - A non-official frontend was used, I cannot handle this."
-                                  .format(input_file))
-                    valid_dockerfile = False
-
-            if valid_dockerfile:
-                new_stages_lines = []
-                something_can_be_optimized = False
-                for stage in stages:  # stage is (instructions, contexts)
-                    _simulator = StageSimulator(stage)
-                    _simulator.simulate()
-                    _optimizer = StageOptimizer(stage, dockerfile_in.lines)
-                    strategies = _simulator.get_optimization_strategies()
-
-                    add_cache_strategies = len([s for s in strategies if isinstance(s, AddCacheStrategy)])
-                    if add_cache_strategies > 0:
-                        something_can_be_optimized = True
-                        new_stage_lines = _optimizer.optimize(strategies)
-                    else:
-                        new_stage_lines = _optimizer.optimize([])
-
-                    if stage is not stages[-1]:
-                        new_stage_lines.append('\n\n')
-
-                    new_stages_lines.append(new_stage_lines)
-
-                if something_can_be_optimized:
-                    global_optimizer.optimize(stages, new_stages_lines)
-                    writer = DockerfileWriter(dockerfile_out)
-                    writer.write(new_stages_lines)
-                    stats.successful_one_file()
-                    logging.info("Successful - {0} - {1}".format(input_file, output_file))
-                else:
-                    # just copy output from input
-                    stats.unchanged_one_file()
-                    logging.info("Unchanged - {0} - Nothing can be optimized.".format(input_file))
-                    f_out.write(f_in.read())
+            optimizer = DockerfileOptimizer(PipelineContext.create(settings=engine_settings, stats=stats,
+                                                                   timer=self.timer))
+            new_stages_lines, _, reason = optimizer.optimize(dockerfile_in)
+            if new_stages_lines is not None:
+                writer = DockerfileWriter(f_out)
+                writer.write(new_stages_lines)
+                if self.timer is not None:
+                    self.timer.lap('write')
+                stats.successful_one_file()
+                logging.info("Successful - {0} - {1}".format(input_file, output_file))
+                return Stats.SUCCESSFUL
+
+            stats.unchanged_one_file()
+            if reason == DockerfileOptimizer.NOTHING_TO_OPTIMIZE:
+                # just copy output from input
+                logging.info("Unchanged - {0} - {1}".format(input_file, reason))
+                f_out.write(f_in.read())
+            elif reason == DockerfileOptimizer.EMPTY_FILE:
+                logging.info("Unchanged - {0} - {1}".format(input_file, reason))
             else:
-                stats.unchanged_one_file()
+                logging.error("Unchanged - {0} - {1}".format(input_file, reason))
+            return Stats.UNCHANGED
 
         except handle_error.HandleError as e:  # An error occurred when optimizing this dockerfile
             # just copy output from input
@@ -187,15 +456,163 @@ class Engine(object):
             logging.warning(
                 "Unchanged - {0} - The input file is copied.".format(input_file, output_file))
             engine_settings.fail_fileobj.write(input_file + '\n')
+            return Stats.FAILED
 
+    @staticmethod
+    def _prefilter(f_in) -> bool:
+        """
+        Search the raw bytes of the input file for package manager executables
+        (see optimization_config.build_prefilter_re()). Large files are mapped into memory instead of read.
+
+        :param f_in: the opened input file (binary mode), or an in-memory file such as io.BytesIO.
+                The position is reset to the start.
+        :return: True if the file may be optimized, or False if nothing can be optimized.
+        """
+        prefilter_re = optimization_config.global_opt_settings.prefilter_re
+        try:
+            if isinstance(f_in, io.BytesIO):
+                content = f_in.getbuffer()
+                try:
+                    return len(content) == 0 or prefilter_re.search(content) is not None
+                finally:
+                    content.release()
+            size = os.fstat(f_in.fileno()).st_size
+            if size == 0:   # Reported as an empty file by the pipeline
+                return True
+            if size >= _PREFILTER_MMAP_SIZE:
+                with mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ) as content:
+                    return prefilter_re.search(content) is not None
+            f_in.seek(0)
+            return prefilter_re.search(f_in.read()) is not None
+        except (OSError, ValueError, io.UnsupportedOperation):    # Not a regular file, let the pipeline decide
+            return True
         finally:
-            f_in.close()
-            f_out.close()
+            f_in.seek(0)
 
-            if engine_settings.show_stats:
-                logging.info(stats.one_file_str())
+    def _optimize_archive(self):
+        """
+        Process the candidate dockerfiles inside the input archive (see archive_util.iter_archive_members()),
+        and write the results into the output archive, INPUT with the suffix inserted by default
+        (see archive_util.archive_output_path()).
+        The members are streamed through the pipeline one by one without being extracted to disk, and the members
+        which are not optimized are copied from the input as they are. The other members (not matching the globs,
+        too large, binary or in another shard) are copied as well, without being read into memory if possible.
+        The logs, the statistics and the failure file use the names of the members.
 
-            stats.finished_one_file(input_file)
+        :return: None
+        """
+        import tarfile  # Imported lazily with util.archive_util, they are only needed by archive runs
+        import zipfile
+        from util import archive_util
+
+        output_file = engine_settings.output_file
+        if output_file is None:
+            output_file = archive_util.archive_output_path(engine_settings.input_file, engine_settings.suffix)
+        self._create_output_directory(os.path.dirname(output_file))
+
+        writer = archive_util.ArchiveWriter(output_file)
+        try:
+            for member, content, output in self._optimize_members(self._read_archive_members()):
+                if content is None:
+                    writer.copy(member)
+                else:
+                    writer.add(member, content if output is None else output)
+        except (OSError, EOFError, tarfile.TarError, zipfile.BadZipFile) as e:
+            writer.abort()
+            logging.error('Cannot read the archive "{0}": {1}'.format(engine_settings.input_file, e))
+            sys.exit(-1)
+        except BaseException:
+            writer.abort()
+            raise
+        writer.close()
+
+    @staticmethod
+    def _read_archive_members():
+        """
+        Read the members of the input archive. The candidate dockerfiles are read, and the other members
+        are marked with member.candidate = False.
+
+        :return: a generator of (member, content) of every member (see archive_util.iter_archive_members()),
+                content is None if the member is not read yet.
+        """
+        from util import archive_util
+
+        for member in archive_util.iter_archive_members(path=engine_settings.input_file,
+                                                        include_globs=engine_settings.include_globs,
+                                                        exclude_globs=file_util.DEFAULT_EXCLUDE_GLOBS
+                                                        + engine_settings.exclude_globs,
+                                                        max_size=engine_settings.max_file_size):
+            if member.candidate and not file_util.in_shard(member.name, engine_settings.shard):
+                member.candidate = False
+            if not member.candidate:
+                yield member, None
+                continue
+            content = member.read()
+            member.candidate = archive_util.is_candidate_member(member, content)
+            yield member, content
+
+    def _optimize_members(self, members):
+        """
+        Process the candidate members of the input archive. If engine_settings.jobs > 1, the members will be
+        distributed to a pool of worker processes.
+
+        :param members: an iterable of (member, content), see _read_archive_members().
+        :return: a generator of (member, content, output) of every member (see _run_one_member()),
+                output is None if the member is not a candidate. The candidates are in the order of members.
+        """
+        if engine_settings.jobs > 1:
+            yield from self._optimize_members_parallel(members)
+        else:
+            for member, content in members:
+                if member.candidate:
+                    output, _, _ = self._run_one_member(member.name, content)
+                    yield member, content, output
+                else:
+                    yield member, content, None
+
+    def _run_one_member(self, name: str, content: bytes):
+        """
+        Process one member of the input archive in memory, and execute the pipeline (see _process_one_file()).
+
+        :param name: the name of the member.
+        :param content: the content of the member.
+        :return: (output, outcome, stat_tuple). output is the bytes of the result, or None if the member is not
+                optimized, then it should be copied from the input. outcome and stat_tuple are the same as
+                _run_one_file().
+        """
+        start_time = time.perf_counter()
+        f_out = io.BytesIO()
+        outcome, stat_tuple = self._process_one_file(name, name, io.BytesIO(content), f_out, start_time,
+                                                     journal_path=name)
+        output = f_out.getvalue() if outcome == Stats.SUCCESSFUL else None
+        return output, outcome, stat_tuple
+
+    def _optimize_members_parallel(self, members):
+        """
+        Process the candidate members of the input archive with a pool of engine_settings.jobs worker processes,
+        see _optimize_files_parallel(). Only a few candidates per worker are read ahead, so the archive
+        is still streamed: the other members are yielded at once, before the pending candidates.
+
+        :param members: an iterable of (member, content), see _read_archive_members().
+        :return: a generator of (member, content, output) of every member, see _optimize_members().
+        """
+        def finish(pending_member):
+            member, content, async_result = pending_member
+            file_stats, failures, profile, memory_records, (output, _, _) = async_result.get()
+            self._merge_worker_results(file_stats, failures, profile, memory_records)
+            return member, content, output
+
+        with _create_worker_pool(self.result_cache) as pool:
+            pending = collections.deque()
+            for member, content in members:
+                if not member.candidate:
+                    yield member, content, None
+                    continue
+                pending.append((member, content, pool.apply_async(_run_member_in_worker, (member.name, content))))
+                if len(pending) >= _ARCHIVE_PENDING_PER_JOB * engine_settings.jobs:
+                    yield finish(pending.popleft())
+            while len(pending) > 0:
+                yield finish(pending.popleft())
 
     def _optimize_directory(self):
         """
@@ -204,24 +621,314 @@ class Engine(object):
 
         :return: None
         """
-        input_dir = engine_settings.input_file
-        output_dir = engine_settings.output_file
-        for current_dir, dirs, files in os.walk(input_dir):
-            for f in files:
-                input_file = os.path.join(current_dir, f)
-                if output_dir is None:
-                    output_file = input_file + engine_settings.suffix
-                else:
-                    output_file = os.path.join(output_dir,
-                                               os.path.relpath(input_file, input_dir))
+        tasks = self._walk_input_directory()
+        if engine_settings.dedup:
+            self._optimize_files_dedup(list(tasks))
+        else:
+            for _ in self._optimize_files(tasks):
+                pass
+
+    def _optimize_files(self, tasks):
+        """
+        Process the files. If engine_settings.jobs > 1, the files will be distributed to a pool of worker processes.
+
+        :param tasks: an iterable of (input_file, output_file).
+        :return: a generator of (outcome, stat_tuple) of every file (see _run_one_file()), in the order of tasks.
+        """
+        if engine_settings.jobs > 1:
+            yield from self._optimize_files_parallel(tasks)
+        else:
+            for input_file, output_file in tasks:
+                yield self._run_one_file(input_file=input_file, output_file=output_file)
+
+    def _optimize_files_dedup(self, tasks: list):
+        """
+        Process the files, but optimize the duplicated files only once.
+
+        Files are grouped by the hash of their normalized content (see _dedup_key()), and only the first file
+        of every group (the representative) is optimized. The statistics of the other files of the group are
+        restored from the representative, and their outputs are:
+
+        -   The output of the representative, copied (or hard-linked, when engine_settings.dedup_link is set),
+            if the file is byte-identical to the representative.
+        -   A copy of the file itself, if it differs from the representative (such as in line endings)
+            and the representative is not optimized, and its output is a copy of its input.
+        -   Or else, the file is optimized by itself.
+
+        The files are still reported in the order of tasks, so the outputs, the statistics and the failure file
+        are the same as optimizing every file.
+
+        :param tasks: a list of (input_file, output_file).
+        :return: None
+        """
+        keys = []           # (normalized hash, content hash) of every task, see _dedup_key()
+        representatives = {}    # Key: normalized hash; Value: the index of the representative task
+        for index, (input_file, _) in enumerate(tasks):
+            keys.append(self._dedup_key(input_file))
+            if keys[index] is not None:
+                representatives.setdefault(keys[index][0], index)
+
+        def is_representative(i: int) -> bool:
+            return keys[i] is None or representatives[keys[i][0]] == i
+
+        results = self._optimize_files(task for index, task in enumerate(tasks) if is_representative(index))
+        representative_results = {}     # Key: the index of the representative task; Value: (outcome, stat_tuple)
+        for index, (input_file, output_file) in enumerate(tasks):
+            if is_representative(index):
+                representative_results[index] = next(results)
+                continue
+
+            start_time = time.perf_counter()
+            representative_index = representatives[keys[index][0]]
+            outcome, stat_tuple = representative_results[representative_index]
+            representative_input_file, representative_output_file = tasks[representative_index]
+            if outcome is None:
+                copied = False
+            elif keys[index][1] == keys[representative_index][1]:   # Byte-identical
+                copied = self._copy_output(representative_output_file, output_file)
+            elif outcome != Stats.SUCCESSFUL and \
+                    filecmp.cmp(representative_input_file, representative_output_file, shallow=False):
+                copied = self._copy_output(input_file, output_file, link=False)
+            else:
+                copied = False
+            if not copied:
                 self._run_one_file(input_file=input_file, output_file=output_file)
-            if output_dir is not None:
-                for d in dirs:
-                    input_sub_dir = os.path.join(current_dir, d)
-                    output_sub_dir = os.path.join(output_dir,
-                                                  os.path.relpath(input_sub_dir, input_dir))
-                    if not os.path.exists(output_sub_dir):
-                        os.mkdir(output_sub_dir)
+                continue
+            self._restore_one_file(input_file, outcome, stat_tuple)
+            logging.info("Duplicated - {0} - The same as {1}".format(input_file, representative_input_file))
+            stats.finished_one_file(input_file)
+            if self.journal is not None:
+                self.journal.record(os.path.abspath(input_file), outcome, stat_tuple,
+                                    time.perf_counter() - start_time)
+
+        for _ in results:   # Finish the worker processes
+            pass
+
+    @staticmethod
+    def _dedup_key(input_file: str):
+        """
+        Get the hash of the normalized content of the file: line endings are converted to "\\n",
+        and the whitespaces at the end of every line and the empty lines at the end of the file are removed.
+
+        :param input_file: the path of the dockerfile.
+        :return: (normalized hash, content hash), the content hash is the hash of the raw content.
+                None when the file cannot be read.
+        """
+        try:
+            with open(file=input_file, mode='rb') as f:
+                content = f.read()
+        except OSError:     # Reported when the file is optimized
+            return None
+        lines = content.replace(b'\r\n', b'\n').split(b'\n')
+        return hashlib.sha256(b'\n'.join(line.rstrip() for line in lines).rstrip(b'\n')).digest(), \
+            hashlib.sha256(content).digest()
+
+    @staticmethod
+    def _copy_output(source_file: str, output_file: str, link: bool = True) -> bool:
+        """
+        Copy source_file (such as the output of a representative file) to output_file,
+        or make a hard link when engine_settings.dedup_link is set.
+
+        :param source_file: the file to be copied.
+        :param output_file: the output file to be created.
+        :param link: False to always copy the file, such as when source_file is an input file.
+        :return: True when succeeded, or else False.
+        """
+        try:
+            # The output may be a hard link made by a previous run, which must not be written through
+            if os.path.lexists(output_file):
+                os.remove(output_file)
+            if engine_settings.dedup_link and link:
+                try:
+                    os.link(source_file, output_file)
+                    return True
+                except OSError:     # For example, hard links are not supported, then just copy the file
+                    pass
+            shutil.copyfile(source_file, output_file)
+        except OSError as e:
+            logging.error(e)
+            return False
+        return True
+
+    def _walk_input_directory(self):
+        """
+        Walk the input directory for the candidate dockerfiles (see file_util.walk_dockerfiles()),
+        and create the output sub-directories lazily, before their first output file is yielded.
+        The files finished by a previous run (see --resume) are skipped.
+
+        :return: a generator of (input_file, output_file).
+        """
+        created_dirs = set()
+        for input_file in file_util.walk_dockerfiles(input_dir=engine_settings.input_file,
+                                                     include_globs=engine_settings.include_globs,
+                                                     exclude_globs=self._get_exclude_globs(),
+                                                     max_size=engine_settings.max_file_size):
+            if self._is_journaled(input_file) or not self._in_shard(input_file):
+                continue
+            yield input_file, self._get_output_file(input_file, created_dirs)
+
+    @staticmethod
+    def _in_shard(input_file: str) -> bool:
+        """
+        Check if a file inside the input directory belongs to the shard of this run (see --shard).
+
+        :param input_file: the path of the file.
+        :return: True if the file belongs to the shard, or else False.
+        """
+        if engine_settings.shard is None:
+            return True
+        return file_util.in_shard(os.path.relpath(input_file, engine_settings.input_file), engine_settings.shard)
+
+    @staticmethod
+    def _get_exclude_globs() -> list:
+        exclude_globs = file_util.DEFAULT_EXCLUDE_GLOBS + engine_settings.exclude_globs
+        if engine_settings.output_file is None:
+            # Don't optimize the outputs of previous runs
+            exclude_globs = exclude_globs + ['*' + glob.escape(engine_settings.suffix)]
+        return exclude_globs
+
+    @staticmethod
+    def _get_output_file(input_file: str, created_dirs: set) -> str:
+        """
+        Get the output path of a file inside the input directory, and create its directory if needed.
+
+        :param input_file: the path of the input file.
+        :param created_dirs: the output directories created before, which is updated by this.
+        :return: the output path.
+        """
+        if engine_settings.output_file is None:
+            return input_file + engine_settings.suffix
+        output_file = os.path.join(engine_settings.output_file,
+                                   os.path.relpath(input_file, engine_settings.input_file))
+        output_sub_dir = os.path.dirname(output_file)
+        if output_sub_dir not in created_dirs:
+            os.makedirs(output_sub_dir, exist_ok=True)
+            created_dirs.add(output_sub_dir)
+        return output_file
+
+    def _watch_directory(self):
+        """
+        Process the dockerfiles inside the input directory, and then watch the directory until interrupted:
+        the files added or modified are processed again, and the outputs of the deleted files are removed.
+        The directory is polled every engine_settings.watch_interval seconds, comparing the mtime and size
+        of every file. The statistics of a file are subtracted before it's processed again or deleted,
+        and the stat file and the failure file are rewritten after every change.
+
+        :return: None
+        """
+        watched_files = {}  # Key: input_file; Value: (file_key, output_file, outcome, stat_tuple)
+        self._poll_input_directory(watched_files)
+        self._write_stats()
+        self._write_failures(watched_files)
+        logging.warning('Watching "{0}" for changes, press Ctrl+C to stop.'.format(engine_settings.input_file))
+        try:
+            while True:
+                time.sleep(engine_settings.watch_interval)
+                if self._poll_input_directory(watched_files):
+                    self._write_stats()
+                    self._write_failures(watched_files)
+        except KeyboardInterrupt:
+            logging.info('Stopped watching.')
+
+    def _poll_input_directory(self, watched_files: dict) -> bool:
+        """
+        Process the files inside the input directory which are not in watched_files, or have been modified,
+        and forget the files which have been deleted.
+
+        :param watched_files: the files processed before, which is updated by this.
+                Key: input_file; Value: (file_key, output_file, outcome, stat_tuple).
+                file_key is (mtime, size) of the input file when it was processed.
+        :return: True if any file is changed, or else False.
+        """
+        created_dirs = set()
+        tasks = []
+        file_keys = {}
+        for entry in file_util.walk_dockerfile_entries(input_dir=engine_settings.input_file,
+                                                       include_globs=engine_settings.include_globs,
+                                                       exclude_globs=self._get_exclude_globs()):
+            try:
+                entry_stat = entry.stat()
+            except OSError:     # Deleted after being listed
+                continue
+            if not self._in_shard(entry.path):
+                continue
+            file_key = (entry_stat.st_mtime_ns, entry_stat.st_size)
+            file_keys[entry.path] = file_key
+            watched_file = watched_files.get(entry.path)
+            if watched_file is not None and watched_file[0] == file_key:
+                continue
+            if not file_util.is_candidate_file(entry, engine_settings.max_file_size):
+                del file_keys[entry.path]
+                continue
+
+            output_file = self._get_output_file(entry.path, created_dirs)
+            if watched_file is not None:    # Modified
+                stats.forget_one_file(entry.path, watched_file[3], watched_file[2])
+            else:
+                journaled = self.journaled_files.pop(os.path.abspath(entry.path), None)
+                if journaled is not None:   # Finished by a previous run, see --resume
+                    watched_files[entry.path] = (file_key, output_file) + journaled
+                    continue
+            tasks.append((entry.path, output_file))
+
+        changed = len(tasks) > 0
+        for input_file in [input_file for input_file in watched_files if input_file not in file_keys]:
+            _, output_file, outcome, stat_tuple = watched_files.pop(input_file)
+            stats.forget_one_file(input_file, stat_tuple, outcome)
+            if os.path.exists(output_file):
+                os.remove(output_file)
+            logging.info("Deleted - {0} - {1} is removed.".format(input_file, output_file))
+            changed = True
+
+        for (input_file, output_file), (outcome, stat_tuple) in zip(tasks, self._optimize_files(tasks)):
+            watched_files[input_file] = (file_keys[input_file], output_file, outcome, stat_tuple)
+        return changed
+
+    @staticmethod
+    def _write_failures(watched_files: dict):
+        """
+        Rewrite the failure file with the failed files being watched.
+
+        :param watched_files: see _poll_input_directory().
+        :return: None
+        """
+        engine_settings.fail_fileobj.seek(0)
+        engine_settings.fail_fileobj.truncate()
+        engine_settings.fail_fileobj.writelines(input_file + '\n' for input_file, (_, _, outcome, _)
+                                                in watched_files.items() if outcome == Stats.FAILED)
+        engine_settings.fail_fileobj.flush()
+
+    def _optimize_files_parallel(self, tasks):
+        """
+        Process the files with a pool of engine_settings.jobs worker processes.
+        Every worker keeps its own stats, which are merged into the stats of this process
+        in the order of tasks, so the statistics and the failure file are the same as a serial run.
+
+        :param tasks: an iterable of (input_file, output_file).
+        :return: a generator of (outcome, stat_tuple) of every file, in the order of tasks.
+        """
+        with _create_worker_pool(self.result_cache) as pool:
+            for file_stats, failures, profile, memory_records, result in pool.imap(_run_one_file_in_worker, tasks,
+                                                                                   chunksize=_WORKER_CHUNK_SIZE):
+                self._merge_worker_results(file_stats, failures, profile, memory_records)
+                yield result
+
+    def _merge_worker_results(self, file_stats, failures: str, profile, memory_records):
+        """
+        Merge the results of a file processed by a worker process into this process.
+
+        :param file_stats: the statistics of the file.
+        :param failures: the content the file adds to the failure file.
+        :param profile: the profile of the file, or None without --profile.
+        :param memory_records: the memory records of the file, or None without --memtrace.
+        :return: None
+        """
+        stats.merge(file_stats)
+        engine_settings.fail_fileobj.write(failures)
+        if profile is not None:
+            self.profiler.merge(profile)
+        if memory_records is not None:
+            self.memory_tracer.merge(memory_records)
 
     def _create_output_directory(self, output_dir):
         """
@@ -234,3 +941,150 @@ class Engine(object):
         else:
             self._create_output_directory(os.path.dirname(output_dir))
             os.mkdir(output_dir)
+
+
+_WORKER_CHUNK_SIZE = 16     # Number of files sent to a worker process at once
+_ARCHIVE_PENDING_PER_JOB = 4    # Number of archive members read ahead per worker process
+_PREFILTER_MMAP_SIZE = 1024 * 1024  # Input files at least this size are mapped into memory by the pre-filter
+_worker_engine: Engine      # The engine of a worker process, created by _init_worker()
+
+
+def _result_cache_salt() -> bytes:
+    """
+    Get the salt of the result cache keys. Cached results are invalidated when any of these changes:
+    -   The loaded settings (settings.yaml).
+    -   The engine settings which change the output.
+    -   The source code of this tool.
+
+    :return: the salt.
+    """
+    salt = hashlib.sha256()
+    salt.update(optimization_config.settings_digest.encode('utf-8'))
+    salt.update(repr(engine_settings.remove_command_with_true).encode('utf-8'))
+    salt.update(repr(engine_settings.prefilter).encode('utf-8'))
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    for current_dir, dirs, files in os.walk(src_dir):
+        dirs.sort()
+        for f in sorted(files):
+            if f.endswith('.py'):
+                file_stat = os.stat(os.path.join(current_dir, f))
+                salt.update('{0}:{1}:{2}\n'.format(os.path.relpath(os.path.join(current_dir, f), src_dir),
+                                                   file_stat.st_size, file_stat.st_mtime_ns).encode('utf-8'))
+    return salt.digest()
+
+
+def _create_worker_pool(result_cache: ResultCache):
+    """
+    Create a pool of engine_settings.jobs worker processes, initialized by _init_worker().
+
+    :param result_cache: the result cache of the parent process, or None if the result cache is not used.
+    :return: the multiprocessing.Pool.
+    """
+    import multiprocessing  # Imported lazily, it is only needed by parallel runs
+
+    return multiprocessing.Pool(processes=engine_settings.jobs,
+                                initializer=_init_worker,
+                                initargs=(engine_settings,
+                                          optimization_config.pm_settings,
+                                          optimization_config.pm_executables,
+                                          optimization_config.global_opt_settings,
+                                          optimization_config.settings_digest,
+                                          result_cache.salt if result_cache is not None else None))
+
+
+def _init_worker(settings, pm_settings, pm_executables, global_opt_settings, settings_digest,
+                 result_cache_salt: bytes = None):
+    """
+    Initialize a worker process of Engine._optimize_files_parallel().
+    The settings are sent once per worker process, instead of once per file.
+
+    :param settings: the engine settings of the parent process.
+    :param pm_settings: the loaded PM settings of the parent process.
+    :param pm_executables: the index of PM executables of the parent process.
+    :param global_opt_settings: the loaded global optimization settings of the parent process.
+    :param settings_digest: the digest of the loaded settings of the parent process.
+    :param result_cache_salt: the salt of the result cache keys of the parent process, or None if the result
+            cache is not used.
+    :return: None
+    """
+    global _worker_engine
+    if settings is not engine_settings:
+        vars(engine_settings).update(vars(settings))
+    # The failure file and the stat file are written by the parent process only
+    engine_settings.fail_fileobj = io.StringIO()
+    engine_settings.stat_fileobj = None
+    stats.detach()  # Forked worker processes inherit the statistics of the parent process, such as --resume
+    optimization_config.pm_settings.update(pm_settings)
+    optimization_config.pm_executables.update(pm_executables)
+    optimization_config.global_opt_settings = global_opt_settings
+    optimization_config.settings_digest = settings_digest
+
+    if len(logging.getLogger().handlers) == 0:    # Worker processes are spawned rather than forked
+        args_handler.init_logger()
+
+    if result_cache_salt is None:
+        engine_settings.use_cache = False
+    _worker_engine = Engine(result_cache_salt=result_cache_salt)
+
+
+def _run_one_file_in_worker(task):
+    """
+    Process one dockerfile inside a worker process.
+
+    :param task: (input_file, output_file).
+    :return: (file_stats, failures, profile, memory_records, result).
+            file_stats is a Stats object with the statistics of this file.
+            failures is the content this file adds to the failure file.
+            profile is the profile of this file (see PipelineProfiler.detach()), or None without --profile.
+            memory_records are the memory records of this file (see MemoryTracer.detach()),
+            or None without --memtrace.
+            result is (outcome, stat_tuple) returned by Engine._run_one_file().
+    """
+    input_file, output_file = task
+    result = _worker_engine._run_one_file(input_file=input_file, output_file=output_file)
+    return _detach_worker_results() + (result,)
+
+
+def _run_member_in_worker(name: str, content: bytes):
+    """
+    Process one member of the input archive inside a worker process.
+
+    :param name: the name of the member.
+    :param content: the content of the member.
+    :return: (file_stats, failures, profile, memory_records, result), see _run_one_file_in_worker().
+            result is (output, outcome, stat_tuple) returned by Engine._run_one_member().
+    """
+    result = _worker_engine._run_one_member(name, content)
+    return _detach_worker_results() + (result,)
+
+
+def _detach_worker_results():
+    """
+    Take the statistics, the failure records, the profile and the memory records of the finished file
+    out of the worker process, to send them to the parent process.
+
+    :return: (file_stats, failures, profile, memory_records), see _run_one_file_in_worker().
+    """
+    failures = engine_settings.fail_fileobj.getvalue()
+    engine_settings.fail_fileobj.seek(0)
+    engine_settings.fail_fileobj.truncate()
+    profile = _worker_engine.profiler.detach() if _worker_engine.profiler is not None else None
+    memory_records = _worker_engine.memory_tracer.detach() if _worker_engine.memory_tracer is not None else None
+    return stats.detach(), failures, profile, memory_records
+
+
+def _optimize_content_in_worker(content: bytes, name: str):
+    """
+    Process the content of one dockerfile inside a worker process (see server.OptimizerServer).
+    The statistics and the failure records are not kept in the worker process.
+
+    :param content: the bytes of the dockerfile to be optimized.
+    :param name: the name of the dockerfile.
+    :return: (output, outcome, stat_tuple), see Engine.optimize_content().
+    """
+    try:
+        return _worker_engine.optimize_content(content, name)
+    finally:
+        stats.detach()
+        engine_settings.fail_fileobj.seek(0)
+        engine_settings.fail_fileobj.truncate()
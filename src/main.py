@@ -11,9 +11,26 @@
 import sys
 
 from config import args_handler
-from engine import Engine
+from config.engine_config import engine_settings
 
 if __name__ == '__main__':
-    args_handler.init_by_argv(sys.argv[1:])
-    engine = Engine()
-    engine.run()
+    # The engine is imported after the arguments are handled, so "-h" and illegal arguments return quickly
+    if len(sys.argv) > 1 and sys.argv[1] == 'serve':
+        args_handler.init_serve_by_argv(sys.argv[2:])
+
+        from server import OptimizerServer
+
+        OptimizerServer(socket_path=engine_settings.socket_path, jobs=engine_settings.jobs).run()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'merge-stats':
+        args_handler.init_merge_stats_by_argv(sys.argv[2:])
+
+        from stats_merger import merge_stats_dumps
+
+        merge_stats_dumps(engine_settings.merge_dump_files)
+    else:
+        args_handler.init_by_argv(sys.argv[1:])
+
+        from engine import Engine
+
+        engine = Engine()
+        engine.run()
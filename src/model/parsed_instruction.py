@@ -0,0 +1,31 @@
+class ParsedInstruction:
+    """
+    Describe a parsed RUN instruction, such as "RUN --mount=type=cache,target=/root/.cache apt-get update && \\
+    apt-get install gcc".
+
+    All positions are indices of the instruction content (line continuations are kept), so the optimizer
+    can edit the content in place (see model.span_edit).
+    """
+
+    def __init__(self, content: str, instruction_type: str, type_end: int, body_start: int, options: str,
+                 exec_form: bool, commands: list, connectors: list):
+        """
+        Initialize the parsed instruction.
+
+        :param content: the content of the instruction.
+        :param instruction_type: the type of the instruction as it's written, such as "RUN" or "run".
+        :param type_end: the end index of the instruction type.
+        :param body_start: the start index of the body (options and commands) after the instruction type.
+        :param options: the options string of the instruction, such as "--mount=type=cache,target=/root/.cache".
+        :param exec_form: whether the commands are exec-form, such as '["echo", "3"]'.
+        :param commands: the list of commands (shell_lexer.SimpleCommand), empty when the commands are exec-form.
+        :param connectors: the connectors between commands (shell_lexer.Token), such as '&&'.
+        """
+        self.content = content
+        self.instruction_type = instruction_type
+        self.type_end = type_end
+        self.body_start = body_start
+        self.options = options
+        self.exec_form = exec_form
+        self.commands = commands
+        self.connectors = connectors
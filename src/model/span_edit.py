@@ -0,0 +1,24 @@
+class SpanEdit:
+    """
+    Describe an edit of a string: replace s[start: end] with text.
+    When start == end, this is an insertion before s[start].
+    """
+
+    def __init__(self, start: int, end: int, text: str):
+        """
+        Initialize the span edit.
+
+        :param start: the start index of the span.
+        :param end: the end index (exclusive) of the span.
+        :param text: the new text of the span.
+        """
+        assert 0 <= start <= end
+        self.start = start
+        self.end = end
+        self.text = text
+
+    def is_insertion(self) -> bool:
+        return self.start == self.end
+
+    def __repr__(self):
+        return 'SpanEdit({0}, {1}, {2!r})'.format(self.start, self.end, self.text)
@@ -1,4 +1,12 @@
+import array
+import copy
+import heapq
+import json
+import math
+import os
+
 from config.engine_config import engine_settings
+from util.filename_store import FilenameStore
 
 
 class Stats(object):
@@ -6,6 +14,17 @@ class Stats(object):
     The statistics of the optimization process.
     """
 
+    # Outcomes of a file
+    SUCCESSFUL = 'successful'
+    UNCHANGED = 'unchanged'
+    FAILED = 'failed'
+
+    # Version of the format of to_dump(), increased when the format is changed incompatibly
+    DUMP_VERSION = 1
+
+    # Number of the slowest files in the statistics, see timed_one_file()
+    SLOWEST_FILES_NUM = 10
+
     def __init__(self):
         self.add_cache_num = 0
         self.insert_before_num = 0
@@ -23,7 +42,13 @@ class Stats(object):
         self.total_failed_files = 0
         self.total_unchanged_files = 0
 
-        self.total_optimization_dict = {}
+        # The optimized files grouped by their statistics tuples (one_file_tuple())
+        self.total_optimization_files = FilenameStore()
+
+        # The durations of all files in seconds, and a min-heap of (duration, filename) of the slowest files.
+        # They are only recorded when the files are timed (see --timings)
+        self.total_durations = array.array('d')
+        self.slowest_files = []
 
     def one_file_optimization_num(self):
         return self.add_cache_num + self.insert_before_num \
@@ -35,9 +60,28 @@ class Stats(object):
                + self.total_remove_command_num + self.total_remove_option_num \
                + self.total_syntax_change_num
 
+    def one_file_tuple(self) -> tuple:
+        """
+        Return the statistics of the optimization of one file as a tuple.
+
+        :return: (add_cache_num, insert_before_num, remove_command_num, remove_option_num, syntax_change_num)
+        """
+        return (
+            self.add_cache_num,
+            self.insert_before_num,
+            self.remove_command_num,
+            self.remove_option_num,
+            self.syntax_change_num
+        )
+
     def total_files(self):
         return self.total_successful_files + self.total_failed_files + self.total_unchanged_files
 
+    def success_rate(self) -> float:
+        if self.total_files() == 0:
+            return 0.0
+        return round(self.total_successful_files / self.total_files() * 100, 2)
+
     def one_file_str(self) -> str:
         """
         Return the statistics string of the optimization of one file.
@@ -94,23 +138,45 @@ class Stats(object):
                     self.total_successful_files,
                     self.total_failed_files,
                     self.total_unchanged_files,
-                    round(self.total_successful_files / self.total_files() * 100, 2),
+                    self.success_rate(),
 
                     self.optimization_dict_str()
-                    )
+                    ) + self.durations_str()
+
+    def durations_str(self) -> str:
+        """
+        Return the percentiles of the durations of all files, and the slowest files.
+
+        :return: the statistics string of the durations, or an empty string if no file is timed.
+        """
+        if len(self.total_durations) == 0:
+            return ''
+        durations = sorted(self.total_durations)
+
+        def percentile(p: int) -> float:    # The nearest-rank method
+            return durations[max(math.ceil(p / 100 * len(durations)) - 1, 0)]
+
+        return \
+            ' - Durations of files: p50 {:.2f}ms, p95 {:.2f}ms, p99 {:.2f}ms, max {:.2f}ms\n' \
+            ' - Slowest files:\n' \
+            '{}' \
+            '----------------------------------------------\n' \
+            .format(percentile(50) * 1000, percentile(95) * 1000, percentile(99) * 1000, durations[-1] * 1000,
+                    ''.join('   {:.2f}ms\t{}\n'.format(duration * 1000, filename)
+                            for duration, filename in sorted(self.slowest_files, reverse=True)))
+
+    def sorted_optimization_counts(self) -> list:
+        """
+        :return: a list of (stat_tuple, count) of the optimized files, sorted by count in descending order.
+        """
+        return sorted(self.total_optimization_files.counts().items(), key=lambda x: x[1], reverse=True)
 
     def optimization_dict_str(self) -> str:
-        sorted_dict_items = sorted(self.total_optimization_dict.items(), key=lambda x: len(x[1]), reverse=True)
-        lines = ''
-        for stat_tuple, filenames in sorted_dict_items:
-            count = len(filenames)
-            lines += ' {},\t(Total: {}\t\tAddCache: {}\t\tInsertBefore: {}\t\tRemoveCommand: {}' \
-                     '\tRemoveOption: {}\t\tSyntaxChange: {}) \n'\
-                .format(
-                    count,
-                    sum(stat_tuple), stat_tuple[0], stat_tuple[1], stat_tuple[2], stat_tuple[3], stat_tuple[4]
-                )
-        return lines
+        return ''.join(' {},\t(Total: {}\t\tAddCache: {}\t\tInsertBefore: {}\t\tRemoveCommand: {}'
+                       '\tRemoveOption: {}\t\tSyntaxChange: {}) \n'
+                       .format(count, sum(stat_tuple),
+                               stat_tuple[0], stat_tuple[1], stat_tuple[2], stat_tuple[3], stat_tuple[4])
+                       for stat_tuple, count in self.sorted_optimization_counts())
 
     def optimization_dict_write_stat_file(self):
         s = '\n' \
@@ -140,23 +206,24 @@ class Stats(object):
                     self.total_successful_files,
                     self.total_failed_files,
                     self.total_unchanged_files,
-                    round(self.total_successful_files / self.total_files() * 100, 2),
+                    self.success_rate(),
                     )
         engine_settings.stat_fileobj.writelines(s)
         engine_settings.stat_fileobj.flush()
 
-        sorted_dict_items = sorted(self.total_optimization_dict.items(), key=lambda x: len(x[1]), reverse=True)
-        for stat_tuple, filenames in sorted_dict_items:
-            lines = []
-            count = len(filenames)
-            lines.append(
+        # The filenames are streamed from the store, so the report is never built in memory
+        for stat_tuple, count in self.sorted_optimization_counts():
+            engine_settings.stat_fileobj.write(
                 '{},\t(Total: {}\t\tAddCache: {}\t\tInsertBefore: {}\t\tRemoveCommand: {}'
                 '\tRemoveOption: {}\t\tSyntaxChange: {})\n'.format(
                     count, sum(stat_tuple), stat_tuple[0], stat_tuple[1], stat_tuple[2], stat_tuple[3], stat_tuple[4]
                 ))
-            for filename in filenames:
-                lines.append(filename + '\n')
-            engine_settings.stat_fileobj.writelines(lines)
+            recorded = 0
+            for filename in self.total_optimization_files.filenames(stat_tuple):
+                engine_settings.stat_fileobj.write(filename + '\n')
+                recorded += 1
+            if count > recorded:    # See --stats-max-files
+                engine_settings.stat_fileobj.write('... ({0} more files are not recorded)\n'.format(count - recorded))
             engine_settings.stat_fileobj.flush()
 
     def finished_one_file(self, filename):
@@ -166,17 +233,7 @@ class Stats(object):
         :return:
         """
         if self.add_cache_num > 0:
-            this_file = (
-                self.add_cache_num,
-                self.insert_before_num,
-                self.remove_command_num,
-                self.remove_option_num,
-                self.syntax_change_num
-            )
-            if self.total_optimization_dict.get(this_file):
-                self.total_optimization_dict[this_file].append(filename)
-            else:
-                self.total_optimization_dict[this_file] = [filename]
+            self.total_optimization_files.add(self.one_file_tuple(), filename)
 
         self.add_cache_num = 0
         self.insert_before_num = 0
@@ -184,6 +241,23 @@ class Stats(object):
         self.remove_option_num = 0
         self.syntax_change_num = 0
 
+    def timed_one_file(self, filename, duration: float):
+        """
+        Record the duration of one file.
+
+        :param filename: the filename.
+        :param duration: the time to process the file, in seconds.
+        :return: None
+        """
+        self.total_durations.append(duration)
+        self._push_slowest_file(duration, filename)
+
+    def _push_slowest_file(self, duration: float, filename):
+        if len(self.slowest_files) < Stats.SLOWEST_FILES_NUM:
+            heapq.heappush(self.slowest_files, (duration, filename))
+        elif duration > self.slowest_files[0][0]:
+            heapq.heapreplace(self.slowest_files, (duration, filename))
+
     def clear_total(self):
         """
         Clear the statistics of all files.
@@ -200,6 +274,195 @@ class Stats(object):
         self.total_failed_files = 0
         self.total_unchanged_files = 0
 
+    def merge(self, other):
+        """
+        Merge the statistics of all files inside other into this object.
+        The filenames of other are appended after the existing ones, so merging the statistics
+        in the order the files were processed gives the same result as a serial run.
+
+        :param other: another Stats object, for example the one sent back by a worker process.
+        :return: None
+        """
+        self.total_add_cache_num += other.total_add_cache_num
+        self.total_insert_before_num += other.total_insert_before_num
+        self.total_remove_command_num += other.total_remove_command_num
+        self.total_remove_option_num += other.total_remove_option_num
+        self.total_syntax_change_num += other.total_syntax_change_num
+
+        self.total_successful_files += other.total_successful_files
+        self.total_failed_files += other.total_failed_files
+        self.total_unchanged_files += other.total_unchanged_files
+
+        self.total_optimization_files.merge(other.total_optimization_files)
+
+        self.total_durations.extend(other.total_durations)
+        for duration, filename in other.slowest_files:
+            self._push_slowest_file(duration, filename)
+
+    def to_dump(self) -> dict:
+        """
+        Return the statistics of all files as a JSON-serializable dict (a stats dump), which can be
+        merged with the dumps of other runs, such as the other shards of --shard (see from_dump()).
+
+        :return: {"version": Stats.DUMP_VERSION,
+                  "totals": {"add_cache": ..., "insert_before": ..., "remove_command": ...,
+                             "remove_option": ..., "syntax_change": ...},
+                  "files": {"successful": ..., "failed": ..., "unchanged": ...},
+                  "optimization_dict": [[stat_tuple, count, filenames], ...]}
+                The filenames may be fewer than count, see --stats-max-files.
+        """
+        dump = self._dump_header()
+        files = self.total_optimization_files
+        dump['optimization_dict'] = [[list(stat_tuple), count, list(files.filenames(stat_tuple))]
+                                     for stat_tuple, count in files.counts().items()]
+        return dump
+
+    def _dump_header(self) -> dict:
+        return {
+            'version': Stats.DUMP_VERSION,
+            'totals': {
+                'add_cache': self.total_add_cache_num,
+                'insert_before': self.total_insert_before_num,
+                'remove_command': self.total_remove_command_num,
+                'remove_option': self.total_remove_option_num,
+                'syntax_change': self.total_syntax_change_num,
+            },
+            'files': {
+                Stats.SUCCESSFUL: self.total_successful_files,
+                Stats.FAILED: self.total_failed_files,
+                Stats.UNCHANGED: self.total_unchanged_files,
+            },
+        }
+
+    @staticmethod
+    def from_dump(dump: dict):
+        """
+        Create a Stats object with the statistics of all files from a stats dump (see to_dump()).
+
+        :param dump: the stats dump.
+        :return: the Stats object.
+        :raise ValueError: the dump is broken, or has an unsupported version.
+        """
+        try:
+            if dump['version'] != Stats.DUMP_VERSION:
+                raise ValueError('unsupported version {0}'.format(dump['version']))
+            restored = Stats()
+            totals, files = dump['totals'], dump['files']
+            restored.total_add_cache_num = int(totals['add_cache'])
+            restored.total_insert_before_num = int(totals['insert_before'])
+            restored.total_remove_command_num = int(totals['remove_command'])
+            restored.total_remove_option_num = int(totals['remove_option'])
+            restored.total_syntax_change_num = int(totals['syntax_change'])
+            restored.total_successful_files = int(files[Stats.SUCCESSFUL])
+            restored.total_failed_files = int(files[Stats.FAILED])
+            restored.total_unchanged_files = int(files[Stats.UNCHANGED])
+            restored.total_optimization_files.max_files = engine_settings.stats_max_files
+            for entry in dump['optimization_dict']:
+                stat_tuple, count, filenames = tuple(int(n) for n in entry[0]), int(entry[1]), entry[2]
+                for filename in filenames:
+                    restored.total_optimization_files.add(stat_tuple, str(filename))
+                if count > len(filenames):
+                    restored.total_optimization_files.add(stat_tuple, None, count - len(filenames))
+        except (KeyError, TypeError) as e:
+            raise ValueError('broken stats dump: {0!r}'.format(e))
+        return restored
+
+    def write_dump(self, path: str):
+        """
+        Write the stats dump (see to_dump()) into a JSON file, replacing it atomically.
+
+        :param path: the path of the JSON file.
+        :return: None
+        """
+        tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(file=tmp_path, mode='w', encoding='utf-8') as f:
+            # The same as json.dump(self.to_dump(), f), but the filenames are streamed from the store
+            f.write(json.dumps(self._dump_header())[:-1] + ', "optimization_dict": [')
+            for i, (stat_tuple, count) in enumerate(self.total_optimization_files.counts().items()):
+                f.write('{0}[{1}, {2}, ['.format(', ' if i > 0 else '', json.dumps(list(stat_tuple)), count))
+                for j, filename in enumerate(self.total_optimization_files.filenames(stat_tuple)):
+                    f.write((', ' if j > 0 else '') + json.dumps(filename))
+                f.write(']]')
+            f.write(']}')
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def read_dump(path: str):
+        """
+        Read a stats dump written by write_dump().
+
+        :param path: the path of the JSON file.
+        :return: the Stats object, see from_dump().
+        :raise OSError: the file cannot be read.
+        :raise ValueError: the file is not a stats dump.
+        """
+        with open(file=path, mode='r', encoding='utf-8') as f:
+            return Stats.from_dump(json.load(f))
+
+    def detach(self):
+        """
+        Return a copy of the statistics of all files, and clear them in this object.
+        Worker processes use this to send their statistics back to the parent process.
+
+        :return: a new Stats object.
+        """
+        detached = copy.copy(self)
+        self.clear_total()
+        self.total_optimization_files = FilenameStore(max_files=detached.total_optimization_files.max_files)
+        self.total_durations = array.array('d')
+        self.slowest_files = []
+        return detached
+
+    def restore_one_file(self, stat_tuple, outcome: str):
+        """
+        Restore the statistics of one file from its tuple and outcome, for example from the result cache.
+
+        :param stat_tuple: the tuple returned by one_file_tuple().
+        :param outcome: Stats.SUCCESSFUL, Stats.UNCHANGED or Stats.FAILED.
+        :return: None
+        """
+        self.add_cache_num, self.insert_before_num, self.remove_command_num, \
+            self.remove_option_num, self.syntax_change_num = stat_tuple
+
+        self.total_add_cache_num += self.add_cache_num
+        self.total_insert_before_num += self.insert_before_num
+        self.total_remove_command_num += self.remove_command_num
+        self.total_remove_option_num += self.remove_option_num
+        self.total_syntax_change_num += self.syntax_change_num
+
+        if outcome == Stats.SUCCESSFUL:
+            self.successful_one_file()
+        elif outcome == Stats.FAILED:
+            self.failed_one_file()
+        else:
+            self.unchanged_one_file()
+
+    def forget_one_file(self, filename, stat_tuple, outcome):
+        """
+        Subtract the statistics of a file accounted before, for example when the file is deleted
+        or optimized again by --watch.
+
+        :param filename: the filename passed to finished_one_file().
+        :param stat_tuple: the tuple returned by one_file_tuple() for the file.
+        :param outcome: the outcome of the file, or None if the file was not optimized (cannot be opened).
+        :return: None
+        """
+        add_cache_num, insert_before_num, remove_command_num, remove_option_num, syntax_change_num = stat_tuple
+        self.total_add_cache_num -= add_cache_num
+        self.total_insert_before_num -= insert_before_num
+        self.total_remove_command_num -= remove_command_num
+        self.total_remove_option_num -= remove_option_num
+        self.total_syntax_change_num -= syntax_change_num
+
+        if outcome == Stats.SUCCESSFUL:
+            self.total_successful_files -= 1
+        elif outcome == Stats.FAILED:
+            self.total_failed_files -= 1
+        elif outcome == Stats.UNCHANGED:
+            self.total_unchanged_files -= 1
+
+        self.total_optimization_files.remove(tuple(stat_tuple), filename)
+
     def add_cache(self):
         self.add_cache_num += 1
         self.total_add_cache_num += 1
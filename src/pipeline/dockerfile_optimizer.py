@@ -0,0 +1,91 @@
+from model.optimization_strategy import AddCacheStrategy
+from pipeline.dockerfile_reader import DockerfileReader
+from pipeline.global_optimizer import GlobalOptimizer
+from pipeline.pipeline_context import PipelineContext
+from pipeline.stage_optimizer import StageOptimizer
+from pipeline.stage_simulator import StageSimulator
+from pipeline.stage_splitter import StageSplitter
+
+
+class DockerfileOptimizer(object):
+    """
+    Execute the whole pipeline (StageSplitter, StageSimulator, StageOptimizer and GlobalOptimizer)
+    for one dockerfile in memory. It neither reads nor writes files: the caller decides what to do
+    with the result, and the modifications are accounted into the stats of the PipelineContext.
+    The phases are measured by the timer of the PipelineContext if it's set.
+    """
+
+    # Reasons why a dockerfile is not optimized
+    EMPTY_FILE = 'Encountered an empty file.'
+    NON_OFFICIAL_FRONTEND = 'A non-official frontend was used, I cannot handle this.'
+    NO_STAGE = 'No stage was found! Is it correct?'
+    NOTHING_TO_OPTIMIZE = 'Nothing can be optimized.'
+
+    def __init__(self, context: PipelineContext):
+        """
+        Initialize the optimizer.
+
+        :param context: the PipelineContext of this dockerfile.
+        """
+        self.context = context
+
+    def optimize(self, dockerfile_in: DockerfileReader):
+        """
+        Optimize the dockerfile.
+
+        :param dockerfile_in: the DockerfileReader of the dockerfile.
+        :return: (new_stages_lines, strategies, reason).
+            -   new_stages_lines: a list of the string lines of every optimized stage,
+                or None if the dockerfile is not optimized.
+            -   strategies: a list of the applied OptimizationStrategies of every stage.
+            -   reason: why the dockerfile is not optimized (one of the reasons above), or None if it is optimized.
+        :raise HandleError: the dockerfile cannot be handled.
+        """
+        timer = self.context.timer
+        splitter = StageSplitter(dockerfile=dockerfile_in)
+        global_optimizer = GlobalOptimizer(context=self.context)
+        stages = []     # list of (instructions, contexts)
+        new_stages_lines = []
+        stages_strategies = []
+        something_can_be_optimized = False
+        for stage in splitter.iter_stages():    # stage is (instructions, contexts)
+            if timer is not None:
+                timer.lap('parse')
+            if len(stages) == 0:    # The first stage
+                if len(stage[0]) == 0:
+                    return None, [], DockerfileOptimizer.EMPTY_FILE
+                if not global_optimizer.optimizable([stage]):
+                    return None, [], DockerfileOptimizer.NON_OFFICIAL_FRONTEND
+            else:
+                new_stages_lines[-1].append('\n\n')
+            stages.append(stage)
+
+            _simulator = StageSimulator(stage, context=self.context)
+            _simulator.simulate()
+            if timer is not None:
+                timer.lap('simulate')
+            _optimizer = StageOptimizer(stage, dockerfile_in.lines, _simulator.get_parsed_instructions(),
+                                        context=self.context)
+            strategies = _simulator.get_optimization_strategies()
+
+            add_cache_strategies = len([s for s in strategies if isinstance(s, AddCacheStrategy)])
+            if add_cache_strategies > 0:
+                something_can_be_optimized = True
+            else:
+                strategies = []
+            new_stages_lines.append(_optimizer.optimize(strategies))
+            stages_strategies.append(strategies)
+            if timer is not None:
+                timer.lap('optimize')
+        if timer is not None:
+            timer.lap('parse')  # Splitter found no more stage
+
+        if len(stages) == 0:
+            return None, [], DockerfileOptimizer.NO_STAGE
+        if not something_can_be_optimized:
+            return None, stages_strategies, DockerfileOptimizer.NOTHING_TO_OPTIMIZE
+
+        global_optimizer.optimize(stages, new_stages_lines)
+        if timer is not None:
+            timer.lap('global_optimize')
+        return new_stages_lines, stages_strategies, None
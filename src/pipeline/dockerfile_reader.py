@@ -0,0 +1,195 @@
+import re
+
+
+class DockerfileReader(object):
+    """
+    The reader for the input dockerfile of StageSplitter.
+
+    It parses the dockerfile in a single linear pass, and produces the same instructions
+    as dockerfile_parse.DockerfileParser.structure. Unlike DockerfileParser, whose properties
+    read and parse the whole file again on every access, the content is read and decoded only once.
+    """
+
+    # Instructions whose contexts are used by the pipeline. Contexts of other instructions are not built.
+    CONTEXT_INSTRUCTIONS = ('RUN',)
+
+    _instruction_re = re.compile(r'^\s*(\S+)\s+(.*)$')
+    _comment_re = re.compile(r'^\s*#')
+    _escape_directive_re = re.compile(r'^\s*#\s*escape\s*=\s*(\\|`)\s*$', re.I)
+    _syntax_directive_re = re.compile(r'^\s*#\s*syntax\s*=\s*(.*)\s*$', re.I)
+    _from_image_re = re.compile(r'^\s*\S+')
+
+    def __init__(self, fileobj=None, content: bytes = None):
+        """
+        Initialize the DockerfileReader. One of fileobj and content should be provided.
+
+        :param fileobj: the file object of the input dockerfile (binary mode).
+        :param content: the bytes of the input dockerfile.
+        """
+        self.fileobj = fileobj
+        self.content = content
+        self._lines = None
+
+    @property
+    def lines(self) -> list:
+        """
+        :return: the lines of the dockerfile (decoded as utf-8, line endings are kept).
+        """
+        if self._lines is None:
+            if self.content is None:
+                self.fileobj.seek(0)
+                self.content = self.fileobj.read()
+                self.fileobj.seek(0)
+            self._lines = [line + '\n' for line in self.content.decode('utf-8').split('\n')]
+            # The last line has no line ending
+            self._lines[-1] = self._lines[-1][:-1]
+            if self._lines[-1] == '':
+                self._lines.pop()
+        return self._lines
+
+    def instructions(self):
+        """
+        Parse the instructions of the dockerfile, the same as DockerfileParser.structure.
+
+        :return: a generator of instructions. An instruction is a dict:
+                {"instruction": "FROM",       # always upper-case
+                 "startline": 0,              # 0-based
+                 "endline": 0,                # 0-based
+                 "content": "From fedora\n",
+                 "value": "fedora"}
+        """
+        line_continuation_char = '\\'
+        continuation_re = re.compile(r'^.*\\\s*$')
+        directive_possible = True
+        current_instruction = None
+        in_continuation = False
+
+        for lineno, line in enumerate(self.lines):
+            if directive_possible:
+                match = self._escape_directive_re.match(line)
+                if match:
+                    line_continuation_char = match.group(1)
+                    continuation_re = re.compile(r'^.*' + re.escape(line_continuation_char) + r'\s*$')
+                elif not self._syntax_directive_re.match(line):
+                    directive_possible = False
+
+            # A multi-line instruction can be interjected with comments
+            if self._comment_re.match(line):
+                yield {
+                    'instruction': 'COMMENT',
+                    'startline': lineno,
+                    'endline': lineno,
+                    'content': line,
+                    'value': re.sub(r'^\s*#\s*', '', line).replace('\n', '')
+                }
+                continue
+
+            if not in_continuation:
+                match = self._instruction_re.match(line)
+                if not match:
+                    continue
+                current_instruction = {
+                    'instruction': match.group(1).upper(),
+                    'startline': lineno,
+                    'endline': lineno,
+                    'content': line,
+                    'value': self._rstrip_eol(match.group(2), line_continuation_char)
+                }
+            else:
+                current_instruction['content'] += line
+                current_instruction['endline'] = lineno
+                if current_instruction['value']:
+                    current_instruction['value'] += self._rstrip_eol(line, line_continuation_char)
+                else:
+                    current_instruction['value'] = self._rstrip_eol(line.lstrip(), line_continuation_char)
+
+            in_continuation = continuation_re.match(line)
+            if not in_continuation and current_instruction is not None:
+                yield current_instruction
+
+    def stages(self):
+        """
+        Parse the dockerfile into stages, each of which starts with a "FROM" instruction.
+        The result is the same as splitting DockerfileParser.structure and DockerfileParser.context_structure:
+        -   If there are at most one FROM instruction with an image, the whole dockerfile is one stage.
+        -   Or else the dockerfile is split before every FROM instruction except the first one.
+
+        Contexts are only built for the instructions in CONTEXT_INSTRUCTIONS; for other instructions
+        the context is None. The args/envs/labels dicts of a context are shared with the contexts of
+        the following instructions until an ARG/ENV/LABEL instruction changes them, so they must not
+        be modified. The value of an ARG without a default value is None.
+
+        :return: a generator of stages. A stage is (instructions, contexts).
+        """
+        # Imported lazily: importing dockerfile_parse takes longer than reading a small dockerfile,
+        # and dockerfiles skipped by the prefilter (see Engine._prefilter()) never need it
+        from dockerfile_parse.util import Context, get_key_val_dictionary
+
+        images_num = 0      # Number of FROM instructions with an image
+        pending_stages = []     # Stages not yielded yet, because we don't know if this is multistage
+        instructions, contexts = [], []
+
+        in_stage = False
+        top_args = {}
+        args, envs, labels = {}, {}, {}
+
+        for instruction in self.instructions():
+            instruction_type = instruction['instruction']
+
+            if instruction_type == 'FROM':
+                if in_stage:
+                    pending_stages.append((instructions, contexts))
+                    instructions, contexts = [], []
+                in_stage = True
+                args, envs, labels = {}, {}, {}     # Reset per stage
+                if self._from_image_re.match(instruction['value']):
+                    images_num += 1
+            elif instruction_type in ('ARG', 'ENV', 'LABEL'):
+                line_values = get_key_val_dictionary(
+                    instruction_value=instruction['value'],
+                    env_replace=instruction_type != 'ARG',
+                    args={key: value for key, value in args.items() if value is not None},
+                    envs=envs)
+                if instruction_type == 'ARG':
+                    if '=' not in instruction['value'].split(None, 1)[0]:
+                        # "ARG X" has no default value (None), unlike "ARG X=" whose default value is empty
+                        line_values = dict.fromkeys(line_values)
+                    for key in list(line_values.keys()):
+                        if not in_stage:
+                            top_args[key] = line_values[key]
+                        elif key in top_args:
+                            line_values[key] = top_args[key]
+                    args = {**args, **line_values}
+                elif instruction_type == 'ENV':
+                    envs = {**envs, **line_values}
+                else:
+                    labels = {**labels, **line_values}
+
+            context = None
+            if instruction_type in self.CONTEXT_INSTRUCTIONS:
+                context = Context(args=args, envs=envs, labels=labels)
+
+            instructions.append(instruction)
+            contexts.append(context)
+
+            if images_num > 1:
+                # This is a multistage dockerfile, the previous stages will never be merged
+                yield from pending_stages
+                pending_stages = []
+
+        if images_num > 1:
+            yield from pending_stages
+            yield instructions, contexts
+        else:
+            # Not a multistage dockerfile: merge all stages
+            for stage_instructions, stage_contexts in reversed(pending_stages):
+                instructions = stage_instructions + instructions
+                contexts = stage_contexts + contexts
+            yield instructions, contexts
+
+    @staticmethod
+    def _rstrip_eol(text: str, line_continuation_char: str = '\\') -> str:
+        text = text.rstrip()
+        if text.endswith(line_continuation_char):
+            return text[:-1]
+        return text
@@ -1,26 +1,26 @@
-from functools import reduce
-
-import dockerfile_parse
+import itertools
 
 
 class DockerfileWriter(object):
     """
     The writer for optimized dockerfile from GlobalOptimizer.
+
+    The lines of all stages are streamed into the output file, without joining them into one list or string.
     """
 
-    def __init__(self, dockerfile: dockerfile_parse.DockerfileParser = None):
+    def __init__(self, fileobj=None):
         """
         Initialize the DockerfileWriter.
 
-        :param dockerfile: the dockerfile object of the output dockerfile.
+        :param fileobj: the file object of the output dockerfile (binary mode, buffered).
         """
-        self.dockerfile = dockerfile
+        self.fileobj = fileobj
 
     def write(self, stages_lines: list):
         """
-        Write the stage_lines into the output dockerfile.
+        Write the stage_lines into the output dockerfile (encoded as utf-8).
 
-        :param stages_lines:
+        :param stages_lines: a list of iterables of string lines, one for each stage.
         :return: None
         """
-        self.dockerfile.lines = reduce(lambda x, y: x + y, stages_lines)
+        self.fileobj.writelines(line.encode('utf-8') for line in itertools.chain.from_iterable(stages_lines))
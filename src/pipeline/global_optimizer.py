@@ -19,7 +19,9 @@ import logging
 import re
 
 from model import handle_error
-from model.stats import stats
+from pipeline.pipeline_context import PipelineContext
+
+logger = logging.getLogger(__name__)
 
 
 class GlobalOptimizer:
@@ -29,8 +31,13 @@ class GlobalOptimizer:
     -   Add/Modify the syntax directive. For example, add "# syntax=docker/dockerfile:1.3".
     """
 
-    def __init__(self):
-        ...
+    def __init__(self, context: PipelineContext = None):
+        """
+        Initialize the optimizer.
+
+        :param context: the PipelineContext, PipelineContext.create() by default.
+        """
+        self.context = context if context is not None else PipelineContext.create()
 
     def optimizable(self, stages: list) -> bool:
         """
@@ -91,7 +98,7 @@ class GlobalOptimizer:
                     elif syntax_lower.startswith('docker.io/docker/dockerfile:'):
                         official_dockerfile_version = syntax_lower[len('docker.io/docker/dockerfile:'):]
                     else:
-                        logging.error('This dockerfile uses a non-official frontend, I cannot handle this.')
+                        logger.error('This dockerfile uses a non-official frontend, I cannot handle this.')
                         raise handle_error.HandleError()
 
                     official_dockerfile_version = official_dockerfile_version.strip()
@@ -112,10 +119,10 @@ class GlobalOptimizer:
 
         if need_to_add_syntax:
             new_stages_lines[0].insert(0, '# syntax=docker/dockerfile:1.3\n')
-            stats.syntax_change()  # Stats
+            self.context.stats.syntax_change()  # Stats
         elif need_to_update_syntax:
             new_stages_lines[0][syntax_line_index] = '# syntax=docker/dockerfile:1.3\n'
-            stats.syntax_change()  # Stats
+            self.context.stats.syntax_change()  # Stats
 
     def _get_syntax(self, s: str):
         """
@@ -0,0 +1,57 @@
+from config import engine_config, optimization_config
+from config.engine_config import EngineSettings
+from config.optimization_config import GlobalOptimizationSettings, OptimizationSettings
+from model import stats as stats_module
+from model.stats import Stats
+
+
+class PipelineContext(object):
+    """
+    The context of optimizing a dockerfile, which is passed through the pipeline (StageSimulator, RunHandler,
+    PMHandler, StageOptimizer and GlobalOptimizer) instead of reading module-level singletons.
+
+    -   settings: the EngineSettings.
+    -   pm_settings: the settings of all PMs. Key: PM's name; Value: a PMSetting object.
+    -   pm_executables: the index of all PM executables. Key: the executable; Value: PM's name.
+    -   global_opt_settings: the GlobalOptimizationSettings.
+    -   stats: the Stats object to account the modifications.
+    -   timer: the PhaseTimer (util.phase_timer) to measure the phases of the pipeline, or None.
+
+    The pipeline only reads the settings and the compiled patterns, so contexts sharing them can be used
+    by different threads at the same time, as long as every context has its own stats.
+    """
+
+    def __init__(self, settings: EngineSettings, pm_settings: dict, pm_executables: dict,
+                 global_opt_settings: GlobalOptimizationSettings, stats: Stats, timer=None):
+        self.settings = settings
+        self.pm_settings = pm_settings
+        self.pm_executables = pm_executables
+        self.global_opt_settings = global_opt_settings
+        self.stats = stats
+        self.timer = timer
+
+    @staticmethod
+    def create(settings: EngineSettings = None, stats: Stats = None, timer=None,
+               optimization_settings: OptimizationSettings = None):
+        """
+        Create a context with the given OptimizationSettings, or the settings loaded by
+        config.optimization_config.load_optimization_settings().
+
+        :param settings: the EngineSettings, config.engine_config.engine_settings by default.
+        :param stats: the Stats object to account the modifications, model.stats.stats by default.
+        :param timer: the PhaseTimer to measure the phases of the pipeline, None by default (not measured).
+        :param optimization_settings: the OptimizationSettings (such as from
+                config.optimization_config.read_optimization_settings()), the loaded settings by default.
+        :return: the PipelineContext.
+        """
+        if optimization_settings is None:
+            optimization_settings = OptimizationSettings(pm_settings=optimization_config.pm_settings,
+                                                         pm_executables=optimization_config.pm_executables,
+                                                         global_opt_settings=optimization_config.global_opt_settings,
+                                                         settings_digest=optimization_config.settings_digest)
+        return PipelineContext(settings=settings if settings is not None else engine_config.engine_settings,
+                               pm_settings=optimization_settings.pm_settings,
+                               pm_executables=optimization_settings.pm_executables,
+                               global_opt_settings=optimization_settings.global_opt_settings,
+                               stats=stats if stats is not None else stats_module.stats,
+                               timer=timer)
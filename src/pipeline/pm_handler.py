@@ -1,8 +1,7 @@
-import re
-
-from config.optimization_config import *
+from config.optimization_config import PMSetting
 from model.global_status import GlobalStatus
 from model.optimization_strategy import *
+from pipeline.pipeline_context import PipelineContext
 from util import context_util, str_util
 
 
@@ -23,12 +22,14 @@ class PMHandler(object):
             self.cache_dirs = cache_dirs
             self.pre_commands_added = False
 
-    def __init__(self, global_status: GlobalStatus, optimization_strategies):
+    def __init__(self, global_status: GlobalStatus, optimization_strategies, context: PipelineContext = None):
         """
         Initialize the PMHandler.
 
         :param global_status: the global_status of this stage created by stage simulator.
+        :param context: the PipelineContext, PipelineContext.create() by default.
         """
+        self.context = context if context is not None else PipelineContext.create()
         self.global_status = global_status
         self.pm_statuses = {}   # Key: PM's name; Value: PMStatus object
         self.optimization_strategies = optimization_strategies
@@ -57,13 +58,12 @@ class PMHandler(object):
         # Concatenate the command words as string to match the regexes.
         pm_command_str = str_util.join_command_words(command[1:])
 
-        pm_setting: PMSetting = pm_settings[pm_name]    # Initialized by config.optimization_config
+        pm_setting: PMSetting = self.context.pm_settings[pm_name]
         pm_status: PMHandler.PMStatus = self.pm_statuses[pm_name]
 
         # ------------------------ Regex matching ------------------------
         # Case for modifying the cache dir
-        for command_regex_modify_cache_dir in pm_setting.commands_regex_modify_cache_dir:
-            modify_cache_dir_re = re.compile(command_regex_modify_cache_dir)
+        for modify_cache_dir_re in pm_setting.commands_re_modify_cache_dir:
             match_result = modify_cache_dir_re.match(pm_command_str)
             # Only considering one match! So we will return directly once finished handling the match.
             if match_result and len(match_result.groups()) > 0:  # This command will modify the cache dir
@@ -78,13 +78,8 @@ class PMHandler(object):
             # TODO: Consider more conditions for modifying cache dir
 
         # Case for running the package manager's build/install process
-        for command_regex_run in pm_setting.commands_regex_run:
-            run_re = re.compile(command_regex_run)
-            match_result = run_re.match(pm_command_str)
-            # Only considering one match
-            if match_result:
-                add_cache = True
-                break
+        if pm_setting.commands_re_run.match(pm_command_str) is not None:
+            add_cache = True
 
         # --------------- Try to generate RemoveOptionStrategy ---------------
         # Case for removing anti-cache options
@@ -126,35 +121,33 @@ class PMHandler(object):
 
             cache_dirs = pm_status.cache_dirs
             if len(cache_dirs) == 0:
-                cache_dirs = context_util.get_context_default_cache_dirs(pm_name, self.global_status)
+                cache_dirs = context_util.get_context_default_cache_dirs(pm_setting.default_cache_dirs,
+                                                                         self.global_status)
 
             for cache_dir in cache_dirs:
                 if cache_dir not in add_cache_strategy.cache_dirs:
                     add_cache_strategy.cache_dirs.append(cache_dir)
 
-    @staticmethod
-    def is_package_manager_executable(executable: str) -> bool:
+    def is_package_manager_executable(self, executable: str) -> bool:
         """
         This function is used by RunHandler to determine if the executable is a PM executable.
 
         :param executable: the executable of a command.
         :return: True when executable is a PM executable, or else False.
         """
-        for pm_name, pm_setting in pm_settings.items():
-            if executable in pm_setting.executables:
-                return True
-        return False
+        return self._get_executable_package_manager(executable) is not None
 
-    @staticmethod
-    def _get_executable_package_manager(executable: str):
+    def _get_executable_package_manager(self, executable: str):
         """
         Similar to is_package_manager_executable(), but return the PM's name.
+        Paths of the executables are also supported, such as "/usr/bin/apt-get".
 
         :param executable: the executable of a command.
         :return: the PM's name when executable is a PM executable, or else None.
         """
-        for pm_name, pm_setting in pm_settings.items():
-            if executable in pm_setting.executables:
-                return pm_name
-        return None
+        pm_executables = self.context.pm_executables
+        pm_name = pm_executables.get(executable)
+        if pm_name is None and '/' in executable:
+            pm_name = pm_executables.get(executable[executable.rfind('/') + 1:])
+        return pm_name
 
@@ -1,14 +1,16 @@
 import logging
 import re
 
-from config import optimization_config
 from model import handle_error
 from model.command_word import CommandWord
 from model.global_status import GlobalStatus
 from model.optimization_strategy import RemoveCommandStrategy
+from pipeline.pipeline_context import PipelineContext
 from pipeline.pm_handler import PMHandler
 from util import str_util, shell_util, context_util
 
+logger = logging.getLogger(__name__)
+
 
 class RunHandler(object):
     """
@@ -20,17 +22,25 @@ class RunHandler(object):
     -   All package-manager-related commands will be passed to PMHandler.
     """
 
-    def __init__(self, global_status: GlobalStatus, optimization_strategies):
+    def __init__(self, global_status: GlobalStatus, optimization_strategies, parsed_instructions: dict = None,
+                 context: PipelineContext = None):
         """
         Initialize the RunHandler.
 
         :param global_status: the global_status of this stage created by stage simulator.
+        :param parsed_instructions: the dict of ParsedInstructions of this stage, keyed by the instruction index.
+                Parsed shell-form RUN instructions will be put into it, so that the StageOptimizer
+                doesn't need to parse them again.
+        :param context: the PipelineContext, PipelineContext.create() by default.
         """
+        self.context = context if context is not None else PipelineContext.create()
         self.global_status = global_status
-        self.pm_handler = PMHandler(global_status=global_status, optimization_strategies=optimization_strategies)
+        self.pm_handler = PMHandler(global_status=global_status, optimization_strategies=optimization_strategies,
+                                    context=self.context)
         self.optimization_strategies = optimization_strategies
+        self.parsed_instructions = parsed_instructions if parsed_instructions is not None else {}
 
-    def handle(self, commands_str: str, context, instruction_index: int):
+    def handle(self, commands_str: str, context, instruction_index: int, content: str = None):
         """
         Handle the commands string after "RUN".
         -   All package-manager-related commands will be passed to PMHandler.
@@ -39,6 +49,8 @@ class RunHandler(object):
                             (preprocessed by DockerfileParse, so line_continue_char does not exist).
         :param context: the context object of this instruction.
         :param instruction_index: the instruction index of the stage.
+        :param content: the full content of the instruction. If it's provided, shell-form commands are parsed
+                from the content, and the ParsedInstruction is put into self.parsed_instructions.
         :return: None
         """
         # Pay attention to RUN options, such as RUN --mount, this should be ignored
@@ -46,6 +58,9 @@ class RunHandler(object):
 
         if shell_util.is_exec_form(commands_str):
             commands = self._process_exec_form(commands_str)
+        elif content is not None and commands_str != '':
+            parsed_instruction, commands = shell_util.parse_run_instruction(content, context)
+            self.parsed_instructions[instruction_index] = parsed_instruction
         else:
             commands, _ = shell_util.process_shell_form(commands_str, context)
         commands = self._handle_bash_c(commands, context)
@@ -103,7 +118,7 @@ class RunHandler(object):
             try:
                 command_words = eval(match_result.group(1))  # ["bash", "-c", "echo", "hello world!"]
             except Exception as e:
-                logging.error('Illegal RUN exec-form: "{0}"'.format(commands_str))
+                logger.error('Illegal RUN exec-form: "{0}"'.format(commands_str))
                 raise handle_error.HandleError()
             return [[CommandWord(word, CommandWord.EXEC_FORM_ARG) for word in command_words]]
         else:
@@ -212,7 +227,8 @@ class RunHandler(object):
         for pm_name, pm_status in pm_statuses.items():
             cache_dirs = pm_status.cache_dirs
             if len(cache_dirs) == 0:
-                cache_dirs = context_util.get_context_default_cache_dirs(pm_name, self.global_status)
+                cache_dirs = context_util.get_context_default_cache_dirs(
+                    self.context.pm_settings[pm_name].default_cache_dirs, self.global_status)
             for cache_dir in cache_dirs:
                 if cache_dir not in all_cache_dirs:
                     assert cache_dir != ''
@@ -251,18 +267,12 @@ class RunHandler(object):
             remove_command_indices.append(command_index)
             remove_command_contents.append(None)    # None indicates to remove the whole command
 
-    @staticmethod
-    def _need_remove_anti_cache_commands(command: list):
+    def _need_remove_anti_cache_commands(self, command: list):
         """
         Check if this command is an anti-cache command.
         :param command: the command to check.
         :return: True if this command is an anti-cache command, or else False.
         """
         # Case for removing anti-cache commands
-        for command_regex_anti_cache in optimization_config.global_opt_settings.anti_cache_commands_regex:
-            anti_cache_re = re.compile(command_regex_anti_cache)
-            command_str = str_util.join_command_words(command)
-            match_result = anti_cache_re.match(command_str)
-            if match_result:
-                return True
-        return False
+        command_str = str_util.join_command_words(command)
+        return self.context.global_opt_settings.anti_cache_commands_re.match(command_str) is not None
@@ -13,9 +13,10 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
-from config.engine_config import engine_settings
 from model.optimization_strategy import *
-from model.stats import stats
+from model.parsed_instruction import ParsedInstruction
+from model.span_edit import SpanEdit
+from pipeline.pipeline_context import PipelineContext
 from util import str_util, context_util, shell_util
 
 
@@ -24,15 +25,20 @@ class StageOptimizer(object):
     Try to apply all optimization strategies from PMHandler to the stage.
     """
 
-    def __init__(self, stage, lines):
+    def __init__(self, stage, lines, parsed_instructions: dict = None, context: PipelineContext = None):
         """
         Initialize the optimizer.
 
         :param stage: the stage to optimize.
+        :param parsed_instructions: the dict of ParsedInstructions of this stage from StageSimulator,
+                keyed by the instruction index. RUN instructions not inside it will be parsed when needed.
+        :param context: the PipelineContext, PipelineContext.create() by default.
         """
+        self.context = context if context is not None else PipelineContext.create()
         self.new_stage_lines = []
         self.instructions, self.contexts = stage
         self.lines = lines
+        self.parsed_instructions = parsed_instructions if parsed_instructions is not None else {}
 
     def optimize(self, optimization_strategies: list) -> list:
         """
@@ -60,18 +66,11 @@ class StageOptimizer(object):
                 matched_strategies = [strategy for strategy in optimization_strategies
                                       if strategy.instruction_index == instruction_index]
                 # Note: if an instruction doesn't use AddCacheStrategy, then it also need to be copied
-                for strategy in matched_strategies:
-                    if isinstance(strategy, AddCacheStrategy):  # At most 1 AddCacheStrategy one instruction
-                        self._optimize_add_cache(strategy=strategy, instruction=instruction, context=context)
-                    elif isinstance(strategy, InsertBeforeStrategy):
-                        self._optimize_insert_before(strategy=strategy, pre_instruction=pre_instruction)
-                    elif isinstance(strategy, RemoveCommandStrategy):
-                        self._optimize_remove_command(strategy=strategy, instruction=instruction)
-                    elif isinstance(strategy, RemoveOptionStrategy):
-                        self._optimize_remove_option(strategy=strategy, instruction=instruction)
+                self._optimize_instruction(strategies=matched_strategies, instruction=instruction, context=context,
+                                           instruction_index=instruction_index, pre_instruction=pre_instruction)
 
                 # Some operations may cause empty lines, this is to remove empty instructions
-                if instruction['content'] != '' and instruction['content'].strip() != instruction['instruction']:
+                if instruction['content'].strip() not in ('', instruction['instruction']):
                     self.new_stage_lines.append(instruction['content'].strip() + '\n')
             else:
                 self.new_stage_lines.append(instruction['content'].strip() + '\n')
@@ -82,15 +81,55 @@ class StageOptimizer(object):
             pre_instruction = instruction
         return self.new_stage_lines
 
+    def _optimize_instruction(self, strategies: list, instruction: dict, context, instruction_index: int,
+                              pre_instruction: dict):
+        """
+        Apply all strategies of the instruction.
+        The edits of all strategies are collected first, and then applied to the original content
+        in a single pass (see str_util.apply_span_edits()). InsertBeforeStrategy doesn't edit the content,
+        the new instructions are added before this instruction.
+
+        :param strategies: the strategies of this instruction.
+        :param instruction: the instruction to optimize.
+        :param context: the context of the instruction.
+        :param instruction_index: the index of the instruction.
+        :param pre_instruction: the instruction before this instruction.
+        :return: None
+        """
+        edits = []
+        for strategy in strategies:
+            if isinstance(strategy, AddCacheStrategy):  # At most 1 AddCacheStrategy one instruction
+                edits.extend(self._optimize_add_cache(strategy=strategy, instruction=instruction, context=context,
+                                                      instruction_index=instruction_index))
+            elif isinstance(strategy, InsertBeforeStrategy):
+                self._optimize_insert_before(strategy=strategy, pre_instruction=pre_instruction)
+            elif isinstance(strategy, RemoveCommandStrategy):
+                edits.extend(self._optimize_remove_command(strategy=strategy, instruction=instruction,
+                                                           instruction_index=instruction_index))
+            elif isinstance(strategy, RemoveOptionStrategy):
+                edits.extend(self._optimize_remove_option(strategy=strategy, instruction=instruction,
+                                                          instruction_index=instruction_index))
+        if len(edits) == 0:
+            return
+
+        new_content = str_util.apply_span_edits(instruction['content'], edits).strip()
+        # Be careful of the line_continue_char
+        while new_content.endswith('\\'):
+            new_content = new_content[:-1].strip()
+        instruction['content'] = new_content
+        self.parsed_instructions.pop(instruction_index, None)   # The content is changed
+
     # --------------------------- Specific optimizations ---------------------------
-    def _optimize_add_cache(self, strategy: AddCacheStrategy, instruction: dict, context):
+    def _optimize_add_cache(self, strategy: AddCacheStrategy, instruction: dict, context,
+                            instruction_index: int) -> list:
         """
-        Apply the AddCacheStrategy for the instruction.
+        Get the edits of the AddCacheStrategy for the instruction.
 
         :param strategy: the AddCacheStrategy.
         :param instruction: the instruction to optimize.
         :param context: the context of the instruction.
-        :return: None
+        :param instruction_index: the index of the instruction.
+        :return: a list of SpanEdits.
         """
         assert instruction['instruction'] == 'RUN'
 
@@ -103,16 +142,13 @@ class StageOptimizer(object):
                                   if cache_dir not in existing_target_dirs]
         mount_args = ['--mount=type=cache,target={0}'.format(cache_dir) for cache_dir in non_mounted_cache_dirs]
         mount_args_str = ' '.join(mount_args)
+        self.context.stats.add_cache()        # Stats
+        if mount_args_str == '':
+            return []
 
-        # Generate optimized commands string
-        instruction_type, instruction_body = str_util.separate_instruction_type_body(instruction['content'])
-        new_content = ' '.join([
-            instruction_type,     # Type of instruction, such as "RUN"
-            mount_args_str,
-            instruction_body
-        ])
-        instruction['content'] = new_content
-        stats.add_cache()        # Stats
+        # Replace the whitespaces between the instruction type and the body
+        parsed_instruction = self._get_parsed_instruction(instruction_index, instruction)
+        return [SpanEdit(parsed_instruction.type_end, parsed_instruction.body_start, ' ' + mount_args_str + ' ')]
 
     def _optimize_insert_before(self, strategy: InsertBeforeStrategy, pre_instruction: dict):
         """
@@ -128,134 +164,125 @@ class StageOptimizer(object):
             if (pre_instruction is None) or \
                     (pre_instruction is not None and pre_instruction['value'] != command_insert):
                 self.new_stage_lines.append('RUN ' + command_insert + '\n')
-                stats.insert_before()    # Stats
-    
-    def _optimize_remove_command(self, strategy: RemoveCommandStrategy, instruction: dict):
+                self.context.stats.insert_before()    # Stats
+
+    def _optimize_remove_command(self, strategy: RemoveCommandStrategy, instruction: dict,
+                                 instruction_index: int) -> list:
         """
-        Apply the RemoveCommandStrategy for the instruction.
+        Get the edits of the RemoveCommandStrategy for the instruction.
 
         :param strategy: the RemoveCommandStrategy.
         :param instruction: the instruction to optimize.
-        :return: None
+        :param instruction_index: the index of the instruction.
+        :return: a list of SpanEdits.
         """
         assert instruction['instruction'] == 'RUN'
         assert len(strategy.remove_command_indices) == len(strategy.remove_command_contents) > 0
 
-        # Parse the commands string again
-        instruction_type, instruction_body = str_util.separate_instruction_type_body(instruction['content'])
-        instruction_options, instruction_body = str_util.separate_run_options(instruction_body)
+        parsed_instruction = self._get_parsed_instruction(instruction_index, instruction)
+        commands = parsed_instruction.commands
+        # Commands out of range (for example, commands inside "bash -c") are ignored
+        remove_contents_dict = {index: remove_contents for index, remove_contents
+                                in zip(strategy.remove_command_indices, strategy.remove_command_contents)
+                                if index < len(commands)}
+        if len(remove_contents_dict) == 0:
+            return []
 
-        commands, connectors = shell_util.split_command_strings(instruction_body)
-        assert len(connectors) == len(commands) - 1
+        # Commands without a body (such as "fi", "done", "}", or the empty command after a trailing "&") are kept
+        body_indices = [index for index, command in enumerate(commands) if command.body_start < command.body_end]
 
         # If all commands in this instruction needs to be removed, then remove the instruction
-        if len(commands) == len(strategy.remove_command_indices):
-            # All commands are ready to be removed
-            for content in strategy.remove_command_contents:
-                if content is not None:
-                    break   # Not all things need to be removed
-            else:
-                # All commands need to be removed
-                instruction['content'] = ''
-                return
-
-        new_commands, new_connectors = [], []
-        for index in range(len(connectors)):
-            if index not in strategy.remove_command_indices:
-                new_commands.append(commands[index])
-                new_connectors.append(connectors[index])
-            else:
-                remove_contents = strategy.remove_command_contents[strategy.remove_command_indices.index(index)]
-                if remove_contents is None:
-                    # Remove the whole command and the connector after it; or substitute it with 'true'
-                    if engine_settings.remove_command_with_true:
-                        new_commands.append(' true ')
-                        new_connectors.append(connectors[index])
-                else:
-                    # Remove all contents of remove_contents inside the command
-                    command = commands[index].strip()
-                    while len(command) > 0 and command[0] == '\\':
-                        command = command[1:].strip()
-                    executable, remain_command = command.split(maxsplit=1)
-                    remain_command = ' ' + remain_command
-                    for content in remove_contents:
-                        # Suppose there exists a space before the content. Remove them.
-                        remain_command = remain_command.replace(' ' + content, '', 1)
-                    new_commands.append(' ' + executable + remain_command)
-                    new_connectors.append(connectors[index])
-
-        # The last command
-        index = len(commands) - 1
-        if index in strategy.remove_command_indices:
-            remove_contents = strategy.remove_command_contents[strategy.remove_command_indices.index(index)]
-            if remove_contents is None:
-                # Remove the whole command and the connector before it; or substitute it with 'true'
-                if engine_settings.remove_command_with_true:
-                    new_commands.append(' true ')
-                else:
-                    if len(new_connectors) > 0:
-                        new_connectors.pop()
-            else:
+        if all(remove_contents_dict.get(index, False) is None for index in body_indices):
+            content = instruction['content']
+            return [SpanEdit(len(content) - len(content.lstrip()), len(content), '')]
+
+        # The whole commands at the end will be removed with the connector before them. Only the last one of them
+        # may end with closing brackets, which are kept.
+        trailing_start = trailing_stop = body_indices[-1] + 1
+        if not self.context.settings.remove_command_with_true:
+            while trailing_start > 0 and remove_contents_dict.get(trailing_start - 1, False) is None:
+                command = commands[trailing_start - 1]
+                if command.body_start != command.start or \
+                        (trailing_start < trailing_stop and command.body_end != command.end):
+                    break
+                trailing_start -= 1
+
+        edits = []
+        for index, remove_contents in remove_contents_dict.items():
+            command = commands[index]
+            if remove_contents is not None:
                 # Remove all contents of remove_contents inside the command
-                command = commands[-1].strip()
-                while len(command) > 0 and command[0] == '\\':
-                    command = command[1:].strip()
-                executable, remain_command = command.split(maxsplit=1)
-                remain_command = ' ' + remain_command
-                for content in remove_contents:
-                    # Suppose there exists a space before the content. Remove them.
-                    remain_command = remain_command.replace(' ' + content, '', 1)
-                new_commands.append(' ' + executable + remain_command)
-        else:
-            new_commands.append(commands[-1])
-
-        new_content = (instruction_type + " " +
-                       (instruction_options + " " if instruction_options != "" else "") +
-                       shell_util.connect_shell_command_string(new_commands, new_connectors)).strip()
-
-        # Be careful of the line_continue_char
-        while new_content.endswith('\\'):
-            new_content = new_content[:-1].strip()
+                edits.extend(self._remove_words(command, remove_contents, remove_all=False))
+            elif index >= trailing_start:
+                continue
+            elif not self.context.settings.remove_command_with_true and command.body_start == command.start and \
+                    command.body_end == command.end and index + 1 in body_indices:
+                # Remove the whole command and the connector after it
+                edits.append(SpanEdit(command.start, commands[index + 1].start, ''))
+            else:
+                # The reserved words and the brackets around the command are kept
+                edits.append(SpanEdit(command.body_start, command.body_end, ' true '))
+        if trailing_start < trailing_stop:
+            edits.append(SpanEdit(commands[trailing_start - 1].end, commands[trailing_stop - 1].body_end, ''))
 
-        instruction['content'] = new_content
-        stats.remove_command()  # Stats
+        self.context.stats.remove_command()  # Stats
+        return edits
 
-    def _optimize_remove_option(self, strategy: RemoveOptionStrategy, instruction: dict):
+    def _optimize_remove_option(self, strategy: RemoveOptionStrategy, instruction: dict,
+                                instruction_index: int) -> list:
         """
-        Apply the RemoveCommandStrategy for the instruction.
+        Get the edits of the RemoveOptionStrategy for the instruction.
 
-        :param strategy: the RemoveCommandStrategy.
+        :param strategy: the RemoveOptionStrategy.
         :param instruction: the instruction to optimize.
-        :return: None
+        :param instruction_index: the index of the instruction.
+        :return: a list of SpanEdits.
         """
         assert instruction['instruction'] == 'RUN'
 
-        # Parse the commands string again
-        instruction_type, instruction_body = str_util.separate_instruction_type_body(instruction['content'])
-        instruction_options, instruction_body = str_util.separate_run_options(instruction_body)
+        parsed_instruction = self._get_parsed_instruction(instruction_index, instruction)
+        if strategy.command_index >= len(parsed_instruction.commands):
+            return []   # Exec-form, or commands inside "bash -c"
 
-        commands, connectors = shell_util.split_command_strings(instruction_body)
-        assert len(connectors) == len(commands) - 1
+        command = parsed_instruction.commands[strategy.command_index]
+        for _ in strategy.remove_options:
+            self.context.stats.remove_option()  # Stats
+        return self._remove_words(command, strategy.remove_options, remove_all=True)
 
-        for command_index in range(len(commands)):
-            if command_index != strategy.command_index:
-                continue
-            for option in sorted(strategy.remove_options, reverse=True):
-                command = commands[command_index]
-                if command.find(' ' + option) != -1:
-                    commands[command_index] = command.replace(' ' + option, '')
-                else:
-                    commands[command_index] = command.replace(option, '')
-                stats.remove_option()  # Stats
-            if len(commands[command_index].strip()) == 0:
-                commands[command_index] = ' true '
-
-        new_content = (instruction_type + " " +
-                       (instruction_options + " " if instruction_options != "" else "") +
-                       shell_util.connect_shell_command_string(commands, connectors)).strip()
+    @staticmethod
+    def _remove_words(command, words: list, remove_all: bool) -> list:
+        """
+        Get the edits to remove some words (and the whitespaces before them) from the command.
+        The executable of the command won't be removed.
 
-        # Be careful of the line_continue_char
-        while new_content.endswith('\\'):
-            new_content = new_content[:-1].strip()
+        :param command: the command (shell_lexer.SimpleCommand).
+        :param words: the words to remove.
+        :param remove_all: remove all occurrences of the words, or else only the first occurrence of every word.
+        :return: a list of SpanEdits.
+        """
+        words_to_remove = list(words)
+        edits = []
+        for i in range(1, len(command.words)):
+            token = command.words[i]
+            word = token.s.strip()
+            if word in words_to_remove:
+                edits.append(SpanEdit(command.words[i - 1].end, token.end, ''))
+                if not remove_all:
+                    words_to_remove.remove(word)
+        return edits
+
+    # --------------------------- Parsed instructions ---------------------------
+    def _get_parsed_instruction(self, instruction_index: int, instruction: dict) -> ParsedInstruction:
+        """
+        Get the ParsedInstruction of the instruction. If the StageSimulator didn't parse it,
+        the instruction will be parsed now.
 
-        instruction['content'] = new_content
+        :param instruction_index: the index of the instruction.
+        :param instruction: the instruction.
+        :return: the ParsedInstruction.
+        """
+        parsed_instruction = self.parsed_instructions.get(instruction_index)
+        if parsed_instruction is None:
+            parsed_instruction, _ = shell_util.parse_run_instruction(instruction['content'], None)
+            self.parsed_instructions[instruction_index] = parsed_instruction
+        return parsed_instruction
@@ -1,4 +1,5 @@
 from model.global_status import GlobalStatus
+from pipeline.pipeline_context import PipelineContext
 from pipeline.run_handler import RunHandler
 
 
@@ -10,17 +11,21 @@ class StageSimulator(object):
     -   RUN instructions will be passed to RunHandler.
     """
 
-    def __init__(self, stage):
+    def __init__(self, stage, context: PipelineContext = None):
         """
         Initialize the stage simulator.
 
         :param stage: the stage to simulate.
+        :param context: the PipelineContext, PipelineContext.create() by default.
         """
+        self.context = context if context is not None else PipelineContext.create()
         # a stage is (instructions, contexts)
         self.instructions, self.contexts = stage
         self.global_status = GlobalStatus()
         self.optimization_strategies = []
-        self.run_handler = RunHandler(self.global_status, self.optimization_strategies)
+        self.parsed_instructions = {}
+        self.run_handler = RunHandler(self.global_status, self.optimization_strategies, self.parsed_instructions,
+                                      context=self.context)
 
     def simulate(self, start_instruction_index=0, end_instruction_index=-1):
         """
@@ -59,7 +64,7 @@ class StageSimulator(object):
                 else:                       # Relative dir
                     self.global_status.work_dir += value
             elif i_type == 'RUN':
-                self.run_handler.handle(value, context, instruction_index)
+                self.run_handler.handle(value, context, instruction_index, instruction['content'])
             # TODO: Consider more instructions
             # elif i_type == "VOLUME":
             #     ...
@@ -75,3 +80,11 @@ class StageSimulator(object):
         :return: the optimization strategies.
         """
         return self.optimization_strategies
+
+    def get_parsed_instructions(self):
+        """
+        Get the parsed RUN instructions from RunHandler.
+
+        :return: a dict of ParsedInstructions, keyed by the instruction index.
+        """
+        return self.parsed_instructions
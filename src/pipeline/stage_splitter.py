@@ -1,8 +1,9 @@
 import logging
 
-import dockerfile_parse
-
 from model import handle_error
+from pipeline.dockerfile_reader import DockerfileReader
+
+logger = logging.getLogger(__name__)
 
 
 class StageSplitter(object):
@@ -10,14 +11,14 @@ class StageSplitter(object):
     Split the dockerfile into stages, each of which starts with a "FROM" instruction.
     """
 
-    def __init__(self, dockerfile: dockerfile_parse.DockerfileParser = None):
+    def __init__(self, dockerfile: DockerfileReader = None):
         """
         Initialize the splitter.
 
-        :param dockerfile: the DockerfileParser object of the input dockerfile.
+        :param dockerfile: the DockerfileReader object of the input dockerfile.
         """
         if dockerfile is None:
-            logging.error('dockerfile=None is provided to stage splitter!')
+            logger.error('dockerfile=None is provided to stage splitter!')
             raise handle_error.HandleError()
         self.dockerfile = dockerfile
 
@@ -26,7 +27,7 @@ class StageSplitter(object):
         Split the dockerfile into stages.
 
         :return: a list of stages. A stage is (instructions, contexts).
-            -   instructions: a list of instructions, an instruction is a dict (from dockerfile_parse.parser):
+            -   instructions: a list of instructions, an instruction is a dict (the same as dockerfile_parse.parser):
                 {"instruction": "FROM",       # always upper-case
                  "startline": 0,              # 0-based
                  "endline": 0,                # 0-based
@@ -40,37 +41,22 @@ class StageSplitter(object):
                     (all variables defined to this line)
                 context.labels: dict with labels valid for this line
                     (all labels defined to this line)
-                context.line_args: dict with arguments defined on this line
-                context.line_envs: dict with variables defined on this line
-                context.line_labels: dict with labels defined on this line
+                Contexts are only built for the instructions reading them (RUN), or else the context is None.
 
             So the final structure of stages is:
             [(stage1_instructions, stage1_contexts), ..., (stagen_instructions, stagen_contexts)]
         """
+        return list(self.iter_stages())
+
+    def iter_stages(self):
+        """
+        Split the dockerfile into stages, the same as get_stages(), but stages are yielded one at a time.
+        The dockerfile is parsed in a single pass while iterating.
+
+        :return: a generator of stages. A stage is (instructions, contexts).
+        """
         try:
-            if not self.dockerfile.is_multistage:
-                return [(self.dockerfile.structure, self.dockerfile.context_structure)]
-            else:
-                instructions = []
-                contexts = []
-                stages = []
-                first_stage = True
-                for i in range(len(self.dockerfile.structure)):
-                    instruction = self.dockerfile.structure[i]
-                    context = self.dockerfile.context_structure[i]
-                    if instruction['instruction'] == 'FROM':
-                        if first_stage:
-                            first_stage = False
-                        else:
-                            stages.append((instructions, contexts))
-                            instructions = []
-                            contexts = []
-                    instructions.append(instruction)
-                    contexts.append(context)
-                if len(instructions) > 0:
-                    stages.append((instructions, contexts))
-                return stages
-        except Exception:
-            logging.error('Internal bug occurred in dockerfile_parse')
+            yield from self.dockerfile.stages()
+        except Exception:   # Including: UnicodeDecodeError, syntax errors of ARG/ENV/LABEL
+            logger.error('Failed to parse the dockerfile')
             raise handle_error.HandleError()
-
@@ -0,0 +1,240 @@
+"""
+Copyright 2022 PandaAwAke
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import stat
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import engine
+from config import optimization_config
+from config.engine_config import engine_settings, global_settings
+from config.optimization_config import load_optimization_settings
+
+
+class OptimizerServer(object):
+    """
+    A long-running optimizer, serving optimize requests over a local Unix socket.
+
+    The settings are loaded once and kept in a pool of worker processes, which do the CPU work,
+    while the requests are accepted by an asyncio event loop. "settings.yaml" is reloaded when it changes.
+
+    The protocol is JSON lines: a client sends one request per line, and gets one response per line
+    in the same order.
+    -   Request: {"id": ..., "content": "FROM ubuntu\\n...", "name": "Dockerfile"}
+        ("id" and "name" are optional).
+    -   Response: {"id": ..., "outcome": "successful", "stats": [...], "content": "..."}
+        ("stats" is the statistics tuple, see Stats.one_file_tuple()),
+        or {"id": ..., "error": "..."} when the request cannot be handled.
+    """
+
+    # Interval of checking whether "settings.yaml" is changed, in seconds
+    SETTINGS_POLL_INTERVAL = 1.0
+    # Maximum size of a request line
+    MAX_REQUEST_SIZE = 64 * 1024 * 1024
+
+    def __init__(self, socket_path: str, jobs: int = 1):
+        """
+        Initialize the server.
+
+        :param socket_path: the path of the Unix socket.
+        :param jobs: the number of worker processes.
+        """
+        self.socket_path = socket_path
+        self.jobs = jobs
+        self.executor = None
+        self.settings_mtime = None
+
+    def run(self):
+        """
+        Serve until interrupted (SIGINT, such as Ctrl+C) or terminated (SIGTERM).
+
+        :return: None
+        """
+        load_optimization_settings()
+        self.settings_mtime = self._get_settings_mtime()
+        self._remove_stale_socket()
+        try:
+            asyncio.run(self._serve())
+        except KeyboardInterrupt:
+            logging.info('Stopped serving.')
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    async def _serve(self):
+        self.executor = self._create_executor()
+        server = await asyncio.start_unix_server(self._handle_client, path=self.socket_path,
+                                                 limit=OptimizerServer.MAX_REQUEST_SIZE)
+        logging.warning('Serving on "{0}" with {1} worker processes.'.format(self.socket_path, self.jobs))
+        stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signal_number, stopped.set)
+        watcher = asyncio.ensure_future(self._watch_settings())
+        try:
+            async with server:
+                await stopped.wait()
+        finally:
+            watcher.cancel()
+        logging.info('Stopped serving.')
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Handle the requests of a connection one by one.
+
+        :param reader: the reader of the connection.
+        :param writer: the writer of the connection.
+        :return: None
+        """
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:  # The request line is too long
+                    response = {'error': 'The request is larger than {0} bytes.'
+                                .format(OptimizerServer.MAX_REQUEST_SIZE)}
+                    writer.write(json.dumps(response).encode('utf-8') + b'\n')
+                    break
+                if not line:
+                    break
+                if line.strip() == b'':
+                    continue
+                response = await self._handle_request(line)
+                writer.write(json.dumps(response).encode('utf-8') + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_request(self, line: bytes) -> dict:
+        """
+        Optimize the dockerfile of a request inside a worker process.
+
+        :param line: the request line.
+        :return: the response.
+        """
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get('id')
+            content = request['content']
+            name = request.get('name') or '<request>'
+            if not isinstance(content, str) or not isinstance(name, str):
+                raise TypeError('"content" and "name" should be strings')
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            return {'id': request_id, 'error': 'Invalid request: {0!r}'.format(e)}
+
+        loop = asyncio.get_running_loop()
+        try:
+            output, outcome, stat_tuple = await loop.run_in_executor(
+                self.executor, engine._optimize_content_in_worker, content.encode('utf-8'), name)
+        except BrokenProcessPool:
+            logging.error('A worker process died, restarting the worker processes.')
+            self._restart_executor()
+            return {'id': request_id, 'error': 'The worker process died.'}
+        except Exception as e:
+            logging.exception(e)
+            return {'id': request_id, 'error': repr(e)}
+        return {'id': request_id, 'outcome': outcome, 'stats': list(stat_tuple),
+                'content': output.decode('utf-8')}
+
+    async def _watch_settings(self):
+        """
+        Reload "settings.yaml" when it changes, and restart the worker processes with the new settings.
+        If the new settings are illegal, the loaded settings are kept.
+        "settings.yaml" is read and parsed in the default executor, so the requests are not blocked meanwhile,
+        and the new settings are installed in the event loop.
+
+        :return: None
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(OptimizerServer.SETTINGS_POLL_INTERVAL)
+            settings_mtime = self._get_settings_mtime()
+            if settings_mtime == self.settings_mtime:
+                continue
+            self.settings_mtime = settings_mtime
+            try:
+                loaded_settings = await loop.run_in_executor(None, optimization_config.read_optimization_settings)
+            except optimization_config.SettingsError as e:
+                logging.error('Cannot reload the settings "{0}", the loaded settings are kept: {1}'
+                              .format(global_settings.pm_settings_path, e))
+                continue
+            optimization_config.install_optimization_settings(loaded_settings)
+            logging.warning('Reloaded the settings "{0}".'.format(global_settings.pm_settings_path))
+            self._restart_executor()
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        # The workers are started on demand, so they are forked from a fork server rather than from this process,
+        # or else they would inherit the connections open at that time, and the clients would never see them closed
+        return ProcessPoolExecutor(max_workers=self.jobs,
+                                   mp_context=multiprocessing.get_context('forkserver'),
+                                   initializer=engine._init_worker,
+                                   initargs=(engine_settings,
+                                             optimization_config.pm_settings,
+                                             optimization_config.pm_executables,
+                                             optimization_config.global_opt_settings,
+                                             optimization_config.settings_digest))
+
+    def _restart_executor(self):
+        """
+        Replace the worker processes. The requests being handled by the old workers are finished by them.
+
+        :return: None
+        """
+        old_executor = self.executor
+        self.executor = self._create_executor()
+        old_executor.shutdown(wait=False)
+
+    @staticmethod
+    def _get_settings_mtime():
+        try:
+            settings_stat = os.stat(global_settings.pm_settings_path)
+        except OSError:
+            return None
+        return settings_stat.st_mtime_ns, settings_stat.st_size
+
+    def _remove_stale_socket(self):
+        """
+        Remove the socket file left by a server which was not stopped normally.
+        Exit if another server is serving on the socket.
+
+        :return: None
+        """
+        try:
+            if not stat.S_ISSOCK(os.stat(self.socket_path).st_mode):
+                logging.error('"{0}" exists and is not a socket!'.format(self.socket_path))
+                sys.exit(-1)
+        except FileNotFoundError:
+            return
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            try:
+                s.connect(self.socket_path)
+            except OSError:
+                os.remove(self.socket_path)
+                return
+        logging.error('Another server is serving on "{0}"!'.format(self.socket_path))
+        sys.exit(-1)
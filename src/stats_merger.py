@@ -0,0 +1,48 @@
+"""
+Copyright 2022 PandaAwAke
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import logging
+import sys
+
+from config.engine_config import engine_settings
+from model.stats import Stats, stats
+
+
+def merge_stats_dumps(dump_files: list):
+    """
+    Combine the stats dumps (see Stats.write_dump()) into the statistics of all files (model.stats.stats),
+    in the order of dump_files. Then log the report, write it into the stat file, and write the combined
+    stats dump if engine_settings.stats_dump_file is set, the same as the end of Engine.run().
+
+    :param dump_files: the paths of the stats dumps, such as the ones written by the runs of every --shard.
+    :return: None
+    """
+    stats.total_optimization_files.max_files = engine_settings.stats_max_files
+    for dump_file in dump_files:
+        try:
+            stats.merge(Stats.read_dump(dump_file))
+        except (OSError, ValueError) as e:
+            logging.error('Cannot read the stats dump "{0}": {1}'.format(dump_file, e))
+            sys.exit(-1)
+    logging.info('Merged {0} stats dumps.'.format(len(dump_files)))
+
+    logging.warning(stats.total_str())
+    stats.optimization_dict_write_stat_file()
+    if engine_settings.stats_dump_file is not None:
+        try:
+            stats.write_dump(engine_settings.stats_dump_file)
+        except OSError as e:
+            logging.error('Cannot write the stats dump "{0}": {1}'.format(engine_settings.stats_dump_file, e))
+            sys.exit(-1)
@@ -0,0 +1,243 @@
+import io
+import logging
+import os
+import shutil
+import tarfile
+import time
+import zipfile
+
+from util import file_util
+
+# The modes to write the supported archives (see file_util.ARCHIVE_SUFFIXES) with tarfile, None for zip
+_TAR_WRITE_MODES = {
+    '.tar': 'w|',
+    '.tar.gz': 'w|gz',
+    '.tgz': 'w|gz',
+    '.zip': None,
+}
+
+
+def archive_output_path(input_path: str, suffix: str) -> str:
+    """
+    Get the default output archive of an input archive: SUFFIX is inserted before the archive suffix,
+    such as "corpus.optimized.tar.gz" for "corpus.tar.gz".
+
+    :param input_path: the path of the input archive.
+    :param suffix: the suffix of the output, such as ".optimized".
+    :return: the path of the output archive.
+    """
+    archive_suffix = file_util.archive_suffix(input_path)
+    return input_path[:-len(archive_suffix)] + suffix + input_path[-len(archive_suffix):]
+
+
+class ArchiveMember:
+    """
+    A regular file inside an archive.
+
+    -   name: the path of the member inside the archive, with "/" as the separator.
+    -   size: the size of the member in bytes.
+    -   mtime: the modification time of the member (seconds since the epoch).
+    -   mode: the permission bits of the member.
+    -   candidate: False if the member doesn't match the globs or is too large (see iter_archive_members()),
+        such members are not dockerfiles and only copied into the output archive.
+    """
+
+    def __init__(self, name: str, size: int, mtime: float, mode: int, fileobj, candidate: bool = True):
+        self.name = name
+        self.size = size
+        self.mtime = mtime
+        self.mode = mode
+        self.candidate = candidate
+        self._fileobj = fileobj
+
+    def open(self):
+        """
+        Get the file object of the content, which can only be read once. For a tar archive, this should be read
+        before the next member is yielded.
+
+        :return: the file object.
+        """
+        return self._fileobj
+
+    def read(self) -> bytes:
+        """
+        Read the content of the member, see open().
+
+        :return: the content.
+        """
+        with self.open() as f:
+            return f.read()
+
+
+def iter_archive_members(path: str, include_globs: list, exclude_globs: list, max_size: int = 0):
+    """
+    Read the archive sequentially and yield its regular files, without extracting anything to disk.
+    Tar archives (compressed or not) are read as a stream, so only the current member is kept in memory.
+
+    The globs are matched as file_util.walk_dockerfiles(): a glob without "/" is matched with the name of
+    the member or any of its parent directories, or else with the path inside the archive.
+    Members not matching the globs and members larger than max_size are yielded with candidate = False, so that
+    they can be copied without being read into memory. Binary members (see file_util.is_binary_content())
+    are only known after being read: check the candidates with is_candidate_member().
+
+    :param path: the path of the archive.
+    :param include_globs: the globs of the candidate members.
+    :param exclude_globs: the globs of the members and directories which are not candidates.
+    :param max_size: the maximum size of a candidate member in bytes, 0 means no limit.
+    :return: a generator of ArchiveMember, in the order of the archive.
+    """
+    member_filter = _MemberFilter(include_globs, exclude_globs)
+
+    def is_candidate(name: str, size: int) -> bool:
+        if not member_filter.matches(name):
+            return False
+        if 0 < max_size < size:
+            logging.debug('Skipped - {0} - The file is too large.'.format(name))
+            return False
+        return True
+
+    if file_util.archive_suffix(path) == '.zip':
+        with zipfile.ZipFile(path, 'r') as zip_file:
+            for info in zip_file.infolist():
+                if info.is_dir():
+                    continue
+                yield ArchiveMember(name=info.filename, size=info.file_size,
+                                    mtime=time.mktime(info.date_time + (0, 0, -1)),
+                                    mode=(info.external_attr >> 16) & 0o777 or 0o644,
+                                    fileobj=zip_file.open(info),
+                                    candidate=is_candidate(info.filename, info.file_size))
+    else:
+        with tarfile.open(path, 'r|*') as tar_file:
+            for info in tar_file:
+                if not info.isfile():
+                    continue
+                yield ArchiveMember(name=info.name, size=info.size, mtime=info.mtime, mode=info.mode & 0o777,
+                                    fileobj=tar_file.extractfile(info),
+                                    candidate=is_candidate(info.name, info.size))
+
+
+def is_candidate_member(member: ArchiveMember, content: bytes) -> bool:
+    """
+    Check if a member from iter_archive_members() may be a dockerfile: binary members are not.
+
+    :param member: the member.
+    :param content: the content of the member.
+    :return: True if the member is a candidate dockerfile, or else False.
+    """
+    if file_util.is_binary_content(content):
+        logging.debug('Skipped - {0} - The file is binary.'.format(member.name))
+        return False
+    return True
+
+
+class _MemberFilter(object):
+    """
+    Match the paths of the members with the include and exclude globs, see iter_archive_members().
+    """
+
+    def __init__(self, include_globs: list, exclude_globs: list):
+        self.include_name_re = file_util.compile_globs([glob for glob in include_globs if '/' not in glob])
+        self.include_path_re = file_util.compile_globs([glob.strip('/') for glob in include_globs if '/' in glob])
+        self.exclude_name_re = file_util.compile_globs([glob for glob in exclude_globs if '/' not in glob])
+        self.exclude_path_re = file_util.compile_globs([glob.strip('/') for glob in exclude_globs if '/' in glob])
+
+    @staticmethod
+    def _matches(name_re, path_re, name: str, path: str) -> bool:
+        return (name_re is not None and name_re.match(name) is not None) or \
+               (path_re is not None and path_re.match(path) is not None)
+
+    def matches(self, member_name: str) -> bool:
+        path_parts = [part for part in member_name.split('/') if part not in ('', '.')]
+        if len(path_parts) == 0:
+            return False
+        # The member is skipped if any of its parent directories is excluded, as if they were pruned
+        for i in range(len(path_parts)):
+            if self._matches(self.exclude_name_re, self.exclude_path_re,
+                             path_parts[i], '/'.join(path_parts[:i + 1])):
+                return False
+        return self._matches(self.include_name_re, self.include_path_re, path_parts[-1], '/'.join(path_parts))
+
+
+class ArchiveWriter(object):
+    """
+    Write the output members into an archive sequentially. The format is decided by the suffix of the path
+    (see file_util.is_archive()), so it can differ from the input archive.
+    The archive is written into a temporary file first, which replaces the path when the writer is closed.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize the writer and create the temporary file.
+
+        :param path: the path of the output archive.
+        """
+        self.path = path
+        self.tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        tar_mode = _TAR_WRITE_MODES[file_util.archive_suffix(path)]
+        if tar_mode is None:
+            self.archive = zipfile.ZipFile(self.tmp_path, 'w', compression=zipfile.ZIP_DEFLATED)
+        else:
+            self.archive = tarfile.open(self.tmp_path, tar_mode, format=tarfile.PAX_FORMAT)
+
+    def add(self, member: ArchiveMember, content: bytes):
+        """
+        Add a member. The name, mtime and mode of the input member are kept.
+
+        :param member: the input member.
+        :param content: the content of the output member.
+        :return: None
+        """
+        if isinstance(self.archive, zipfile.ZipFile):
+            self.archive.writestr(self._zip_info(member, len(content)), content)
+        else:
+            self.archive.addfile(self._tar_info(member, len(content)), io.BytesIO(content))
+
+    def copy(self, member: ArchiveMember):
+        """
+        Copy an input member as it is, its content is streamed from the input archive without being read
+        into memory (see ArchiveMember.open()).
+
+        :param member: the input member.
+        :return: None
+        """
+        with member.open() as f:
+            if isinstance(self.archive, zipfile.ZipFile):
+                with self.archive.open(self._zip_info(member, member.size), 'w') as output:
+                    shutil.copyfileobj(f, output)
+            else:
+                self.archive.addfile(self._tar_info(member, member.size), f)
+
+    @staticmethod
+    def _zip_info(member: ArchiveMember, size: int) -> zipfile.ZipInfo:
+        date_time = time.localtime(max(member.mtime, 315532800))[:6]    # Zip timestamps start from 1980
+        info = zipfile.ZipInfo(filename=member.name, date_time=date_time)
+        info.external_attr = (0o100000 | member.mode) << 16
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.file_size = size   # Decides whether the zip64 extension is needed
+        return info
+
+    @staticmethod
+    def _tar_info(member: ArchiveMember, size: int) -> tarfile.TarInfo:
+        info = tarfile.TarInfo(name=member.name)
+        info.size = size
+        info.mtime = member.mtime
+        info.mode = member.mode
+        return info
+
+    def close(self):
+        """
+        Finish the archive, and move it to the path.
+
+        :return: None
+        """
+        self.archive.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        """
+        Discard the archive, the path is not touched.
+
+        :return: None
+        """
+        self.archive.close()
+        os.remove(self.tmp_path)
@@ -1,12 +1,12 @@
 import logging
+import re
 
-import dockerfile_parse.util
-
-from config.optimization_config import pm_settings
 from model import handle_error
 from model.global_status import GlobalStatus
 from util import str_util
 
+logger = logging.getLogger(__name__)
+
 
 def replace_home_char(path: str, global_status: GlobalStatus) -> str:
     """
@@ -33,26 +33,48 @@ def get_absolute_path(path: str, global_status: GlobalStatus) -> str:
     return global_status.work_dir + path
 
 
+# Matches an escaped "$", or a variable: "$VAR", "${VAR}", "${VAR:-word}" or "${VAR:+word}".
+# The word may contain variables without nested braces, such as "${VAR:-${HOME}/.cache}".
+_variable_re = re.compile(r'\\\$|\$(?:\{(?P<braced>[A-Za-z_][A-Za-z0-9_]*)'
+                          r'(?:(?P<modifier>:[-+])(?P<word>(?:\$\{[^{}]*\}|[^{}])*))?\}'
+                          r'|(?P<name>[A-Za-z_][A-Za-z0-9_]*))')
+
+
 def substitute_env(s: str, context) -> str:
     """
-    Substitute environment variables inside s using context.
+    Substitute environment variables (ENV) and build arguments (ARG) inside s using context,
+    in a single pass. ENV takes precedence over ARG, as Docker does.
+
+    -   "$VAR" and "${VAR}" are replaced with the value, or kept when VAR is unknown
+        (for example, a shell variable or an ARG without a default value).
+    -   "${VAR:-word}" is replaced with word when VAR is unknown or empty, or else the value.
+    -   "${VAR:+word}" is replaced with word when VAR is set and not empty, or else "".
+    -   Escaped "\\$" is kept as it is.
 
     :param s: the string to be processed.
     :param context: the context object of this instruction.
     :return: processed string.
     """
-    if context is None or not isinstance(context, dockerfile_parse.util.Context):
+    if context is None or not hasattr(context, 'envs') or '$' not in s:
         return s
-    need_to_substitute_keys = []
-    for key, _ in context.envs.items():
-        if (s.find('${' + key + '}') != -1 or s.find('$' + key) != -1) and \
-                key not in need_to_substitute_keys:
-            need_to_substitute_keys.append(key)
-    for key in need_to_substitute_keys:
-        value = context.envs[key]
-        s = s.replace('${' + key + '}', value)
-        s = s.replace('$' + key, value)
-    return s
+    envs, args = context.envs, context.args
+
+    def replace(match_result) -> str:
+        name = match_result.group('name') or match_result.group('braced')
+        if name is None:    # Escaped "$"
+            return match_result.group()
+        if name in envs:
+            value = envs[name]
+        else:
+            value = args.get(name)     # None for an ARG without a default value, which is unknown
+        modifier = match_result.group('modifier')
+        if modifier == ':-':
+            return value if value else _variable_re.sub(replace, match_result.group('word'))
+        if modifier == ':+':
+            return _variable_re.sub(replace, match_result.group('word')) if value else ''
+        return value if value is not None else match_result.group()
+
+    return _variable_re.sub(replace, s)
 
 
 def get_mount_target_dirs(instruction, context) -> list:
@@ -64,15 +86,15 @@ def get_mount_target_dirs(instruction, context) -> list:
     while find_index != -1:
         target_dir_index = run_options_str.find('target=', find_index)
         if target_dir_index == -1:
-            logging.error('Cannot find the target directory in existing --mount=type=cache RUN instruction: '
-                          '"{0}"'.format(instruction['content']))
+            logger.error('Cannot find the target directory in existing --mount=type=cache RUN instruction: '
+                         '"{0}"'.format(instruction['content']))
             raise handle_error.HandleError()
 
         # Get target_dir
         space_index = run_options_str.find(' ', target_dir_index)
         if space_index == -1:
-            logging.error('Illegal --mount=type=cache instruction format: '
-                          '"{0}"'.format(instruction['content']))
+            logger.error('Illegal --mount=type=cache instruction format: '
+                         '"{0}"'.format(instruction['content']))
             raise handle_error.HandleError()
         target_dir = run_options_str[target_dir_index + len('target='):space_index]
         target_dir = substitute_env(target_dir, context)
@@ -83,9 +105,9 @@ def get_mount_target_dirs(instruction, context) -> list:
     return existing_target_dirs
 
 
-def get_context_default_cache_dirs(pm_name: str, global_status: GlobalStatus):
+def get_context_default_cache_dirs(default_cache_dirs: list, global_status: GlobalStatus):
     return [
         replace_home_char(cache_dir, global_status)
-        for cache_dir in pm_settings[pm_name].default_cache_dirs
+        for cache_dir in default_cache_dirs
     ]
 
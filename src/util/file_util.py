@@ -0,0 +1,178 @@
+import fnmatch
+import hashlib
+import logging
+import os
+import re
+
+DEFAULT_INCLUDE_GLOBS = ['Dockerfile*', '*.Dockerfile', 'Containerfile']
+DEFAULT_EXCLUDE_GLOBS = ['.git', '.hg', '.svn', 'node_modules', '__pycache__']
+ARCHIVE_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.zip')     # Read and written by util.archive_util
+
+_BINARY_SNIFF_SIZE = 8192   # Number of bytes read to determine if a file is binary
+
+
+def compile_globs(globs: list):
+    """
+    Compile the globs into one case-insensitive regular expression.
+
+    :param globs: a list of globs, such as ["Dockerfile*", "*.Dockerfile"].
+    :return: the compiled regular expression, or None if globs is empty.
+    """
+    if len(globs) == 0:
+        return None
+    return re.compile('|'.join(fnmatch.translate(glob) for glob in globs), re.IGNORECASE)
+
+
+def is_binary_file(path: str) -> bool:
+    """
+    Sniff the beginning of the file: a file containing NUL bytes is considered as binary.
+
+    :param path: the path of the file.
+    :return: True if the file is binary, or else False.
+    """
+    with open(file=path, mode='rb') as f:
+        return is_binary_content(f.read(_BINARY_SNIFF_SIZE))
+
+
+def is_binary_content(content: bytes) -> bool:
+    """
+    The same as is_binary_file(), but sniff the content of a file in memory.
+
+    :param content: the content of the file.
+    :return: True if the content is binary, or else False.
+    """
+    return b'\0' in content[:_BINARY_SNIFF_SIZE]
+
+
+def archive_suffix(path: str):
+    """
+    Get the suffix of the path if it is a supported archive (see ARCHIVE_SUFFIXES), case-insensitive.
+
+    :param path: the path.
+    :return: the suffix (lower-case), or None if the path is not an archive.
+    """
+    lower_path = path.lower()
+    for suffix in ARCHIVE_SUFFIXES:
+        if lower_path.endswith(suffix):
+            return suffix
+    return None
+
+
+def is_archive(path: str) -> bool:
+    """
+    Check if the path is a supported archive by its suffix (see ARCHIVE_SUFFIXES).
+
+    :param path: the path.
+    :return: True if the path is an archive, or else False.
+    """
+    return archive_suffix(path) is not None
+
+
+def in_shard(relative_path: str, shard) -> bool:
+    """
+    Decide if a file belongs to a shard, by the hash of its path relative to the input directory (or its name
+    inside the input archive). The hash doesn't depend on the host or the process, so the shards of the same input
+    on different hosts never overlap, and together they cover all files.
+
+    :param relative_path: the relative path of the file, with "/" or os.sep as the separator.
+    :param shard: (index, count), the index is from 1 to count. None means all files.
+    :return: True if the file belongs to the shard, or else False.
+    """
+    if shard is None:
+        return True
+    index, count = shard
+    digest = hashlib.sha1(relative_path.replace(os.sep, '/').encode('utf-8', 'surrogateescape')).digest()
+    return int.from_bytes(digest[:8], 'big') % count == index - 1
+
+
+def walk_dockerfiles(input_dir: str, include_globs: list, exclude_globs: list, max_size: int = 0):
+    """
+    Walk input_dir recursively and yield the candidate dockerfiles, using os.scandir().
+    The entries of every directory are visited in the order of their names: files first, and then sub-directories.
+
+    A glob without "/" is matched with the name of an entry, or else with the path relative to input_dir.
+    -   Files are yielded only if they match include_globs, but not exclude_globs.
+    -   Directories matching exclude_globs are pruned. Symbolic links to directories are not followed.
+    -   Files larger than max_size, and binary files (see is_binary_file()) are skipped.
+
+    :param input_dir: the input directory.
+    :param include_globs: the globs of the files to yield.
+    :param exclude_globs: the globs of the files and directories to skip.
+    :param max_size: the maximum size of a file in bytes, 0 means no limit.
+    :return: a generator of the paths of the candidate dockerfiles.
+    """
+    for entry in walk_dockerfile_entries(input_dir, include_globs, exclude_globs):
+        if is_candidate_file(entry, max_size):
+            yield entry.path
+
+
+def walk_dockerfile_entries(input_dir: str, include_globs: list, exclude_globs: list):
+    """
+    The same as walk_dockerfiles(), but yield the os.DirEntry of every file matching the globs,
+    without checking its size and content (see is_candidate_file()).
+    The results of DirEntry.stat() are cached, so it's cheap to poll the files with this.
+
+    :param input_dir: the input directory.
+    :param include_globs: the globs of the files to yield.
+    :param exclude_globs: the globs of the files and directories to skip.
+    :return: a generator of os.DirEntry.
+    """
+    include_name_re = compile_globs([glob for glob in include_globs if '/' not in glob])
+    include_path_re = compile_globs([glob.strip('/') for glob in include_globs if '/' in glob])
+    exclude_name_re = compile_globs([glob for glob in exclude_globs if '/' not in glob])
+    exclude_path_re = compile_globs([glob.strip('/') for glob in exclude_globs if '/' in glob])
+
+    def matches(name_re, path_re, entry, relative_path: str) -> bool:
+        return (name_re is not None and name_re.match(entry.name) is not None) or \
+               (path_re is not None and path_re.match(relative_path) is not None)
+
+    pending_dirs = [input_dir]
+    while len(pending_dirs) > 0:
+        current_dir = pending_dirs.pop()
+        try:
+            with os.scandir(current_dir) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError as e:
+            logging.warning('Cannot read the directory "{0}": {1}'.format(current_dir, e))
+            continue
+
+        sub_dirs = []
+        for entry in entries:
+            relative_path = os.path.relpath(entry.path, input_dir).replace(os.sep, '/')
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if not matches(exclude_name_re, exclude_path_re, entry, relative_path):
+                        sub_dirs.append(entry.path)
+                    continue
+                if not entry.is_file() or \
+                        not matches(include_name_re, include_path_re, entry, relative_path) or \
+                        matches(exclude_name_re, exclude_path_re, entry, relative_path):
+                    continue
+            except OSError as e:
+                logging.warning('Cannot read "{0}": {1}'.format(entry.path, e))
+                continue
+            yield entry
+
+        pending_dirs.extend(reversed(sub_dirs))     # Visit the sub-directories in the order of names
+
+
+def is_candidate_file(entry, max_size: int = 0) -> bool:
+    """
+    Check if a file from walk_dockerfile_entries() may be a dockerfile:
+    files larger than max_size, and binary files (see is_binary_file()) are not.
+
+    :param entry: the os.DirEntry of the file.
+    :param max_size: the maximum size of a file in bytes, 0 means no limit.
+    :return: True if the file is a candidate dockerfile, or else False.
+    """
+    try:
+        if 0 < max_size < entry.stat().st_size:
+            logging.debug('Skipped - {0} - The file is too large.'.format(entry.path))
+            return False
+        if is_binary_file(entry.path):
+            logging.debug('Skipped - {0} - The file is binary.'.format(entry.path))
+            return False
+    except OSError as e:
+        logging.warning('Cannot read "{0}": {1}'.format(entry.path, e))
+        return False
+    return True
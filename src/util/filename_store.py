@@ -0,0 +1,195 @@
+import os
+import tempfile
+
+
+class FilenameStore(object):
+    """
+    The filenames of the optimized files, grouped by their statistics tuples (see Stats.one_file_tuple()).
+
+    -   The number of files of every tuple is always kept in memory.
+    -   The filenames are kept in memory until there are SPILL_SIZE of them, and then they are appended to
+        the spill files (one file per tuple, the filenames are separated by NUL) inside a temporary directory,
+        which is deleted when the store is closed or garbage-collected.
+        So a run over millions of files doesn't hold every filename in memory.
+    -   If max_files > 0, at most max_files filenames are recorded for every tuple (the first ones),
+        while the numbers of files are still exact.
+
+    Tuples and filenames are returned in the order they were added.
+    """
+
+    # Number of filenames kept in memory before they are moved into the spill files
+    SPILL_SIZE = 10000
+    # Number of characters read from a spill file at once
+    READ_SIZE = 1024 * 1024
+
+    def __init__(self, max_files: int = 0):
+        """
+        Initialize an empty store.
+
+        :param max_files: the maximum number of filenames recorded for every tuple, 0 means no limit.
+        """
+        self.max_files = max_files
+        self._counts = {}           # Key: stat_tuple; Value: the number of files
+        self._recorded = {}         # Key: stat_tuple; Value: the number of recorded filenames
+        self._memory = {}           # Key: stat_tuple; Value: the filenames not moved into the spill files yet
+        self._memory_size = 0
+        self._spill_dir = None      # tempfile.TemporaryDirectory
+        self._spill_files = {}      # Key: stat_tuple; Value: the path of the spill file
+
+    def __len__(self):
+        return len(self._counts)
+
+    def __getstate__(self):
+        # The spill files belong to this process (such as the stats sent back by worker processes),
+        # so the filenames are moved back into memory
+        state = dict(vars(self))
+        state['_memory'] = self.to_dict()
+        state['_memory_size'] = sum(len(filenames) for filenames in state['_memory'].values())
+        state['_spill_dir'] = None
+        state['_spill_files'] = {}
+        return state
+
+    def add(self, stat_tuple: tuple, filename: str, count: int = 1):
+        """
+        Add a file.
+
+        :param stat_tuple: the statistics tuple of the file.
+        :param filename: the filename, or None to only count the file.
+        :param count: the number of files to count.
+        :return: None
+        """
+        self._counts[stat_tuple] = self._counts.get(stat_tuple, 0) + count
+        if filename is None:
+            return
+        recorded = self._recorded.get(stat_tuple, 0)
+        if 0 < self.max_files <= recorded:
+            return
+        self._recorded[stat_tuple] = recorded + 1
+        filenames = self._memory.get(stat_tuple)
+        if filenames is None:
+            self._memory[stat_tuple] = [filename]
+        else:
+            filenames.append(filename)
+        self._memory_size += 1
+        if self._memory_size >= FilenameStore.SPILL_SIZE:
+            self._spill()
+
+    def remove(self, stat_tuple: tuple, filename: str):
+        """
+        Remove a file added before. Nothing will be done if the file was not added, but if some files of the tuple
+        are not recorded (see max_files), a filename which is not found is assumed to be one of them.
+        Removing a spilled filename rewrites the spill file of the tuple.
+
+        :param stat_tuple: the statistics tuple of the file.
+        :param filename: the filename.
+        :return: None
+        """
+        if stat_tuple not in self._counts:
+            return
+        filenames = self._memory.get(stat_tuple)
+        if filenames is not None and filename in filenames:
+            filenames.remove(filename)
+            self._memory_size -= 1
+            self._recorded[stat_tuple] -= 1
+        elif self._remove_spilled(stat_tuple, filename):
+            self._recorded[stat_tuple] -= 1
+        elif self._counts[stat_tuple] <= self._recorded[stat_tuple]:
+            return  # Every file of the tuple is recorded, so this file was not added
+        self._counts[stat_tuple] -= 1
+        if self._counts[stat_tuple] == 0:
+            del self._counts[stat_tuple]
+            del self._recorded[stat_tuple]
+            self._memory.pop(stat_tuple, None)
+
+    def counts(self) -> dict:
+        """
+        :return: the numbers of files. Key: stat_tuple; Value: the number of files.
+        """
+        return dict(self._counts)
+
+    def filenames(self, stat_tuple: tuple):
+        """
+        Get the recorded filenames of a tuple.
+
+        :param stat_tuple: the statistics tuple.
+        :return: a generator of the filenames, reading the spill file in chunks.
+        """
+        yield from self._read_spill_file(stat_tuple)
+        yield from list(self._memory.get(stat_tuple, []))
+
+    def merge(self, other):
+        """
+        Add all files of other into this store, after the existing ones.
+
+        :param other: another FilenameStore.
+        :return: None
+        """
+        for stat_tuple, count in other.counts().items():
+            recorded = 0
+            for filename in other.filenames(stat_tuple):
+                self.add(stat_tuple, filename)
+                recorded += 1
+            if count > recorded:
+                self.add(stat_tuple, None, count - recorded)
+
+    def to_dict(self) -> dict:
+        """
+        :return: all recorded filenames in memory. Key: stat_tuple; Value: the list of filenames.
+        """
+        return {stat_tuple: list(self.filenames(stat_tuple)) for stat_tuple in self._counts}
+
+    def close(self):
+        """
+        Delete the spill files, and forget all files.
+
+        :return: None
+        """
+        if self._spill_dir is not None:
+            self._spill_dir.cleanup()
+            self._spill_dir = None
+        self._spill_files = {}
+        self._counts = {}
+        self._recorded = {}
+        self._memory = {}
+        self._memory_size = 0
+
+    def _spill(self):
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.TemporaryDirectory(prefix='dpmo-stats-')
+        for stat_tuple, filenames in self._memory.items():
+            spill_file = self._spill_files.get(stat_tuple)
+            if spill_file is None:
+                spill_file = os.path.join(self._spill_dir.name, str(len(self._spill_files)))
+                self._spill_files[stat_tuple] = spill_file
+            with self._open_spill_file(spill_file, 'a') as f:
+                f.write('\0'.join(filenames) + '\0')
+        self._memory = {}
+        self._memory_size = 0
+
+    def _read_spill_file(self, stat_tuple: tuple):
+        spill_file = self._spill_files.get(stat_tuple)
+        if spill_file is None:
+            return
+        with self._open_spill_file(spill_file, 'r') as f:
+            rest = ''
+            while True:
+                chunk = f.read(FilenameStore.READ_SIZE)
+                if chunk == '':
+                    break
+                filenames = (rest + chunk).split('\0')
+                rest = filenames.pop()  # The last filename may be incomplete
+                yield from filenames
+
+    def _remove_spilled(self, stat_tuple: tuple, filename: str) -> bool:
+        filenames = list(self._read_spill_file(stat_tuple))
+        if filename not in filenames:
+            return False
+        filenames.remove(filename)
+        with self._open_spill_file(self._spill_files[stat_tuple], 'w') as f:
+            f.write(''.join(name + '\0' for name in filenames))
+        return True
+
+    @staticmethod
+    def _open_spill_file(path: str, mode: str):
+        # Filenames are not always valid UTF-8 (see os.fsdecode())
+        return open(file=path, mode=mode, encoding='utf-8', errors='surrogateescape', newline='')
@@ -0,0 +1,104 @@
+import json
+import logging
+import os
+
+
+class JsonLinesLog(object):
+    """
+    An append-only file of JSON records, one record per line.
+
+    Every record is appended with a single write() to a file opened with O_APPEND, so worker processes
+    can append to the same file, and a crash can at most truncate the last record.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize the log. The file is opened when the first record is appended.
+
+        :param path: the path of the file.
+        """
+        self.path = path
+        self.fd = None
+
+    def clear(self):
+        """
+        Remove all records of the file.
+
+        :return: None
+        """
+        self.close()
+        open(file=self.path, mode='wb').close()
+
+    def append(self, record: dict):
+        """
+        Append a record.
+
+        :param record: the JSON-serializable record.
+        :return: None
+        """
+        if self.fd is None:
+            self._open()
+        os.write(self.fd, (json.dumps(record) + '\n').encode('utf-8'))
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def _open(self):
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        # A crash may leave a truncated record without the line ending, don't append to it
+        size = os.fstat(self.fd).st_size
+        if size > 0:
+            with open(file=self.path, mode='rb') as f:
+                f.seek(size - 1)
+                if f.read(1) != b'\n':
+                    os.write(self.fd, b'\n')
+
+
+class Journal(JsonLinesLog):
+    """
+    An append-only journal of the finished files, so an interrupted run can be resumed.
+
+    -   Every line is a JSON record: {"path": ..., "outcome": ..., "stats": [...], "duration": ...}.
+        The path is absolute (the name of the member for an archive INPUT), so the run can be resumed
+        from another working directory.
+    -   Worker processes can append to the same journal, see JsonLinesLog.
+    """
+
+    def load(self) -> dict:
+        """
+        Load the records of the journal. Broken records (such as a record truncated by a crash) are ignored.
+
+        :return: a dict of the records in the order they were appended.
+                Key: path; Value: (outcome, stat_tuple, duration). If a path was recorded more than once,
+                the last record wins.
+        """
+        records = {}
+        try:
+            f = open(file=self.path, mode='r', encoding='utf-8')
+        except FileNotFoundError:
+            return records
+        with f:
+            for line_number, line in enumerate(f, start=1):
+                try:
+                    record = json.loads(line)
+                    path = record['path']
+                    records.pop(path, None)     # Keep the order of the last record
+                    records[path] = (record['outcome'], tuple(record['stats']), record['duration'])
+                except (ValueError, KeyError, TypeError):
+                    logging.warning('Ignored the broken record at line {0} of the journal "{1}".'
+                                    .format(line_number, self.path))
+        return records
+
+    def record(self, path: str, outcome: str, stat_tuple: tuple, duration: float):
+        """
+        Append the record of a finished file.
+
+        :param path: the path of the file.
+        :param outcome: the outcome of the file.
+        :param stat_tuple: the statistics tuple of the file (Stats.one_file_tuple()).
+        :param duration: the time to process the file, in seconds.
+        :return: None
+        """
+        self.append({'path': path, 'outcome': outcome, 'stats': list(stat_tuple), 'duration': round(duration, 6)})
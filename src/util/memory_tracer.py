@@ -0,0 +1,212 @@
+import array
+import heapq
+import math
+import tracemalloc
+
+from util.phase_timer import PhaseTimer
+
+
+class MemoryTracer(PhaseTimer):
+    """
+    Measure the memory allocated by every phase of processing a dockerfile with tracemalloc, besides the durations
+    of the phases (see PhaseTimer).
+
+    A snapshot of the traced memory is taken at the start of every file and at the end of every phase
+    (every lap()), and the memory allocated during the phase but not freed at its end is added to the allocation
+    site (the file and line) in the phase. The last phase is "finish", from the end of the pipeline to finish(),
+    which covers the result cache and the statistics.
+    For every file, the peak is the highest traced memory above the traced memory at its start.
+
+    tracemalloc only traces the memory allocated after start_tracing(), and slows everything down,
+    so it should only be used when the memory is being investigated.
+    """
+
+    FINISH_PHASE = 'finish'
+    # Number of frames of the tracebacks, only the innermost frame is used as the allocation site
+    TRACEBACK_FRAMES = 1
+    # Number of the files with the largest peaks in the report
+    LARGEST_FILES_NUM = 10
+    # Number of the allocation sites in the report
+    TOP_SITES_NUM = 30
+
+    def __init__(self):
+        super().__init__()
+        # Key: (phase, filename, line); Value: [size in bytes, number of blocks] allocated and not freed
+        self.sites = {}
+        # The peaks of all files in bytes, and a min-heap of (peak, filename) of the files with the largest peaks
+        self.total_peaks = array.array('q')
+        self.largest_files = []
+        # The peak of the last finished file in bytes
+        self.file_peak = 0
+        self._base_size = 0
+        self._last_statistics = {}
+        # The allocations of tracemalloc and this tracer are left out
+        self._ignored_files = {tracemalloc.__file__, __file__}
+
+    @staticmethod
+    def start_tracing():
+        """
+        Start tracing the memory allocations, if they are not traced yet.
+
+        :return: None
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(MemoryTracer.TRACEBACK_FRAMES)
+
+    @staticmethod
+    def stop_tracing():
+        """
+        Stop tracing the memory allocations, and free the traces.
+
+        :return: None
+        """
+        tracemalloc.stop()
+
+    def start(self):
+        """
+        Start processing a file, it should be ended by finish() or reset().
+
+        :return: None
+        """
+        super().start()
+        self.file_peak = 0
+        self._last_statistics = self._take_statistics()
+        self._base_size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+
+    def lap(self, phase: str):
+        """
+        End a phase, and record its peak and its allocation sites.
+
+        :param phase: the phase which is ended, one of PHASES.
+        :return: None
+        """
+        super().lap(phase)
+        self._end_phase(phase)
+
+    def finish(self, filename: str):
+        """
+        End the "finish" phase and the file, and record the peak of the file.
+
+        :param filename: the name of the file.
+        :return: None
+        """
+        self._end_phase(MemoryTracer.FINISH_PHASE)
+        self._last_statistics = {}
+        self.total_peaks.append(self.file_peak)
+        if len(self.largest_files) < MemoryTracer.LARGEST_FILES_NUM:
+            heapq.heappush(self.largest_files, (self.file_peak, filename))
+        elif self.file_peak > self.largest_files[0][0]:
+            heapq.heapreplace(self.largest_files, (self.file_peak, filename))
+
+    def reset(self):
+        """
+        Discard the file being processed without recording it, such as a file interrupted by an exception.
+
+        :return: None
+        """
+        self._last_statistics = {}
+        self.file_peak = 0
+
+    def detach(self):
+        """
+        Get the records of the files finished so far, and clear them.
+
+        :return: (total_peaks, largest_files, sites), which can be passed to merge().
+        """
+        records = (self.total_peaks, self.largest_files, self.sites)
+        self.total_peaks = array.array('q')
+        self.largest_files = []
+        self.sites = {}
+        return records
+
+    def merge(self, records):
+        """
+        Add the records detached from another tracer (such as the one of a worker process).
+
+        :param records: (total_peaks, largest_files, sites) returned by detach().
+        :return: None
+        """
+        total_peaks, largest_files, sites = records
+        self.total_peaks.extend(total_peaks)
+        for file_peak, filename in largest_files:
+            if len(self.largest_files) < MemoryTracer.LARGEST_FILES_NUM:
+                heapq.heappush(self.largest_files, (file_peak, filename))
+            elif file_peak > self.largest_files[0][0]:
+                heapq.heapreplace(self.largest_files, (file_peak, filename))
+        for key, (size, count) in sites.items():
+            site = self.sites.setdefault(key, [0, 0])
+            site[0] += size
+            site[1] += count
+
+    def peaks_str(self) -> str:
+        """
+        :return: the percentiles of the peaks of all files, or an empty string if no file is traced.
+        """
+        if len(self.total_peaks) == 0:
+            return ''
+        peaks = sorted(self.total_peaks)
+
+        def percentile(p: int) -> int:    # The nearest-rank method, the same as Stats.durations_str()
+            return peaks[max(math.ceil(p / 100 * len(peaks)) - 1, 0)]
+
+        return 'Peak memory of files: p50 {}, p95 {}, p99 {}, max {}'.format(
+            _size_str(percentile(50)), _size_str(percentile(95)), _size_str(percentile(99)), _size_str(peaks[-1]))
+
+    def write_report(self, path: str):
+        """
+        Write the peaks of the files, the files with the largest peaks and the top allocation sites into path.
+
+        :param path: the path of the report.
+        :return: None
+        """
+        top_sites = heapq.nlargest(MemoryTracer.TOP_SITES_NUM, self.sites.items(), key=lambda item: item[1][0])
+        with open(file=path, mode='w', encoding='utf-8') as f:
+            f.write('-----------------[Memory]-----------------\n'
+                    ' - Traced files: {}\n'
+                    ' - {}\n'
+                    ' - Files with the largest peaks:\n'
+                    .format(len(self.total_peaks), self.peaks_str()))
+            f.writelines('   {}\t{}\n'.format(_size_str(file_peak), filename)
+                         for file_peak, filename in sorted(self.largest_files, reverse=True))
+            f.write('------------------------------------------\n'
+                    ' - Top allocation sites (allocated and not freed within the phase, summed over all files):\n'
+                    '   Size\tBlocks\tPhase\tSite\n')
+            f.writelines('   {}\t{}\t{}\t{}:{}\n'.format(_size_str(size), count, phase, filename, line)
+                         for (phase, filename, line), (size, count) in top_sites)
+
+    def _end_phase(self, phase: str):
+        _, peak_size = tracemalloc.get_traced_memory()
+        self.file_peak = max(self.file_peak, peak_size - self._base_size)
+        statistics = self._take_statistics()
+        for site, (size, count) in statistics.items():
+            last_size, last_count = self._last_statistics.get(site, (0, 0))
+            if size > last_size:
+                key = (phase,) + site
+                record = self.sites.setdefault(key, [0, 0])
+                record[0] += size - last_size
+                record[1] += max(count - last_count, 0)
+        self._last_statistics = statistics
+        tracemalloc.reset_peak()
+
+    def _take_statistics(self) -> dict:
+        """
+        Take a snapshot of the traced memory, and group it by the allocation sites.
+
+        Snapshot.statistics() groups the traces in Python, so it costs time linear in the number of live
+        allocations (several times the cost of taking the snapshot) at the start of every file and at the end of
+        every phase, which is most of the slowdown of --memtrace. The sites are filtered after being grouped,
+        filtering the traces with Snapshot.filter_traces() first would cost another pass over them.
+
+        :return: Key: (filename, line); Value: (size in bytes, number of blocks).
+        """
+        statistics = {}
+        for statistic in tracemalloc.take_snapshot().statistics('lineno'):
+            frame = statistic.traceback[0]
+            if frame.filename not in self._ignored_files:
+                statistics[(frame.filename, frame.lineno)] = (statistic.size, statistic.count)
+        return statistics
+
+
+def _size_str(size: int) -> str:
+    return '{:.1f}KiB'.format(size / 1024)
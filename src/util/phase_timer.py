@@ -0,0 +1,44 @@
+import time
+
+
+class PhaseTimer(object):
+    """
+    Measure how long every phase of optimizing a dockerfile takes.
+
+    The pipeline calls lap(phase) at the end of every phase, and the time since the previous lap
+    (or since start()) is added to the phase, so a phase entered several times (such as "simulate"
+    for every stage) is accumulated. The phases are:
+
+    -   parse: reading the dockerfile (including the result cache lookup and the prefilter),
+        and splitting it into stages (DockerfileReader, StageSplitter).
+    -   simulate: StageSimulator.
+    -   optimize: StageOptimizer.
+    -   global_optimize: GlobalOptimizer.
+    -   write: DockerfileWriter.
+    """
+
+    PHASES = ('parse', 'simulate', 'optimize', 'global_optimize', 'write')
+
+    def __init__(self):
+        self.durations = dict.fromkeys(PhaseTimer.PHASES, 0.0)
+        self._last_time = time.perf_counter()
+
+    def start(self):
+        """
+        Clear the durations of all phases, and start timing the first phase.
+
+        :return: None
+        """
+        self.durations = dict.fromkeys(PhaseTimer.PHASES, 0.0)
+        self._last_time = time.perf_counter()
+
+    def lap(self, phase: str):
+        """
+        End a phase, and start timing the next one.
+
+        :param phase: the phase which is ended, one of PHASES.
+        :return: None
+        """
+        now = time.perf_counter()
+        self.durations[phase] += now - self._last_time
+        self._last_time = now
@@ -0,0 +1,167 @@
+import cProfile
+import marshal
+import os
+import time
+
+
+class PipelineProfiler(object):
+    """
+    Profile the pipeline of every file with cProfile, and aggregate the profiles of all files.
+
+    Only the files whose pipeline takes at least min_duration seconds (measured while being profiled)
+    are kept. The aggregated profile is a pstats dictionary:
+    Key: (filename, line, function); Value: (primitive calls, total calls, self time, cumulative time, callers),
+    in which callers is a dictionary of Key: the calling function; Value: (calls, primitive calls, self time,
+    cumulative time) of the calls from it.
+
+    The profiles of worker processes are sent back with detach(), and combined with merge(),
+    the same as model.stats.Stats.
+    """
+
+    # Calls taking less than this (in seconds) along a stack are left out of the collapsed stacks
+    MIN_STACK_TIME = 1e-6
+    # Maximum depth of the collapsed stacks
+    MAX_STACK_DEPTH = 64
+
+    def __init__(self, min_duration: float = 0.0):
+        """
+        Initialize an empty profile.
+
+        :param min_duration: the minimum duration (in seconds) of the files to keep, 0 means all files.
+        """
+        self.min_duration = min_duration
+        self.profiled_files = 0
+        self.func_stats = {}
+
+    def call(self, func, *args):
+        """
+        Call func with args under the profiler, and keep its profile if it takes at least min_duration.
+
+        :param func: the function to profile, such as Engine._optimize_one_file().
+        :param args: the arguments of func.
+        :return: the return value of func.
+        """
+        profile = cProfile.Profile()
+        start_time = time.perf_counter()
+        profile.enable()
+        try:
+            return func(*args)
+        finally:
+            profile.disable()
+            if time.perf_counter() - start_time >= self.min_duration:
+                profile.create_stats()
+                self._add(1, profile.stats)
+
+    def detach(self):
+        """
+        Get the profile recorded so far, and clear it.
+
+        :return: (profiled_files, func_stats), which can be passed to merge().
+        """
+        profile = (self.profiled_files, self.func_stats)
+        self.profiled_files = 0
+        self.func_stats = {}
+        return profile
+
+    def merge(self, profile):
+        """
+        Add the profile detached from another profiler (such as the one of a worker process).
+
+        :param profile: (profiled_files, func_stats) returned by detach().
+        :return: None
+        """
+        self._add(*profile)
+
+    def write(self, path: str):
+        """
+        Write the aggregated profile into path, which can be read by pstats.Stats (and the tools based on it),
+        and the collapsed stacks into path + ".collapsed" (see collapsed_stacks()).
+        Both files are written into temporary files first, which replace the paths when they are completed.
+
+        :param path: the path of the profile.
+        :return: None
+        """
+        tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(file=tmp_path, mode='wb') as f:
+            marshal.dump(self.func_stats, f)     # The same as pstats.Stats.dump_stats()
+        os.replace(tmp_path, path)
+
+        collapsed_path = path + '.collapsed'
+        tmp_path = '{0}.{1}.tmp'.format(collapsed_path, os.getpid())
+        with open(file=tmp_path, mode='w', encoding='utf-8') as f:
+            for stack, value in self.collapsed_stacks():
+                f.write('{0} {1}\n'.format(';'.join(stack), value))
+        os.replace(tmp_path, collapsed_path)
+
+    def collapsed_stacks(self):
+        """
+        Rebuild the call stacks from the aggregated profile, in the "collapsed" format of flamegraph tools.
+
+        cProfile only records the calls between pairs of functions, so the time of a function is divided among
+        its callers in proportion to the cumulative time of the calls from them. Recursive calls are folded into
+        the outermost call.
+
+        :return: a list of (stack, value), stack is a tuple of the frames from the outermost one, and value is
+                the self time of the innermost frame along the stack, in microseconds.
+        """
+        callees = {}    # Key: function; Value: {callee: cumulative time of the calls to callee}
+        roots = []
+        for func, (_, _, _, _, callers) in self.func_stats.items():
+            if len(callers) == 0:
+                roots.append(func)
+            for caller, caller_stats in callers.items():
+                callees.setdefault(caller, {})[func] = caller_stats[3]
+
+        stacks = {}
+        for root in sorted(roots, key=_frame_name):
+            self._collapse(root, self.func_stats[root][3], (), set(), callees, stacks)
+        return [(stack, round(value * 1e6)) for stack, value in stacks.items() if round(value * 1e6) > 0]
+
+    def _collapse(self, func, time_on_stack: float, stack: tuple, funcs_on_stack: set, callees: dict, stacks: dict):
+        _, _, self_time, cumulative_time, _ = self.func_stats[func]
+        stack = stack + (_frame_name(func),)
+        if cumulative_time <= 0:
+            return
+        ratio = time_on_stack / cumulative_time
+        stacks[stack] = stacks.get(stack, 0.0) + self_time * ratio
+        if len(stack) >= PipelineProfiler.MAX_STACK_DEPTH:
+            return
+        funcs_on_stack.add(func)
+        for callee, callee_time in sorted(callees.get(func, {}).items(), key=lambda item: _frame_name(item[0])):
+            if callee not in funcs_on_stack and callee_time * ratio >= PipelineProfiler.MIN_STACK_TIME:
+                self._collapse(callee, callee_time * ratio, stack, funcs_on_stack, callees, stacks)
+        funcs_on_stack.remove(func)
+
+    def _add(self, profiled_files: int, func_stats: dict):
+        self.profiled_files += profiled_files
+        for func, (cc, nc, tt, ct, callers) in func_stats.items():
+            if func[2].endswith("'_lsprof.Profiler' objects>"):   # Profile.disable() itself
+                continue
+            old_stats = self.func_stats.get(func)
+            if old_stats is None:
+                self.func_stats[func] = (cc, nc, tt, ct, dict(callers))
+                continue
+            old_cc, old_nc, old_tt, old_ct, old_callers = old_stats
+            for caller, caller_stats in callers.items():
+                old_caller_stats = old_callers.get(caller)
+                if old_caller_stats is None:
+                    old_callers[caller] = caller_stats
+                else:
+                    old_callers[caller] = tuple(a + b for a, b in zip(old_caller_stats, caller_stats))
+            self.func_stats[func] = (old_cc + cc, old_nc + nc, old_tt + tt, old_ct + ct, old_callers)
+
+
+def _frame_name(func: tuple) -> str:
+    """
+    Get the frame name of a function in the collapsed stacks, such as "optimize (dockerfile_optimizer.py:58)".
+    ";" separates the frames, so it's replaced by ",".
+
+    :param func: (filename, line, function) of pstats.
+    :return: the frame name.
+    """
+    filename, line, name = func
+    if filename == '~':     # Built-in functions
+        frame = name
+    else:
+        frame = '{0} ({1}:{2})'.format(name, os.path.basename(filename), line)
+    return frame.replace(';', ',')
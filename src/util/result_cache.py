@@ -0,0 +1,147 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+
+class ResultCache(object):
+    """
+    An on-disk cache of optimization results, addressed by the content of the input dockerfile.
+
+    -   The key of an entry is the hash of the input bytes and a salt (the settings which
+        change the output, see engine._result_cache_salt()).
+    -   An entry is a file: a JSON header line {"outcome": ..., "stats": [...]}, followed by the output bytes.
+    -   The size of the cache directory is bounded. When it is exceeded, the least recently used
+        entries (entries with the oldest modification time, which is updated on every hit) are removed.
+    """
+
+    # Prune the cache once the entries stored since the last pruning reach this fraction of max_size
+    PRUNE_FRACTION = 0.1
+
+    def __init__(self, cache_dir: str, max_size: int, salt: bytes = b''):
+        """
+        Initialize the result cache.
+
+        :param cache_dir: the directory of the cache, created when needed.
+        :param max_size: the maximum total size of the entries, in bytes.
+        :param salt: the salt of the keys.
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.salt = salt
+        self.unpruned_size = 0    # Total size of the entries stored since the last pruning
+
+    def get_key(self, content: bytes) -> str:
+        """
+        Get the key of the input content.
+
+        :param content: the bytes of the input dockerfile.
+        :return: the key.
+        """
+        key = hashlib.sha256(self.salt)
+        key.update(content)
+        return key.hexdigest()
+
+    def load(self, key: str, fileobj_out):
+        """
+        Write the cached output of key into fileobj_out.
+
+        :param key: the key from get_key().
+        :param fileobj_out: the output file object (binary mode).
+        :return: (outcome, stat_tuple) when key is cached, or else None.
+        """
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, 'rb') as f:
+                header = json.loads(f.readline())
+                outcome, stat_tuple = header['outcome'], tuple(header['stats'])
+                shutil.copyfileobj(f, fileobj_out)
+            os.utime(entry_path)    # Mark as recently used
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:    # Including: broken entries
+            logging.debug('Ignored the result cache entry "{0}": {1}'.format(entry_path, e))
+            fileobj_out.seek(0)
+            fileobj_out.truncate()
+            return None
+        return outcome, stat_tuple
+
+    def store(self, key: str, fileobj_out, outcome: str, stat_tuple: tuple):
+        """
+        Store the output as the cached result of key.
+
+        :param key: the key from get_key().
+        :param fileobj_out: the output file object (binary mode), read from its current position.
+        :param outcome: the outcome of the file.
+        :param stat_tuple: the statistics tuple of the file (Stats.one_file_tuple()).
+        :return: None
+        """
+        entry_path = self._entry_path(key)
+        header = json.dumps({'outcome': outcome, 'stats': list(stat_tuple)}) + '\n'
+        try:
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(entry_path))
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(header.encode('utf-8'))
+                    shutil.copyfileobj(fileobj_out, f)
+                self.unpruned_size += os.path.getsize(tmp_path)
+                os.replace(tmp_path, entry_path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+        except OSError as e:
+            logging.debug('Cannot store the result cache entry "{0}": {1}'.format(entry_path, e))
+            return
+
+        if self.unpruned_size >= self.max_size * ResultCache.PRUNE_FRACTION:
+            self.prune()
+
+    def prune(self):
+        """
+        Remove the least recently used entries until the total size is no more than max_size.
+        Nothing will be done if no entry was stored since the last pruning.
+
+        :return: None
+        """
+        if self.unpruned_size == 0:
+            return
+        self.unpruned_size = 0
+
+        entries = []    # (mtime, size, path)
+        total_size = 0
+        for sub_dir in self._scandir(self.cache_dir):
+            if not sub_dir.is_dir():
+                continue
+            for entry in self._scandir(sub_dir.path):
+                try:
+                    entry_stat = entry.stat()
+                except OSError:     # Removed by another process
+                    continue
+                entries.append((entry_stat.st_mtime, entry_stat.st_size, entry.path))
+                total_size += entry_stat.st_size
+
+        if total_size <= self.max_size:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
+            if total_size <= self.max_size:
+                break
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    @staticmethod
+    def _scandir(path: str) -> list:
+        try:
+            with os.scandir(path) as it:
+                return list(it)
+        except OSError:
+            return []
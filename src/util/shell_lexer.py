@@ -0,0 +1,322 @@
+import logging
+import re
+
+from model import handle_error
+
+logger = logging.getLogger(__name__)
+
+
+class Token(object):
+    """
+    A token of a shell commands string, with its span [start, end) in the source string.
+    """
+
+    WORD = 0            # Unquoted word (or part of a word)
+    SINGLE_QUOTED = 1   # Content inside single quotes
+    DOUBLE_QUOTED = 2   # Content inside double quotes
+    OPERATOR = 3        # Control operators: &&, ||, ;, ;;, |, |&, &, newline, (, )
+
+    def __init__(self, kind: int, s: str, start: int, end: int):
+        """
+        Initialize the token.
+
+        :param kind: one of Token.WORD, Token.SINGLE_QUOTED, Token.DOUBLE_QUOTED, Token.OPERATOR.
+        :param s: the string of the token. For quoted tokens, this is the content inside the quotes.
+                For WORD tokens, line continuations are removed.
+        :param start: the start index of the token (including quotes) in the source string.
+        :param end: the end index (exclusive) of the token (including quotes) in the source string.
+        """
+        self.kind = kind
+        self.s = s
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return 'Token({0}, {1!r}, {2}, {3})'.format(self.kind, self.s, self.start, self.end)
+
+
+class SimpleCommand(object):
+    """
+    A simple command inside a command list, such as "apt-get install gcc" in "apt-get update && apt-get install gcc".
+    """
+
+    def __init__(self, start: int, end: int, words: list, body_start: int, body_end: int):
+        """
+        Initialize the simple command.
+
+        :param start: the start index of the command in the source string (after the previous connector).
+        :param end: the end index (exclusive) of the command in the source string (before the next connector).
+        :param words: the word tokens of the command. Reserved words of compound commands (if, then, do, ...),
+                grouping brackets and variable assignments before the executable are not included.
+        :param body_start: the start index of the command itself, after the reserved words, grouping brackets
+                and case patterns in front of it, such as after "then" in "then rm -rf x".
+        :param body_end: the end index (exclusive) of the command itself, before the grouping brackets after it.
+                The command should only be rewritten inside [body_start, body_end), which is empty if the
+                command is only shell syntax, such as "fi" or the header of "for".
+        """
+        self.start = start
+        self.end = end
+        self.words = words
+        self.body_start = body_start
+        self.body_end = body_end
+
+
+# Connectors between simple commands, longer operators first
+CONNECTORS = ('&&', '||', ';;', '|&', ';', '|', '&', '\n')
+_OPERATOR_CHARS = ';&|()\n'
+_BLANK_CHARS = ' \t\r\f\v'
+
+# Reserved words which can start a command, but are not the executable
+_RESERVED_WORDS = ('!', '{', '}', 'if', 'then', 'elif', 'else', 'fi', 'do', 'done', 'while', 'until', 'esac')
+
+_plain_re = re.compile(r'[^\s\'"\\;&|()`$<>#]+')
+_double_quoted_re = re.compile(r'(?:[^"\\]|\\[\s\S])*"')
+_assignment_re = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*=')
+# Line continuation of dockerfiles, blanks (and '\r' of CRLF) are allowed after the backslash
+_continuation_re = re.compile(r'\\[ \t\r]*\n')
+
+
+def tokenize(s: str, start: int = 0, end: int = None) -> list:
+    """
+    Split the shell commands string into tokens in a single linear pass.
+
+    -   Quoted strings are separate tokens, for example 'echo "a b"' is [WORD(echo), DOUBLE_QUOTED(a b)].
+    -   Command substitutions ($(...) and `...`) and redirections (>&2, &>file) belong to the words.
+    -   Line continuations (backslash-newline, see _continuation_re) are ignored, comments are skipped.
+
+    :param s: the shell commands string.
+    :param start: only tokenize s[start: end], the spans of tokens are still the indices of s.
+    :param end: only tokenize s[start: end], None means len(s).
+    :return: a list of Tokens.
+    """
+    tokens = []
+    n = len(s) if end is None else end
+    i = start
+    word_start = -1     # Start index of the current unquoted word, or -1 when not in a word
+
+    def end_word():
+        nonlocal word_start
+        if word_start != -1:
+            word = s[word_start:i]
+            if '\n' in word:
+                word = _continuation_re.sub('', word)
+            if word != '':
+                tokens.append(Token(Token.WORD, word, word_start, i))
+            word_start = -1
+
+    while i < n:
+        c = s[i]
+        if c in _BLANK_CHARS:
+            end_word()
+            i += 1
+        elif c == '\\':
+            match = _continuation_re.match(s, i, n)
+            if match:
+                i = match.end()     # Line continuation, between words or inside a word
+                continue
+            if word_start == -1:
+                word_start = i
+            i = min(i + 2, n)
+        elif c == "'" or c == '"':
+            end_word()
+            if c == "'":
+                quote_end = s.find("'", i + 1, n) + 1
+            else:
+                match = _double_quoted_re.match(s, i + 1, n)
+                quote_end = match.end() if match else 0
+            if quote_end == 0:
+                logger.error('Illegal RUN command: "{0}"'.format(s[start: n]))
+                raise handle_error.HandleError()
+            tokens.append(Token(Token.SINGLE_QUOTED if c == "'" else Token.DOUBLE_QUOTED,
+                                s[i + 1: quote_end - 1], i, quote_end))
+            i = quote_end
+        elif c == '#' and word_start == -1 and \
+                (i == start or s[i - 1] in _BLANK_CHARS or s[i - 1] in _OPERATOR_CHARS):
+            # Comment, until the end of the line (line continuations don't end it)
+            comment_end = s.find('\n', i, n)
+            while comment_end > 0 and s[comment_end - 1] == '\\':
+                comment_end = s.find('\n', comment_end + 1, n)
+            i = n if comment_end == -1 else comment_end
+        elif c in _OPERATOR_CHARS and not (c == '&' and s.startswith('>', i + 1, n)):
+            end_word()
+            operator = c
+            if c != '\n' and c != '(' and c != ')':
+                for connector in CONNECTORS:
+                    if s.startswith(connector, i, n):
+                        operator = connector
+                        break
+            tokens.append(Token(Token.OPERATOR, operator, i, i + len(operator)))
+            i += len(operator)
+        else:
+            if word_start == -1:
+                word_start = i
+            if c == '$' and s.startswith('(', i + 1, n):
+                i = _match_bracket(s, i + 1, n)
+            elif c == '`':
+                backtick_end = s.find('`', i + 1, n)
+                i = i + 1 if backtick_end == -1 else backtick_end + 1
+            elif c in '<>&':    # Redirections, such as 2>&1, &>file, >|file
+                i += 2 if s.startswith(('&', '|'), i + 1, n) else 1
+            else:
+                match = _plain_re.match(s, i, n)
+                i = match.end() if match else i + 1
+    end_word()
+    return tokens
+
+
+def _match_bracket(s: str, start: int, n: int) -> int:
+    """
+    Find the end of the bracket starting at s[start] (which is '('), quotes and nested brackets are considered.
+
+    :param s: the string to search.
+    :param start: the index of '('.
+    :param n: the end index of the search.
+    :return: the index after the matched ')', or n if it's not closed.
+    """
+    depth = 0
+    i = start
+    while i < n:
+        c = s[i]
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        elif c == '\\':
+            i += 1
+        elif c == "'":
+            quote_end = s.find("'", i + 1, n)
+            i = n if quote_end == -1 else quote_end
+        elif c == '"':
+            match = _double_quoted_re.match(s, i + 1, n)
+            i = match.end() - 1 if match else n
+        i += 1
+    return n
+
+
+def parse_command_list(s: str, start: int = 0, end: int = None):
+    """
+    Parse the shell commands string into simple commands and connectors between them.
+    This is a simplified POSIX shell command list grammar:
+    -   Commands are separated by connectors: &&, ||, ;, ;;, |, |&, & and newline.
+    -   Subshells and groups ("( ... )", "{ ...; }") are flattened, their commands are commands of the list.
+    -   Reserved words of compound commands (if/then/elif/else/fi, while/until/do/done) are skipped,
+        headers of "for"/"select" have no words, and patterns of "case" items are skipped.
+    -   Variable assignments before the executable are skipped, for example "A=1 B=2 make".
+
+    Examples:
+    ->  apt-get update && apt-get install gcc
+    <-  [SimpleCommand('apt-get update '), SimpleCommand(' apt-get install gcc')], ['&&']
+    ->  if true; then curl x | sh; fi
+    <-  [SimpleCommand('if true'), SimpleCommand(' then curl x '), SimpleCommand(' sh'), SimpleCommand(' fi')],
+        [';', '|', ';'], the bodies of the commands are 'true', ' curl x ', ' sh' and ''.
+
+    :param s: the shell commands string.
+    :param start: only parse s[start: end], the spans of commands are still the indices of s.
+    :param end: only parse s[start: end], None means len(s).
+    :return: (commands, connectors).
+            commands is a list of SimpleCommands, the text of a command is s[command.start: command.end].
+            connectors is a list of connector Tokens between commands, len(connectors) == len(commands) - 1.
+    """
+    commands = []
+    connectors = []
+    case_depth = 0              # The number of unclosed "case" commands
+    in_case_header = False      # Between "case" and "in"
+    in_case_pattern = False     # Inside the pattern of a case item, such as "a|b)"
+
+    end = len(s) if end is None else end
+    segment_start = start
+    segment_tokens = []
+    prefix_end = start          # The end of the case header and patterns skipped in the current command
+    command_started = False     # Whether the current command has tokens except reserved words
+    for token in tokenize(s, start, end) + [None]:
+        if token is not None:
+            if in_case_header:
+                in_case_header = not (token.kind == Token.WORD and token.s == 'in')
+                in_case_pattern = not in_case_header
+                prefix_end = token.end
+                continue
+            if in_case_pattern:
+                if token.kind == Token.WORD and token.s == 'esac':
+                    case_depth -= 1
+                    in_case_pattern = False
+                elif token.kind == Token.OPERATOR and token.s == ')':
+                    in_case_pattern = False
+                prefix_end = token.end
+                continue
+            if token.kind == Token.WORD and not command_started:
+                if token.s == 'case':
+                    case_depth += 1
+                    in_case_header = True
+                    prefix_end = token.end
+                    continue
+                if token.s == 'esac' and case_depth > 0:
+                    case_depth -= 1
+            if not (token.kind == Token.OPERATOR and token.s in CONNECTORS):
+                segment_tokens.append(token)
+                command_started = command_started or not (token.kind == Token.WORD and token.s in _RESERVED_WORDS)
+                continue
+
+        commands.append(_simple_command(segment_start, end if token is None else token.start,
+                                        segment_tokens, prefix_end))
+        if token is not None:
+            connectors.append(token)
+            segment_start = token.end
+            prefix_end = token.end
+            segment_tokens = []
+            command_started = False
+            in_case_pattern = token.s == ';;' and case_depth > 0
+    return commands, connectors
+
+
+def _simple_command(start: int, end: int, tokens: list, prefix_end: int) -> SimpleCommand:
+    """
+    Build a simple command from its tokens.
+    Grouping brackets, reserved words and the header of "for"/"select" in front of the command, and grouping
+    brackets after it are not part of its body. Variable assignments before the executable are part of the body,
+    but not of the words.
+
+    :param start: the start index of the command (after the previous connector).
+    :param end: the end index (exclusive) of the command (before the next connector).
+    :param tokens: the tokens between two connectors, except the skipped case header and patterns.
+    :param prefix_end: the end of the skipped case header and patterns, or else start.
+    :return: the SimpleCommand.
+    """
+    body_first = 0
+    while body_first < len(tokens):
+        token = tokens[body_first]
+        if token.kind == Token.OPERATOR or (token.kind == Token.WORD and token.s in _RESERVED_WORDS):
+            body_first += 1
+        elif token.kind == Token.WORD and token.s in ('for', 'select'):
+            body_first = len(tokens)
+        else:
+            break
+    body_last = len(tokens)
+    while body_last > body_first and tokens[body_last - 1].kind == Token.OPERATOR:
+        body_last -= 1
+
+    body_start = max(prefix_end, tokens[body_first - 1].end) if body_first > 0 else prefix_end
+    if body_first == body_last:
+        body_end = body_start
+    else:
+        body_end = tokens[body_last].start if body_last < len(tokens) else end
+    return SimpleCommand(start, end, _command_words(tokens[body_first: body_last]), body_start, body_end)
+
+
+def _command_words(tokens: list) -> list:
+    """
+    Get the words of a simple command from the tokens of its body.
+    Variable assignments before the executable are skipped.
+
+    :param tokens: the tokens of the body.
+    :return: a list of Tokens.
+    """
+    words = [token for token in tokens if token.kind != Token.OPERATOR]
+
+    i = 0
+    while i < len(words) and words[i].kind == Token.WORD and _assignment_re.match(words[i].s):
+        i += 1
+        while i < len(words) and words[i].start == words[i - 1].end:
+            i += 1      # The quoted value of the assignment, such as A="1 2"
+    return words[i:]
@@ -3,7 +3,13 @@ import re
 
 from model import handle_error
 from model.command_word import CommandWord
-from util import str_util, context_util
+from model.parsed_instruction import ParsedInstruction
+from util import context_util, shell_lexer
+
+logger = logging.getLogger(__name__)
+
+# Instruction type, and the options (such as --mount=type=cache) of a RUN instruction
+_run_instruction_re = re.compile(r'\s*(\S+)\s+((?:--\S+\s*)*)')
 
 
 def is_exec_form(s: str):
@@ -17,32 +23,6 @@ def is_exec_form(s: str):
     return match_result is not None
 
 
-def match_double_quotes(s: str, start: int = 0):
-    """
-    Get the ending index of the firstly encountered double quotes (in s[start:]).
-    If no matches, return -1.
-
-    :param s: the string to search.
-    :param start: the start index of s.
-    :return: the ending index of firstly encountered double quotes, or -1 when no matches.
-    """
-    i = start
-    while i < len(s):
-        if s[i] == '"':
-            j = i + 1
-            while True:
-                matched_quote = s.find('"', j)  # Find matched quote
-                if matched_quote == -1:
-                    return -1
-
-                if s[matched_quote - 1] != '\\':
-                    return matched_quote
-                else:
-                    j = matched_quote + 1
-        i += 1
-    return -1
-
-
 def connect_shell_command_string(commands: list, connectors: list) -> str:
     """
     Join the full commands string using connectors.
@@ -61,128 +41,41 @@ def connect_shell_command_string(commands: list, connectors: list) -> str:
     return commands_str
 
 
-def _process_command_quotes_and_words(commands_str: str):
-    """
-    Only split the commands_str into:
-    - Single Quoted CommandWords
-    - Double Quoted CommandWords
-    - Other Content Normao CommandWords
-
-    Examples:
-    ->  apt-get install python3-pip && echo "hello, world!"
-    <-  [
-            CommandWord('apt-get install python3-pip && echo '),
-            CommandWord('hello, world!', DOUBLE_QUOTED)
-        ]
-    ->  echo 'ab\"cd' && echo "ab\"cd"
-    <-  [
-            CommandWord('echo '), CommandWord('ab\\"cd', SINGLE_QUOTED),
-            CommandWord(' && echo '), CommandWord('ab\\"cd', DOUBLE_QUOTED)
-        ]
-
-    :param commands_str: the commands string, for example 'apt-get update && apt install gcc'
-    :return: a list of CommandWords
-    """
-    # Handling shell-form
-    commands_str_split_words = []
-
-    # - Handling quotes and brackets
-    i = 0
-    content_outside_quote = ''
-    while i < len(commands_str):
-        if commands_str[i] in ("'", '"') and \
-                (i == 0 or (i > 0 and commands_str[i - 1] != '\\')):
-            # Find matched quote
-            if commands_str[i] == "'":
-                matched_quote = commands_str.find("'", i + 1)
-            else:
-                matched_quote = match_double_quotes(commands_str, i)
-
-            if matched_quote == -1:
-                logging.error('Illegal RUN command: "{0}"'.format(commands_str))
-                raise handle_error.HandleError()
-
-            if len(content_outside_quote) > 0:
-                commands_str_split_words.append(CommandWord(content_outside_quote))
-            content_outside_quote = ''
-
-            content_inside_quote = commands_str[i + 1: matched_quote]
-
-            commands_str_split_words.append(
-                CommandWord(content_inside_quote,
-                            CommandWord.SINGLE_QUOTED if commands_str[i] == "'" else CommandWord.DOUBLE_QUOTED))
-            i = matched_quote
-        else:
-            content_outside_quote += commands_str[i]
-        i += 1
-    if len(content_outside_quote) > 0:
-        commands_str_split_words.append(CommandWord(content_outside_quote))
-
-    return commands_str_split_words
-
-
 def split_command_strings(commands_str: str):
     """
     Preprocess the commands_str behind RUN (shell-form).
     The returned commands will be represented as strings.
-    All commands inside commands_str (connected with &&, ||, ;, etc) will be returned.
-    Note: escape character will not be translated inside double quotes, but \" inside
-          double quotes can be recognized.
-          ENV variables will not be substituted.
+    All commands inside commands_str (connected with &&, ||, ;, |, &, newline, etc) will be returned.
+    The commands and connectors are the source text of commands_str, so connecting them gives commands_str.
+    Note: ENV variables will not be substituted.
 
     Examples:
     ->  apt-get install python3-pip && echo "hello, world!"
-    <-  (['apt-get install python3-pip', 'echo "hello, world!"'], ['&&'])
+    <-  (['apt-get install python3-pip ', ' echo "hello, world!"'], ['&&'])
     ->  echo 'ab\"cd' && echo "ab\"cd"
-    <-  (["echo 'ab\\\"cd'", 'echo "ab"cd"'], ['&&'])
+    <-  (["echo 'ab\\\"cd' ", ' echo "ab\\"cd"'], ['&&'])
 
     :param commands_str: the shell-form commands string, for example 'apt-get update && apt install gcc'
     :return: commands, connectors.
-            commands is a list of commands (a command is a list of strings).
-            connectors is a list of connectors between commands ('&&', ';', '||').
+            commands is a list of commands (a command is a string).
+            connectors is a list of connectors between commands ('&&', ';', '||', '|', ...).
     """
-    commands_str_split_words = _process_command_quotes_and_words(commands_str)
-
-    # - Separate multiple commands in commands_str, for example 'a && b || c'
-    commands = []
-    connectors = []
-    command_str = ''
-    for command_word in commands_str_split_words:
-        if command_word.kind == CommandWord.SINGLE_QUOTED:
-            command_str += "'{}'".format(command_word.s)
-        elif command_word.kind == CommandWord.DOUBLE_QUOTED:
-            command_str += '"{}"'.format(command_word.s)
-        elif command_word.kind in (CommandWord.NORMAL, CommandWord.EXEC_FORM_ARG):
-            s = command_word.s
-            connector_indices_kinds = []
-            for connector in ('&&', ';', '||'):
-                connector_index = s.find(connector)
-                while connector_index != -1:
-                    connector_indices_kinds.append((connector_index, connector))
-                    connector_index = s.find(connector, connector_index + 1)
-            connector_indices_kinds = sorted(connector_indices_kinds, key=lambda x: x[0])
-
-            pre_connector_end_index = 0
-            for connector_index, connector_kind in connector_indices_kinds:
-                command_str += s[pre_connector_end_index: connector_index]
-                commands.append(command_str)
-                connectors.append(connector_kind)
-                pre_connector_end_index = connector_index + len(connector_kind)
-                command_str = ''
-            command_str += s[pre_connector_end_index:]
-    commands.append(command_str)
-    return commands, connectors
+    commands, connectors = shell_lexer.parse_command_list(commands_str)
+    return [commands_str[command.start: command.end] for command in commands], \
+        [connector.s for connector in connectors]
 
 
 def process_shell_form(commands_str: str, context):
     """
     Preprocess the commands_str behind RUN (shell-form).
     The returned commands will be represented as CommandWord objects.
-    All commands inside commands_str (connected with &&, ||, ;, etc) will be returned.
+    All commands inside commands_str (connected with &&, ||, ;, |, &, newline, etc) will be returned,
+    the commands are the same as split_command_strings().
     Note: escape character will not be translated inside double quotes, but \" inside
           double quotes can be recognized.
           ENV variables are substituted too (including string inside double quotes).
-          Brackets outside quotes will be removed.
+          Brackets, reserved words of compound commands and variable assignments before
+          the executable are removed (see shell_lexer.parse_command_list()).
           "DEBIAN_FRONTEND=noninteractive" will be removed.
 
     Examples:
@@ -201,53 +94,71 @@ def process_shell_form(commands_str: str, context):
     :param context: the context of this instruction. Context can be None.
     :return: (commands, connectors).
             commands is a list of commands (a command is a list of CommandWords).
-            connectors is a list of connectors between commands ('&&', ';', '||').
+            connectors is a list of connectors between commands ('&&', ';', '||', '|', ...).
     """
+    commands, connectors = shell_lexer.parse_command_list(commands_str)
+    return [_command_words(command, context) for command in commands], [connector.s for connector in connectors]
 
-    commands_str_split_words = _process_command_quotes_and_words(commands_str)
 
-    # - Separate multiple commands in commands_str, for example 'a && b || c'
-    commands = []
-    connectors = []
+def parse_run_instruction(content: str, context):
+    """
+    Parse the full content of a RUN instruction (line continuations included) in one pass.
+    The result contains both the spans of the commands inside the content, and the CommandWords
+    of the commands (like process_shell_form()).
 
-    command_words = []
-    for command_word in commands_str_split_words:
-        if command_word.kind == CommandWord.SINGLE_QUOTED:
-            command_words.append(command_word)
-        elif command_word.kind == CommandWord.DOUBLE_QUOTED:
-            command_word.s = context_util.substitute_env(command_word.s, context)
-            command_words.append(command_word)
-        elif command_word.kind in (CommandWord.NORMAL, CommandWord.EXEC_FORM_ARG):
-            s = command_word.s
-
-            # Remove brackets directly, because we don't care about the order of evaluation
-            s = str_util.remove_brackets(s)
-            s = context_util.substitute_env(s, context)
-
-            connector_indices_kinds = []
-
-            for connector in ('&&', ';', '||'):
-                connector_index = s.find(connector)
-                while connector_index != -1:
-                    connector_indices_kinds.append((connector_index, connector))
-                    connector_index = s.find(connector, connector_index + 1)
-            connector_indices_kinds = sorted(connector_indices_kinds, key=lambda x: x[0])
-
-            pre_connector_end_index = 0
-            for connector_index, connector_kind in connector_indices_kinds:
-                command_words.extend([
-                    CommandWord(word) for word in s[pre_connector_end_index: connector_index].strip().split()
-                    if word != 'DEBIAN_FRONTEND=noninteractive'
-                ])
-                commands.append(command_words)
-                connectors.append(connector_kind)
-                pre_connector_end_index = connector_index + len(connector_kind)
-                command_words = []
+    :param content: the content of the RUN instruction, for example 'RUN apt-get update && apt install gcc\n'.
+    :param context: the context of this instruction. Context can be None.
+    :return: (parsed_instruction, commands).
+            parsed_instruction is a ParsedInstruction.
+            commands is a list of commands (a command is a list of CommandWords),
+            it's empty when the commands are exec-form.
+    """
+    match_result = _run_instruction_re.match(content)
+    if match_result is None:
+        logger.error('Illegal RUN instruction: "{0}"'.format(content))
+        raise handle_error.HandleError()
+    commands_start = match_result.end(2)
+    commands_end = max(len(content.rstrip()), commands_start)
+
+    exec_form = is_exec_form(content[commands_start: commands_end])
+    if exec_form:
+        commands, connectors = [], []
+    else:
+        commands, connectors = shell_lexer.parse_command_list(content, commands_start, commands_end)
+    parsed_instruction = ParsedInstruction(
+        content=content,
+        instruction_type=match_result.group(1),
+        type_end=match_result.end(1),
+        body_start=match_result.start(2),
+        options=match_result.group(2).strip(),
+        exec_form=exec_form,
+        commands=commands,
+        connectors=connectors
+    )
+    return parsed_instruction, [_command_words(command, context) for command in commands]
+
+
+def _command_words(command: shell_lexer.SimpleCommand, context) -> list:
+    """
+    Get the CommandWords of a simple command, and substitute ENV variables inside them.
+    Unquoted words are split again after the substitution, except command substitutions.
 
+    :param command: the simple command.
+    :param context: the context of this instruction. Context can be None.
+    :return: a list of CommandWords.
+    """
+    command_words = []
+    for token in command.words:
+        if token.kind == shell_lexer.Token.SINGLE_QUOTED:
+            command_words.append(CommandWord(token.s, CommandWord.SINGLE_QUOTED))
+        elif token.kind == shell_lexer.Token.DOUBLE_QUOTED:
+            command_words.append(CommandWord(context_util.substitute_env(token.s, context), CommandWord.DOUBLE_QUOTED))
+        elif ' ' in token.s or '\t' in token.s or '\n' in token.s:
+            # Command substitutions, such as $(which gcc), are not split
+            command_words.append(CommandWord(context_util.substitute_env(token.s, context)))
+        else:
             command_words.extend([
-                CommandWord(word) for word in s[pre_connector_end_index:].strip().split()
+                CommandWord(word) for word in context_util.substitute_env(token.s, context).split()
                 if word != 'DEBIAN_FRONTEND=noninteractive'
             ])
-    commands.append(command_words)
-    return commands, connectors
-
+    return command_words
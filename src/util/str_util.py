@@ -1,7 +1,11 @@
+import logging
 import re
 
+from model import handle_error
 from model.command_word import CommandWord
 
+logger = logging.getLogger(__name__)
+
 
 def remove_brackets(s: str) -> str:
     return s.replace('(', '').replace(')', '')
@@ -62,3 +66,36 @@ def strip_and_dequote(s: str) -> str:
     while s[0] == '"' and s[-1] == '"':
         s = s[1:-1]
     return s
+
+
+def apply_span_edits(s: str, edits: list) -> str:
+    """
+    Apply all span edits (model.span_edit.SpanEdit) of s in a single pass.
+    -   Edits are applied in the order of their positions. Insertions at the same position
+        keep their order in edits, and they are applied before other edits starting at this position.
+    -   If an edit is inside another edit, the outer edit wins (the inner edit is ignored).
+    -   If two edits partially overlap, a HandleError is raised.
+
+    :param s: the string to edit.
+    :param edits: a list of SpanEdits, their spans are the indices of s.
+    :return: the edited string.
+    """
+    # Insertions before other edits; longer edits before the edits inside them
+    sorted_edits = sorted(edits, key=lambda e: (e.start, not e.is_insertion(), -e.end))
+
+    pieces = []
+    pos = 0
+    last_edit = None    # The last applied edit which is not an insertion
+    for edit in sorted_edits:
+        if last_edit is not None and edit.start < last_edit.end:
+            if edit.end <= last_edit.end:
+                continue    # Inside last_edit
+            logger.error('Overlapping edits: {0} and {1} of "{2}"'.format(last_edit, edit, s))
+            raise handle_error.HandleError()
+        pieces.append(s[pos: edit.start])
+        pieces.append(edit.text)
+        pos = edit.end
+        if not edit.is_insertion():
+            last_edit = edit
+    pieces.append(s[pos:])
+    return ''.join(pieces)
@@ -0,0 +1,79 @@
+import io
+import os
+import tempfile
+import unittest
+
+from config import engine_config
+from config.engine_config import EngineSettings, engine_settings
+from model.stats import Stats, stats
+
+
+class EngineTestCase(unittest.TestCase):
+    """
+    The base of the tests which run the Engine on a temporary input directory.
+
+    setUp() writes DOCKERFILES into the input directory, and resets the engine settings and the statistics:
+    the input and output are the temporary directories, the result cache is disabled, and the failure file and
+    the stat file are in-memory files. tearDown() resets them again, and removes the temporary directory.
+    """
+
+    # Key: the path inside the input directory; Value: the content (str or bytes)
+    DOCKERFILES = {}
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.input_dir = self.path('in')
+        self.output_dir = self.path('out')
+        os.mkdir(self.input_dir)
+        engine_config.global_settings.pm_settings_path = '../resources/settings.yaml'
+        self.reset_settings()
+        for name, content in self.DOCKERFILES.items():
+            self.write_input(name, content)
+
+    def tearDown(self):
+        vars(engine_settings).update(vars(EngineSettings()))
+        vars(stats).update(vars(Stats()))
+        self.tmp_dir.cleanup()
+
+    def reset_settings(self):
+        """
+        Reset the engine settings and the statistics, such as before running the Engine again.
+
+        :return: None
+        """
+        vars(engine_settings).update(vars(EngineSettings()))
+        engine_settings.input_file = self.input_dir
+        engine_settings.output_file = self.output_dir
+        engine_settings.use_cache = False
+        engine_settings.fail_fileobj = io.StringIO()
+        engine_settings.stat_fileobj = io.StringIO()
+        vars(stats).update(vars(Stats()))
+
+    def path(self, *names: str) -> str:
+        """
+        :param names: the path inside the temporary directory.
+        :return: the path.
+        """
+        return os.path.join(self.tmp_dir.name, *names)
+
+    def write_input(self, name: str, content) -> str:
+        """
+        Write a file into the input directory, the parent directories are created if needed.
+
+        :param name: the path inside the input directory.
+        :param content: the content, str or bytes.
+        :return: the path of the file.
+        """
+        path = os.path.join(self.input_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content.encode('utf-8') if isinstance(content, str) else content)
+        return path
+
+    def read_output(self, name: str) -> bytes:
+        """
+        :param name: the path inside the output directory.
+        :return: the content of the output file.
+        """
+        with open(os.path.join(self.output_dir, name), 'rb') as f:
+            return f.read()
@@ -0,0 +1,98 @@
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+import api
+from config import engine_config, optimization_config
+from config.engine_config import EngineSettings
+from config.optimization_config import SettingsError
+from model.optimization_strategy import AddCacheStrategy
+from model.stats import Stats, stats
+
+
+class TestApi(unittest.TestCase):
+
+    def setUp(self):
+        engine_config.global_settings.pm_settings_path = '../resources/settings.yaml'
+
+    def tearDown(self):
+        engine_config.global_settings.pm_settings_path = '../resources/settings.yaml'
+
+    def test_optimize_text(self):
+        root_handlers = list(logging.getLogger().handlers)
+        total_before = stats.one_file_tuple(), stats.total_files()
+
+        result = api.optimize_text('FROM ubuntu\nRUN pip install numpy\n', name='Dockerfile')
+        self.assertEqual(result.outcome, Stats.SUCCESSFUL)
+        self.assertEqual(result.text, '# syntax=docker/dockerfile:1.3\nFROM ubuntu\n'
+                                      'RUN --mount=type=cache,target=/root/.cache/pip pip install numpy\n')
+        self.assertEqual(result.stats, {'add_cache': 1, 'insert_before': 0, 'remove_command': 0,
+                                        'remove_option': 0, 'syntax_change': 1})
+        self.assertEqual(len(result.strategies), 1)
+        self.assertIsInstance(result.strategies[0][0], AddCacheStrategy)
+
+        result = api.optimize_text('FROM ubuntu\nRUN echo hello\n')
+        self.assertEqual((result.outcome, result.text), (Stats.UNCHANGED, 'FROM ubuntu\nRUN echo hello\n'))
+        settings = EngineSettings()
+        settings.prefilter = False
+        result = api.optimize_text('FROM ubuntu\nRUN echo hello\n', settings=settings)
+        self.assertEqual((result.outcome, result.text), (Stats.UNCHANGED, 'FROM ubuntu\nRUN echo hello\n'))
+
+        self.assertEqual((stats.one_file_tuple(), stats.total_files()), total_before)
+        self.assertEqual(logging.getLogger().handlers, root_handlers)
+
+    def test_no_global_state(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            settings_path = os.path.join(tmp_dir, 'settings.yaml')
+            shutil.copyfile('../resources/settings.yaml', settings_path)
+            engine_config.global_settings.pm_settings_path = settings_path
+            loaded_settings = dict(optimization_config.pm_settings), optimization_config.pm_executables.copy()
+
+            result = api.optimize_text('FROM ubuntu\nRUN pip install numpy\n')
+            self.assertEqual(result.outcome, Stats.SUCCESSFUL)
+            self.assertEqual((dict(optimization_config.pm_settings), optimization_config.pm_executables),
+                             loaded_settings)
+            self.assertEqual(os.listdir(tmp_dir), ['settings.yaml'])    # No snapshot is written
+
+            with open(os.path.join(tmp_dir, 'bad.yaml'), 'w') as f:
+                f.write('anti-cache-commands-regex: []\npackageManagers:\n  pip:\n    commands-regex-run: ["("]\n')
+            engine_config.global_settings.pm_settings_path = os.path.join(tmp_dir, 'bad.yaml')
+            with self.assertRaises(SettingsError):
+                api.optimize_text('FROM ubuntu\nRUN pip install numpy\n')
+            with self.assertRaises(SettingsError):
+                optimization_config.read_optimization_settings(os.path.join(tmp_dir, 'missing.yaml'))
+
+    def test_optimize_many(self):
+        texts = [
+            'FROM ubuntu\nRUN apt-get install gcc\n',
+            ('bad', 'FROM ubuntu\nRUN pip install "numpy\n'),
+            ('empty', ''),
+        ]
+        results = [(result.name, result.outcome) for result in api.optimize_many(texts)]
+        self.assertEqual(results, [
+            ('<memory-0>', Stats.SUCCESSFUL),
+            ('bad', Stats.FAILED),
+            ('empty', Stats.UNCHANGED),
+        ])
+
+        texts = iter(texts)
+        results = api.optimize_many(texts)
+        self.assertEqual(next(results).outcome, Stats.SUCCESSFUL)
+        self.assertEqual(next(texts), ('bad', 'FROM ubuntu\nRUN pip install "numpy\n'))     # Consumed lazily
+
+    def test_optimize_many_threads(self):
+        texts = [
+            'FROM ubuntu\nRUN apt-get update && apt-get install gcc\nRUN rm -rf /var/lib/apt/lists/*\n',
+            'FROM python:3\nRUN pip install --no-cache-dir flask\nFROM node\nRUN npm install\n',
+            'FROM ubuntu\nRUN echo hello\n',
+            'FROM ubuntu\nRUN pip install "numpy\n',
+        ] * 25
+        expected = [(result.text, result.outcome, result.stats) for result in api.optimize_many(texts)]
+        results = [(result.text, result.outcome, result.stats) for result in api.optimize_many(texts, jobs=4)]
+        self.assertEqual(results, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import io
+import tarfile
+import unittest
+import zipfile
+
+from config.engine_config import engine_settings
+from engine import Engine
+from engine_test_case import EngineTestCase
+from model.stats import stats
+
+
+class TestArchive(EngineTestCase):
+
+    MEMBERS = {
+        'a/Dockerfile': b'FROM ubuntu\nRUN apt-get install gcc\n',
+        'a/README.md': b'# readme\n',
+        'b/Dockerfile': b'FROM python\nRUN echo hello\n',
+        'b/Dockerfile.bad': b'FROM python\nRUN pip install "flask\n',
+        'node_modules/Dockerfile': b'FROM python\nRUN pip install flask\n',
+        'c/Dockerfile': b'\x00\x01FROM ubuntu\n',
+        'd/Dockerfile': b'FROM ubuntu\nRUN apt-get install gcc\n' + b'#' * 2048,
+    }
+
+    def setUp(self):
+        super().setUp()
+        engine_settings.max_file_size = 1024
+
+    def _run(self, input_file: str, output_file: str = None) -> dict:
+        engine_settings.input_file = input_file
+        engine_settings.output_file = output_file
+        Engine().run()
+        output_file = output_file or self.path('in.optimized' + input_file[input_file.index('.'):])
+        if output_file.endswith('.zip'):
+            with zipfile.ZipFile(output_file) as f:
+                return {name: f.read(name) for name in f.namelist()}
+        with tarfile.open(output_file) as f:
+            return {member.name: f.extractfile(member).read() for member in f.getmembers()}
+
+    def _check_outputs(self, outputs: dict):
+        self.assertEqual(sorted(outputs), sorted(self.MEMBERS))
+        self.assertTrue(outputs['a/Dockerfile'].startswith(b'# syntax=docker/dockerfile:1.3\n'))
+        # The other members are copied as they are, including the ones which are not candidates
+        for name in self.MEMBERS:
+            if name != 'a/Dockerfile':
+                self.assertEqual(outputs[name], self.MEMBERS[name])
+        self.assertEqual((stats.total_successful_files, stats.total_failed_files, stats.total_unchanged_files),
+                         (1, 1, 1))
+        self.assertEqual(list(stats.total_optimization_files.to_dict().values()), [['a/Dockerfile']])
+        self.assertEqual(engine_settings.fail_fileobj.getvalue(), 'b/Dockerfile.bad\n')
+
+    def _write_tar(self) -> str:
+        with tarfile.open(self.path('in.tar.gz'), 'w:gz') as f:
+            for name, content in self.MEMBERS.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                f.addfile(info, io.BytesIO(content))
+        return self.path('in.tar.gz')
+
+    def test_tar(self):
+        self._check_outputs(self._run(self._write_tar()))
+
+    def test_tar_to_zip(self):
+        self._check_outputs(self._run(self._write_tar(), self.path('out.zip')))
+
+    def test_zip(self):
+        with zipfile.ZipFile(self.path('in.zip'), 'w') as f:
+            for name, content in self.MEMBERS.items():
+                f.writestr(name, content)
+        engine_settings.jobs = 2
+        self._check_outputs(self._run(self.path('in.zip'), self.path('out.tar')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import unittest
+
+from config.engine_config import engine_settings
+from engine import Engine
+from engine_test_case import EngineTestCase
+from model.stats import stats
+
+
+class TestDedup(EngineTestCase):
+
+    DOCKERFILES = {
+        'a.Dockerfile': 'FROM ubuntu\nRUN echo hi\n',
+        'b.Dockerfile': 'FROM ubuntu  \r\nRUN echo hi \r\n',
+        'c.Dockerfile': 'FROM ubuntu\nRUN apt-get install gcc\n',
+        'd.Dockerfile': 'FROM ubuntu\nRUN apt-get install gcc\n',
+        'e.Dockerfile': 'FROM ubuntu\r\nRUN apt-get install gcc \r\n',
+        'f.Dockerfile': 'FROM python\nRUN pip install "flask\n',
+        'g.Dockerfile': 'FROM python\r\nRUN pip install "flask\r\n',
+    }
+
+    def _run(self, dedup: bool, dedup_link: bool = False):
+        """
+        Run the Engine on the input directory.
+
+        :return: (outputs, failures, stat report), outputs is a dictionary of Key: name; Value: content.
+        """
+        self.reset_settings()
+        engine_settings.dedup = dedup
+        engine_settings.dedup_link = dedup_link
+        Engine().run()
+        outputs = {name: self.read_output(name) for name in sorted(os.listdir(self.output_dir))}
+        return outputs, engine_settings.fail_fileobj.getvalue(), engine_settings.stat_fileobj.getvalue()
+
+    def test_dedup(self):
+        expected = self._run(dedup=False)
+        outputs, failures, stat_report = self._run(dedup=True)
+        self.assertEqual((outputs, failures, stat_report), expected)
+        self.assertEqual((stats.total_successful_files, stats.total_failed_files, stats.total_unchanged_files),
+                         (3, 2, 2))
+
+        # The files which are not optimized keep their own content
+        self.assertEqual(outputs['b.Dockerfile'], self.DOCKERFILES['b.Dockerfile'].encode())
+        self.assertEqual(outputs['g.Dockerfile'], self.DOCKERFILES['g.Dockerfile'].encode())
+        self.assertEqual(outputs['c.Dockerfile'], outputs['d.Dockerfile'])
+        self.assertEqual(failures.count('Dockerfile'), 2)
+
+    def test_dedup_link(self):
+        expected = self._run(dedup=False)
+        self.assertEqual(self._run(dedup=True, dedup_link=True), expected)
+        self.assertTrue(os.path.samefile(os.path.join(self.output_dir, 'c.Dockerfile'),
+                                         os.path.join(self.output_dir, 'd.Dockerfile')))
+        self.assertFalse(os.path.samefile(os.path.join(self.output_dir, 'c.Dockerfile'),
+                                          os.path.join(self.output_dir, 'e.Dockerfile')))
+
+        # Running again doesn't write through the hard links of the previous run
+        self.write_input('d.Dockerfile', 'FROM ubuntu\nRUN echo bye\n')
+        self.assertEqual(self._run(dedup=True, dedup_link=True)[0]['c.Dockerfile'], expected[0]['c.Dockerfile'])
+
+
+if __name__ == '__main__':
+    unittest.main()
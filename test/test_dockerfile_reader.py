@@ -0,0 +1,85 @@
+import io
+import os
+import unittest
+
+from dockerfile_parse import DockerfileParser
+
+from pipeline.dockerfile_reader import DockerfileReader
+from pipeline.stage_splitter import StageSplitter
+
+
+class TestDockerfileReader(unittest.TestCase):
+
+    def _assert_same_as_dockerfile_parse(self, content: bytes):
+        parser = DockerfileParser(fileobj=io.BytesIO(content))
+        reader = DockerfileReader(content=content)
+        structure, context_structure = parser.structure, parser.context_structure
+        self.assertEqual(list(reader.instructions()), structure)
+
+        stages = StageSplitter(dockerfile=reader).get_stages()
+        self.assertEqual([instruction for instructions, _ in stages for instruction in instructions], structure)
+        self.assertEqual(len(stages), len(parser.parent_images) if parser.is_multistage else 1)
+
+        contexts = [context for _, contexts in stages for context in contexts]
+        for instruction, context, expected_context in zip(structure, contexts, context_structure):
+            if instruction['instruction'] == 'RUN':
+                # dockerfile_parse doesn't tell an ARG without a default value (None) from an empty one
+                self.assertEqual({key: value or '' for key, value in context.args.items()}, expected_context.args)
+                self.assertEqual(context.envs, expected_context.envs)
+            else:
+                self.assertIsNone(context)
+
+    def test_dockerfiles(self):
+        dockerfiles_dir = '../dockerfiles'
+        for filename in sorted(os.listdir(dockerfiles_dir)):
+            with open(os.path.join(dockerfiles_dir, filename), 'rb') as f:
+                self._assert_same_as_dockerfile_parse(f.read())
+
+    def test_arg_env(self):
+        lines = [
+            'ARG arg1=bar',
+            'ARG top=1',
+            'FROM base',
+            'ARG top=2',
+            'env HOME=/root/$arg1',
+            'ARG arg2',
+            'ENV version=${arg2:-v1.0.0}',
+            'ENV HOME1=/${arg1}/foo',
+            'ENV HOME2=$HOME1/foo',
+            'RUN [ "echo", "$HOME" ]',
+            'FROM base2 AS second',
+            'ENV A B',
+            'RUN echo $A $top',
+            'ARG empty=',
+            'ENV B=${empty}x${arg2}',
+            'RUN echo $B',
+        ]
+        content = ''.join(line + '\n' for line in lines).encode('utf-8')
+        self._assert_same_as_dockerfile_parse(content)
+
+        contexts = [context for _, contexts in StageSplitter(dockerfile=DockerfileReader(content=content)).get_stages()
+                    for context in contexts]
+        self.assertEqual(contexts[9].args, {'top': '1', 'arg2': None})
+        self.assertEqual(contexts[-1].args, {'empty': ''})
+        self.assertEqual(contexts[-1].envs, {'A': 'B', 'B': 'x'})
+
+    def test_continuation_and_comments(self):
+        content = '# syntax=docker/dockerfile:1.3\r\n' \
+                  '# escape=`\r\n' \
+                  'FROM base\r\n' \
+                  'RUN apt-get update && `\r\n' \
+                  '# interrupt RUN\r\n' \
+                  '    apt-get install gcc\r\n' \
+                  '\r\n' \
+                  'RUN echo 3 &&  `\n' \
+                  'FROM\n' \
+                  'RUN echo 4'
+        self._assert_same_as_dockerfile_parse(content.encode('utf-8'))
+
+    def test_empty(self):
+        self._assert_same_as_dockerfile_parse(b'')
+        self.assertEqual(StageSplitter(dockerfile=DockerfileReader(content=b'')).get_stages(), [([], [])])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+
+from util import file_util
+
+
+class TestFileUtil(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = self.tmp_dir.name
+        files = {
+            'Dockerfile': b'FROM ubuntu\n',
+            'README.md': b'# readme\n',
+            'a/app.dockerfile': b'FROM ubuntu\n',
+            'a/Dockerfile.dev': b'FROM ubuntu\n',
+            'a/Dockerfile.bin': b'FROM ubuntu\0\n',
+            'a/Dockerfile.big': b'#' * 2048 + b'\n',
+            'b/Containerfile': b'FROM ubuntu\n',
+            'b/test/Dockerfile': b'FROM ubuntu\n',
+            '.git/Dockerfile': b'FROM ubuntu\n',
+            'node_modules/x/Dockerfile': b'FROM ubuntu\n',
+        }
+        for path, content in files.items():
+            path = os.path.join(self.root, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(content)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _walk(self, include_globs: list, exclude_globs: list, max_size: int = 0) -> list:
+        return [os.path.relpath(path, self.root) for path in file_util.walk_dockerfiles(
+            self.root, include_globs, exclude_globs, max_size)]
+
+    def test_walk_dockerfiles(self):
+        self.assertEqual(self._walk(file_util.DEFAULT_INCLUDE_GLOBS, file_util.DEFAULT_EXCLUDE_GLOBS, 1024), [
+            'Dockerfile', 'a/Dockerfile.dev', 'a/app.dockerfile', 'b/Containerfile', 'b/test/Dockerfile'
+        ])
+        self.assertEqual(self._walk(file_util.DEFAULT_INCLUDE_GLOBS, ['b/test', '*.dev']), [
+            'Dockerfile', '.git/Dockerfile', 'a/Dockerfile.big', 'a/app.dockerfile', 'b/Containerfile',
+            'node_modules/x/Dockerfile'
+        ])
+        self.assertEqual(self._walk(['*.md', 'b/*/*'], file_util.DEFAULT_EXCLUDE_GLOBS), [
+            'README.md', 'b/test/Dockerfile'
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import pickle
+import unittest
+
+from util.filename_store import FilenameStore
+
+
+class TestFilenameStore(unittest.TestCase):
+
+    def setUp(self):
+        self.spill_size = FilenameStore.SPILL_SIZE
+        FilenameStore.SPILL_SIZE = 4
+
+    def tearDown(self):
+        FilenameStore.SPILL_SIZE = self.spill_size
+
+    def test_spill(self):
+        store = FilenameStore()
+        for i in range(10):
+            store.add((1, 0, 0, 0, 1) if i % 3 else (2, 0, 0, 0, 1), 'f{0}'.format(i))
+        self.assertEqual(len(os.listdir(store._spill_dir.name)), 2)
+        self.assertEqual(store.counts(), {(2, 0, 0, 0, 1): 4, (1, 0, 0, 0, 1): 6})
+        self.assertEqual(list(store.filenames((2, 0, 0, 0, 1))), ['f0', 'f3', 'f6', 'f9'])
+
+        store.remove((2, 0, 0, 0, 1), 'f3')     # In a spill file
+        store.remove((2, 0, 0, 0, 1), 'f9')     # In memory
+        store.remove((2, 0, 0, 0, 1), 'f1')     # Not added
+        self.assertEqual(store.to_dict(), {(2, 0, 0, 0, 1): ['f0', 'f6'],
+                                           (1, 0, 0, 0, 1): ['f1', 'f2', 'f4', 'f5', 'f7', 'f8']})
+
+        copied = pickle.loads(pickle.dumps(store))
+        self.assertIsNone(copied._spill_dir)
+        self.assertEqual(copied.to_dict(), store.to_dict())
+        spill_dir = store._spill_dir.name
+        store.close()
+        self.assertEqual(len(store), 0)
+        self.assertFalse(os.path.exists(spill_dir))
+
+    def test_max_files(self):
+        store = FilenameStore(max_files=2)
+        for i in range(5):
+            store.add((1, 0, 0, 0, 1), 'f{0}'.format(i))
+        store.remove((1, 0, 0, 0, 1), 'f4')     # Counted, but not recorded
+        self.assertEqual(store.counts(), {(1, 0, 0, 0, 1): 4})
+        self.assertEqual(store.to_dict(), {(1, 0, 0, 0, 1): ['f0', 'f1']})
+
+        merged = FilenameStore(max_files=3)
+        merged.add((1, 0, 0, 0, 1), 'g0')
+        merged.merge(store)
+        self.assertEqual(merged.counts(), {(1, 0, 0, 0, 1): 5})
+        self.assertEqual(merged.to_dict(), {(1, 0, 0, 0, 1): ['g0', 'f0', 'f1']})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from config import engine_config
+from config.engine_config import engine_settings
+from engine import Engine
+from engine_test_case import EngineTestCase
+from util.journal import Journal
+
+
+class TestJournal(unittest.TestCase):
+
+    def test_record_and_load(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'journal.jsonl')
+            journal = Journal(path)
+            self.assertEqual(journal.load(), {})
+
+            journal.record('a', 'successful', (1, 1, 0, 0, 1), 0.5)
+            journal.record('b', 'failed', (0, 0, 0, 0, 0), 0.1)
+            journal.close()
+            with open(path, 'ab') as f:
+                f.write(b'{"path": "c", "outc')     # Truncated by a crash
+
+            journal = Journal(path)
+            journal.record('a', 'unchanged', (0, 0, 0, 0, 0), 0.2)
+            journal.close()
+            self.assertEqual(list(journal.load().items()), [
+                ('b', ('failed', (0, 0, 0, 0, 0), 0.1)),
+                ('a', ('unchanged', (0, 0, 0, 0, 0), 0.2)),
+            ])
+
+            journal.clear()
+            self.assertEqual(journal.load(), {})
+
+
+class TestResume(EngineTestCase):
+
+    DOCKERFILES = {
+        'a.Dockerfile': 'FROM ubuntu\nRUN apt-get install gcc\n',
+        'b.Dockerfile': 'FROM python\nRUN pip install "flask\n',
+        'c.Dockerfile': 'FROM ubuntu\nRUN echo hi\n',
+        'sub/d.Dockerfile': 'FROM python\nRUN pip install flask\n',
+        'sub/e.Dockerfile': 'FROM ubuntu\nRUN apt-get install "g++\n',
+        'sub/f.Dockerfile': 'FROM node\nRUN npm install express\n',
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.cwd = os.getcwd()
+        engine_config.global_settings.pm_settings_path = os.path.abspath('../resources/settings.yaml')
+        os.mkdir(self.path('cwd'))
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        super().tearDown()
+
+    def _run(self, cwd: str, input_file: str, jobs: int = 1, journal: bool = True, resume: bool = False,
+             interrupt_after: int = 0):
+        """
+        Run the Engine inside the working directory cwd (relative to the temporary directory).
+        If interrupt_after > 0, the run is interrupted after finishing that many files.
+
+        :return: (outputs, failures, stat report), the lines of the failures and the stat report are sorted,
+                since the resumed files are restored before the others.
+        """
+        os.chdir(self.path(cwd))
+        self.reset_settings()
+        engine_settings.input_file = input_file
+        engine_settings.output_file = os.path.join(os.path.dirname(input_file), 'out')
+        engine_settings.jobs = jobs
+        engine_settings.journal_file = self.path('journal.jsonl') if journal else None
+        engine_settings.resume = resume
+
+        engine = Engine()
+        if interrupt_after > 0:
+            # The files are finished in the parent process by _run_one_file(), or by merging the worker results
+            method = '_merge_worker_results' if jobs > 1 else '_run_one_file'
+            original = getattr(engine, method)
+            calls = []
+
+            def interrupt(*args, **kwargs):
+                if len(calls) == interrupt_after:
+                    raise KeyboardInterrupt()
+                calls.append(args)
+                return original(*args, **kwargs)
+
+            with mock.patch.object(engine, method, interrupt):
+                self.assertRaises(KeyboardInterrupt, engine.run)
+            engine.journal.close()
+            return None
+
+        engine.run()
+        names = [os.path.relpath(os.path.join(root, name), self.output_dir)
+                 for root, _, files in os.walk(self.output_dir) for name in files]
+        outputs = {name: self.read_output(name) for name in names}
+        return (outputs, sorted(engine_settings.fail_fileobj.getvalue().splitlines()),
+                sorted(engine_settings.stat_fileobj.getvalue().splitlines()))
+
+    def _check_resume(self, interrupted_jobs: int, resumed_jobs: int):
+        expected = self._run('cwd', os.path.join('..', 'in'), journal=False)
+        self.assertEqual(len(expected[0]), len(self.DOCKERFILES))
+        self.assertEqual(len(expected[1]), 2)
+        shutil.rmtree(self.output_dir)
+
+        # Interrupted inside the temporary directory, and resumed inside another working directory
+        self._run('.', 'in', jobs=interrupted_jobs, interrupt_after=3)
+        journaled = Journal(self.path('journal.jsonl')).load()
+        self.assertGreaterEqual(len(journaled), 3)
+        if interrupted_jobs == 1:   # The worker processes may have finished more files than the parent merged
+            self.assertEqual(len(journaled), 3)
+        self.assertTrue(all(os.path.isabs(path) for path in journaled))
+
+        with mock.patch.object(Engine, '_optimize_one_file', autospec=True,
+                               side_effect=Engine._optimize_one_file) as optimize_one_file:
+            self.assertEqual(self._run('cwd', os.path.join('..', 'in'), jobs=resumed_jobs, resume=True), expected)
+        if resumed_jobs == 1:   # The worker processes don't see the mock
+            self.assertEqual(optimize_one_file.call_count, len(self.DOCKERFILES) - len(journaled))
+        self.assertEqual(len(Journal(self.path('journal.jsonl')).load()), len(self.DOCKERFILES))
+
+    def test_resume(self):
+        self._check_resume(interrupted_jobs=1, resumed_jobs=1)
+
+    def test_resume_parallel(self):
+        self._check_resume(interrupted_jobs=1, resumed_jobs=2)
+        shutil.rmtree(self.output_dir)
+        self._check_resume(interrupted_jobs=2, resumed_jobs=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
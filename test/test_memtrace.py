@@ -0,0 +1,78 @@
+import json
+import os
+import tracemalloc
+import unittest
+from unittest import mock
+
+from config.engine_config import engine_settings
+from engine import Engine
+from engine_test_case import EngineTestCase
+from util.memory_tracer import MemoryTracer
+
+
+class TestMemtrace(EngineTestCase):
+
+    DOCKERFILES = {
+        'a.Dockerfile': 'FROM ubuntu\nRUN apt-get install gcc\n',
+        'b.Dockerfile': 'FROM python\nRUN pip install flask\n',
+    }
+
+    def setUp(self):
+        super().setUp()
+        engine_settings.memtrace_file = self.path('memtrace.txt')
+
+    def _check_report(self):
+        self.assertFalse(tracemalloc.is_tracing())
+        with open(engine_settings.memtrace_file) as f:
+            report = f.read()
+        self.assertIn(' - Traced files: 2\n', report)
+        self.assertIn(' - Peak memory of files: p50 ', report)
+        self.assertIn('a.Dockerfile', report)
+        sites = report[report.index('   Size\tBlocks\tPhase\tSite\n'):].splitlines()[1:]
+        self.assertGreater(len(sites), 0)
+        phases = {site.split('\t')[2] for site in sites}
+        self.assertTrue(phases <= set(MemoryTracer.PHASES) | {MemoryTracer.FINISH_PHASE})
+        self.assertIn('simulate', phases)
+        self.assertFalse(any('memory_tracer.py' in site or 'tracemalloc.py' in site for site in sites))
+
+    def test_memtrace(self):
+        engine_settings.memtrace = True
+        engine_settings.timings_file = self.path('timings.jsonl')
+        Engine().run()
+        self._check_report()
+        with open(engine_settings.timings_file) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(len(records), 2)
+        self.assertTrue(all(record['peak_memory'] > 0 for record in records))
+
+    def test_memtrace_parallel(self):
+        engine_settings.memtrace = True
+        engine_settings.jobs = 2
+        Engine().run()
+        self._check_report()
+
+    def test_interrupted_file(self):
+        engine_settings.memtrace = True
+        engine = Engine()
+        with mock.patch.object(Engine, '_optimize_one_file', side_effect=RuntimeError):
+            self.assertRaises(RuntimeError, engine._run_one_file, self.path('in', 'a.Dockerfile'), self.path('a'))
+        self.assertEqual(engine.memory_tracer._last_statistics, {})
+
+        # The next file is traced from its own start
+        with mock.patch.object(MemoryTracer, 'start', autospec=True, side_effect=MemoryTracer.start) as start:
+            engine._run_one_file(self.path('in', 'b.Dockerfile'), self.path('b'))
+        self.assertEqual(start.call_count, 1)
+        self.assertEqual(len(engine.memory_tracer.total_peaks), 1)
+        self.assertEqual(engine.memory_tracer.largest_files[0][1], self.path('in', 'b.Dockerfile'))
+        engine.memory_tracer.stop_tracing()
+
+    def test_no_memtrace(self):
+        engine = Engine()
+        engine.run()
+        self.assertIsNone(engine.memory_tracer)
+        self.assertIsNone(engine.timer)
+        self.assertFalse(os.path.exists(engine_settings.memtrace_file))
+
+
+if __name__ == '__main__':
+    unittest.main()
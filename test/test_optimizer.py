@@ -2,9 +2,12 @@ import unittest
 
 from dockerfile_parse import DockerfileParser
 
+from config.engine_config import engine_settings
 from model import handle_error
 from model.optimization_strategy import *
+from model.span_edit import SpanEdit
 from pipeline import stage_optimizer
+from util import str_util
 
 
 class TestOptimizer(unittest.TestCase):
@@ -29,6 +32,51 @@ class TestOptimizer(unittest.TestCase):
             print('You will see this')
             return
 
+    def _optimize(self, lines: list, strategies: list) -> list:
+        instructions = self._lines_wrapper(lines)
+        stage = (instructions, [None] * len(instructions))
+        return stage_optimizer.StageOptimizer(stage, self.parser.lines).optimize(strategies)
+
+    def test_multiple_strategies(self):
+        lines = [
+            'RUN pip install --no-cache-dir a && \\',
+            '    rm -rf /root/.cache/pip /tmp/x && pip cache purge && \\',
+            '    echo ok'
+        ]
+        strategies = [
+            RemoveOptionStrategy(0, 0, ['--no-cache-dir']),
+            AddCacheStrategy(0, ['/root/.cache/pip']),
+            RemoveCommandStrategy(0, [1, 2], [['/root/.cache/pip'], None])
+        ]
+        self.assertEqual(self._optimize(lines, strategies), [
+            'RUN --mount=type=cache,target=/root/.cache/pip pip install a && \\\n'
+            '    rm -rf /tmp/x && true && \\\n'
+            '    echo ok\n'
+        ])
+
+        engine_settings.remove_command_with_true = False
+        try:
+            strategies[2] = RemoveCommandStrategy(0, [1, 3], [None, None])
+            self.assertEqual(self._optimize(lines, strategies), [
+                'RUN --mount=type=cache,target=/root/.cache/pip pip install a && pip cache purge\n'
+            ])
+            # The outer edit wins: the command with the option is removed
+            strategies[2] = RemoveCommandStrategy(0, [0], [None])
+            self.assertEqual(self._optimize(lines, strategies), [
+                'RUN --mount=type=cache,target=/root/.cache/pip  \\\n'
+                '    rm -rf /root/.cache/pip /tmp/x && pip cache purge && \\\n'
+                '    echo ok\n'
+            ])
+        finally:
+            engine_settings.remove_command_with_true = True
+
+    def test_apply_span_edits(self):
+        s = '0123456789'
+        self.assertEqual(str_util.apply_span_edits(s, [
+            SpanEdit(8, 9, 'x'), SpanEdit(2, 2, 'a'), SpanEdit(2, 5, 'b'), SpanEdit(3, 4, 'c'), SpanEdit(2, 2, 'd')
+        ]), '01adb567x9')
+        self.assertRaises(handle_error.HandleError, str_util.apply_span_edits, s, [SpanEdit(2, 5, ''), SpanEdit(4, 6, '')])
+
 
 if __name__ == '__main__':
     unittest.main()
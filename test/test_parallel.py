@@ -0,0 +1,55 @@
+import os
+import unittest
+from unittest import mock
+
+from config.engine_config import engine_settings
+from engine import Engine
+from engine_test_case import EngineTestCase
+from model.stats import stats
+
+
+class TestParallel(EngineTestCase):
+
+    DOCKERFILES = {
+        'a.Dockerfile': 'FROM ubuntu\nRUN apt-get update && apt-get install gcc && rm -rf /var/lib/apt/lists/*\n',
+        'b.Dockerfile': 'FROM python\nRUN pip install "flask\n',
+        'c.Dockerfile': 'FROM ubuntu\nRUN echo hi\n',
+        'd/Dockerfile': 'FROM python\nRUN pip install --no-cache-dir flask\n',
+        'd/e.Dockerfile': 'FROM node\nRUN npm install && npm cache clean --force\n',
+        'f.Dockerfile': '',
+        'g.Dockerfile': 'FROM ubuntu\nRUN apt-get install "gcc\n',
+    }
+
+    def _run(self, jobs: int, use_cache: bool = False):
+        self.reset_settings()
+        engine_settings.jobs = jobs
+        engine_settings.use_cache = use_cache
+        engine_settings.cache_dir = self.path('cache')
+        Engine().run()
+        outputs = {}
+        for current_dir, _, files in os.walk(self.output_dir):
+            for f in files:
+                name = os.path.relpath(os.path.join(current_dir, f), self.output_dir)
+                outputs[name] = self.read_output(name)
+        return outputs, engine_settings.fail_fileobj.getvalue(), engine_settings.stat_fileobj.getvalue()
+
+    def test_same_as_serial(self):
+        outputs, failures, stat_report = self._run(jobs=1)
+        self.assertEqual(len(outputs), len(self.DOCKERFILES))
+        self.assertEqual(failures.count('\n'), 2)
+        self.assertEqual(self._run(jobs=2), (outputs, failures, stat_report))
+
+    def test_shared_result_cache(self):
+        expected = self._run(jobs=1)
+        self.assertEqual(self._run(jobs=2, use_cache=True), expected)
+
+        # The worker processes store the results with the cache keys of the parent process
+        with mock.patch.object(Engine, '_optimize_one_file', autospec=True,
+                               side_effect=Engine._optimize_one_file) as optimize_one_file:
+            self.assertEqual(self._run(jobs=1, use_cache=True), expected)
+        self.assertEqual(optimize_one_file.call_count, 1)     # c.Dockerfile is skipped by the pre-filter
+        self.assertEqual(stats.total_successful_files, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
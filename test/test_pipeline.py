@@ -3,6 +3,7 @@ import unittest
 from dockerfile_parse import DockerfileParser
 
 from config import engine_config
+from config import optimization_config
 from config.optimization_config import load_optimization_settings
 from model import handle_error
 from pipeline.stage_optimizer import StageOptimizer
@@ -27,7 +28,7 @@ class TestAll(unittest.TestCase):
         try:
             _simulator = StageSimulator(stage)
             _simulator.simulate()
-            _optimizer = StageOptimizer(stage, self.parser.lines)
+            _optimizer = StageOptimizer(stage, self.parser.lines, _simulator.get_parsed_instructions())
             new_stage_lines = _optimizer.optimize(_simulator.get_optimization_strategies())
         except handle_error.HandleError as e:
             print('A handle error was raised')
@@ -47,6 +48,36 @@ class TestAll(unittest.TestCase):
             'RUN --mount=type=cache,target=/var/cache/apt --mount=type=cache,target=/var/lib/apt apt-get install\n'
         ])
 
+    def test_executable_path(self):
+        lines = [
+            'RUN /usr/local/bin/pip install gcc && ./configure'
+        ]
+        result = self._execute_one_stage(lines)
+        self.assertEqual(result, [
+            'RUN --mount=type=cache,target=/root/.cache/pip /usr/local/bin/pip install gcc && ./configure\n'
+        ])
+
+    def test_prefilter(self):
+        prefilter_re = optimization_config.global_opt_settings.prefilter_re
+        for content in [b'RUN apt-get update', b'RUN /usr/bin/pip3 install a', b'ENV PM=npm', b'RUN cd a && ./mvnw']:
+            self.assertIsNotNone(prefilter_re.search(content), content)
+        for content in [b'RUN echo golang', b'COPY pip.conf /etc/', b'RUN make && make install']:
+            self.assertIsNone(prefilter_re.search(content), content)
+        self.assertEqual(optimization_config._regex_literal_prefix(r'^apt(-get)?\s+(auto)?clean'), 'apt')
+        self.assertEqual(optimization_config._regex_literal_prefix(r'^pipx?\s'), 'pip')
+        self.assertEqual(optimization_config._regex_literal_prefix(r'^apt|^npm'), '')
+
+    def test_reload_settings(self):
+        pm_names = list(optimization_config.pm_settings.keys())
+        engine_config.global_settings.pm_settings_path = 'not-exists.yaml'
+        self.assertFalse(optimization_config.reload_optimization_settings())
+        self.assertEqual(list(optimization_config.pm_settings.keys()), pm_names)
+        self.assertEqual(optimization_config.pm_executables['apt-get'], 'apt')
+
+        engine_config.global_settings.pm_settings_path = '../resources/settings.yaml'
+        self.assertTrue(optimization_config.reload_optimization_settings())
+        self.assertEqual(list(optimization_config.pm_settings.keys()), pm_names)
+
     def test_run_exec_form(self):
         lines = [
             'RUN --mount=type=cache,target=/var/lib/apt [ "apt-get", "update" ]',
@@ -107,6 +138,44 @@ class TestAll(unittest.TestCase):
             'RUN echo 3 && true\n',
             'RUN --mount=type=cache,target=/var/cache/apt --mount=type=cache,target=/var/lib/apt  true && apt-get install || true\n'])
 
+    def test_anti_cache_compound_commands(self):
+        mount = 'RUN --mount=type=cache,target=/var/lib/apt --mount=type=cache,target=/var/cache/apt '
+        lines = [
+            'RUN apt-get update && if [ -d x ]; then rm -rf /var/lib/apt/lists/*; fi',
+            'RUN apt-get update && for d in a; do rm -rf /var/lib/apt/lists/*; done',
+            'RUN apt-get update && { rm -rf /var/lib/apt/lists/*; }',
+            'RUN apt-get update && ( rm -rf /var/lib/apt/lists/* )',
+        ]
+        # The reserved words and the brackets around the removed commands are kept
+        for line, expected in zip(lines, [
+            'apt-get update && if [ -d x ]; then true ; fi\n',
+            'apt-get update && for d in a; do true ; done\n',
+            'apt-get update && { true ; }\n',
+            'apt-get update && ( true )\n',
+        ]):
+            self.assertEqual(self._execute_one_stage([line])[-1], mount + expected)
+
+        lines += [
+            'RUN apt-get update && { apt-get install gcc && rm -rf /var/lib/apt/lists/*; }',
+            'RUN apt-get install gcc && rm -rf /var/lib/apt/lists/* &',
+            'RUN apt-get update && rm -rf /var/lib/apt/lists/* && if [ -d x ]; then echo a; fi',
+        ]
+        # Only the commands without the reserved words and the brackets are removed with their connectors
+        engine_config.engine_settings.remove_command_with_true = False
+        try:
+            for line, expected in zip(lines, [
+                'apt-get update && if [ -d x ]; then true ; fi\n',
+                'apt-get update && for d in a; do true ; done\n',
+                'apt-get update && { true ; }\n',
+                'apt-get update && ( true )\n',
+                'apt-get update && { apt-get install gcc ; }\n',
+                'apt-get install gcc &\n',
+                'apt-get update && if [ -d x ]; then echo a; fi\n',
+            ]):
+                self.assertEqual(self._execute_one_stage([line])[-1], mount + expected)
+        finally:
+            engine_config.engine_settings.remove_command_with_true = True
+
     def test_modify_cache_dir(self):
         lines = [
             'RUN npm install',
@@ -0,0 +1,69 @@
+import os
+import pstats
+import unittest
+
+from config.engine_config import engine_settings
+from engine import Engine
+from engine_test_case import EngineTestCase
+from util.profiler import PipelineProfiler
+
+
+class TestProfile(EngineTestCase):
+
+    DOCKERFILES = {
+        'a.Dockerfile': 'FROM ubuntu\nRUN apt-get install gcc\n',
+        'b.Dockerfile': 'FROM python\nRUN pip install flask\n',
+        'c.Dockerfile': 'FROM python\nRUN echo hello\n',
+    }
+
+    def setUp(self):
+        super().setUp()
+        engine_settings.profile_file = self.path('dpmo.prof')
+
+    def _check_profile(self, profiled_files: int):
+        profile = pstats.Stats(engine_settings.profile_file)
+        calls = {func[2]: func_stats[1] for func, func_stats in profile.stats.items()}
+        # c.Dockerfile is skipped by the pre-filter, so only 2 files go through DockerfileOptimizer
+        self.assertEqual(calls['_optimize_one_file'], profiled_files)
+        self.assertEqual(calls['optimize'], profiled_files - 1)
+
+        with open(engine_settings.profile_file + '.collapsed') as f:
+            lines = f.read().splitlines()
+        self.assertGreater(len(lines), 0)
+        for line in lines:
+            stack, _, value = line.rpartition(' ')
+            self.assertTrue(stack.startswith('_optimize_one_file (engine.py:'))
+            self.assertGreater(int(value), 0)
+        self.assertTrue(any(';optimize (dockerfile_optimizer.py:' in line for line in lines))
+
+    def test_profile(self):
+        Engine().run()
+        self._check_profile(3)
+
+    def test_profile_parallel(self):
+        engine_settings.jobs = 2
+        Engine().run()
+        self._check_profile(3)
+
+    def test_min_duration(self):
+        engine_settings.profile_min_duration = 3600
+        Engine().run()
+        self.assertFalse(os.path.exists(engine_settings.profile_file))
+
+    def test_merge(self):
+        def f():
+            return sum(range(100))
+
+        profiler = PipelineProfiler()
+        other = PipelineProfiler()
+        profiler.call(f)
+        other.call(f)
+        other.call(f)
+        profiler.merge(other.detach())
+        self.assertEqual(profiler.profiled_files, 3)
+        self.assertEqual(other.func_stats, {})
+        self.assertEqual([func_stats[1] for func, func_stats in profiler.func_stats.items() if func[2] == 'f'], [3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import io
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from config.engine_config import engine_settings
+from engine import Engine
+from engine_test_case import EngineTestCase
+from model.stats import stats
+from util.result_cache import ResultCache
+
+
+class TestResultCache(unittest.TestCase):
+
+    STAT_TUPLE = (3, 1, 1, 0, 0, 1)
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = ResultCache(cache_dir=os.path.join(self.tmp_dir.name, 'cache'), max_size=1024 * 1024,
+                                 salt=b'salt')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _store(self, key: str, output: bytes, outcome: str = 'successful'):
+        self.cache.store(key, io.BytesIO(output), outcome, self.STAT_TUPLE)
+
+    def _load(self, key: str):
+        f_out = io.BytesIO()
+        result = self.cache.load(key, f_out)
+        return result, f_out.getvalue()
+
+    def test_get_key(self):
+        key = self.cache.get_key(b'FROM ubuntu\n')
+        self.assertEqual(key, self.cache.get_key(b'FROM ubuntu\n'))
+        self.assertNotEqual(key, self.cache.get_key(b'FROM python\n'))
+        self.assertNotEqual(key, ResultCache(cache_dir=self.cache.cache_dir, max_size=self.cache.max_size,
+                                             salt=b'other').get_key(b'FROM ubuntu\n'))
+
+    def test_hit_and_miss(self):
+        key = self.cache.get_key(b'FROM ubuntu\n')
+        self.assertEqual(self._load(key), (None, b''))
+
+        self._store(key, b'# syntax=docker/dockerfile:1.3\nFROM ubuntu\n')
+        self.assertEqual(self._load(key), (('successful', self.STAT_TUPLE),
+                                           b'# syntax=docker/dockerfile:1.3\nFROM ubuntu\n'))
+        self._store(key, b'FROM ubuntu\n', outcome='failed')
+        self.assertEqual(self._load(key), (('failed', self.STAT_TUPLE), b'FROM ubuntu\n'))
+        self.assertEqual(self._load(self.cache.get_key(b'FROM python\n')), (None, b''))
+
+    def test_corrupt_entries(self):
+        key = self.cache.get_key(b'FROM ubuntu\n')
+        self._store(key, b'FROM ubuntu\n')
+        entry_path = self.cache._entry_path(key)
+        for broken_entry in [b'', b'{"outcome": "successful", "sta', b'{"outcome": "successful"}\nFROM ubuntu\n',
+                             b'not json\nFROM ubuntu\n']:
+            with open(entry_path, 'wb') as f:
+                f.write(broken_entry)
+            # The broken entry is a miss, and nothing is written into the output
+            self.assertEqual(self._load(key), (None, b''))
+
+        self._store(key, b'FROM ubuntu\n')
+        self.assertEqual(self._load(key), (('successful', self.STAT_TUPLE), b'FROM ubuntu\n'))
+
+    def test_prune(self):
+        output = b'#' * 100
+        entry_size = len(b'{"outcome": "successful", "stats": [3, 1, 1, 0, 0, 1]}\n') + len(output)
+        self.cache.max_size = entry_size * 2
+        keys = [self.cache.get_key(str(i).encode()) for i in range(3)]
+
+        now = time.time()
+        self._store(keys[0], output)
+        self._store(keys[1], output)
+        os.utime(self.cache._entry_path(keys[0]), (now - 100, now - 100))
+        os.utime(self.cache._entry_path(keys[1]), (now - 50, now - 50))
+        self.assertEqual(self._load(keys[0])[1], output)     # Recently used now
+
+        self._store(keys[2], output)    # Over max_size, the least recently used entry is removed
+        self.assertEqual([os.path.exists(self.cache._entry_path(key)) for key in keys], [True, False, True])
+        self.assertEqual(self.cache.unpruned_size, 0)
+
+        # Nothing is removed within max_size
+        self.cache.unpruned_size = 1
+        self.cache.prune()
+        self.assertEqual([os.path.exists(self.cache._entry_path(key)) for key in keys], [True, False, True])
+
+
+class TestResultCacheEngine(EngineTestCase):
+
+    DOCKERFILES = {
+        'a.Dockerfile': 'FROM ubuntu\nRUN apt-get install gcc\n',
+        'b.Dockerfile': 'FROM python\nRUN pip install "flask\n',
+        'c.Dockerfile': 'FROM ubuntu\nRUN echo hi\n',
+    }
+
+    def _run(self):
+        self.reset_settings()
+        engine_settings.use_cache = True
+        engine_settings.cache_dir = self.path('cache')
+        with mock.patch.object(Engine, '_optimize_one_file', autospec=True,
+                               side_effect=Engine._optimize_one_file) as optimize_one_file:
+            Engine().run()
+        outputs = {name: self.read_output(name) for name in sorted(os.listdir(self.output_dir))}
+        return (optimize_one_file.call_count, outputs, engine_settings.fail_fileobj.getvalue(),
+                engine_settings.stat_fileobj.getvalue())
+
+    def test_cached_run(self):
+        calls, outputs, failures, stat_report = self._run()
+        self.assertEqual(calls, len(self.DOCKERFILES))
+
+        # c.Dockerfile is skipped by the pre-filter, so it's not cached
+        cache_dir = self.path('cache')
+        self.assertEqual(sum(len(files) for _, _, files in os.walk(cache_dir)), len(self.DOCKERFILES) - 1)
+
+        # The outputs, the failure records and the statistics are restored from the cache
+        self.assertEqual(self._run(), (1, outputs, failures, stat_report))
+        self.assertEqual((stats.total_successful_files, stats.total_failed_files, stats.total_unchanged_files),
+                         (1, 1, 1))
+        self.assertEqual(failures.count('b.Dockerfile'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
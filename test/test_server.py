@@ -0,0 +1,153 @@
+import json
+import os
+import shutil
+import signal
+import socket
+import threading
+import time
+import unittest
+from unittest import mock
+
+import engine
+from config import engine_config
+from engine_test_case import EngineTestCase
+from server import OptimizerServer
+
+_optimize_content_in_worker = engine._optimize_content_in_worker
+
+
+def _optimize_or_crash(content: bytes, name: str):
+    """
+    Replace engine._optimize_content_in_worker(), and kill the worker process for the requests named "crash".
+    """
+    if name == 'crash':
+        os._exit(1)
+    return _optimize_content_in_worker(content, name)
+
+
+class TestServer(EngineTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.socket_path = self.path('dpmo.sock')
+        self.settings_path = self.path('settings.yaml')
+        shutil.copyfile(engine_config.global_settings.pm_settings_path, self.settings_path)
+        engine_config.global_settings.pm_settings_path = self.settings_path
+
+    def tearDown(self):
+        engine_config.global_settings.pm_settings_path = '../resources/settings.yaml'
+        super().tearDown()
+
+    def _serve(self, client):
+        """
+        Run the server in this thread (the signal handlers need the main thread), and client(server) in
+        another thread, which stops the server when it returns.
+
+        :return: None
+        """
+        server = OptimizerServer(self.socket_path, jobs=1)
+        errors = []
+
+        def run_client():
+            try:
+                for _ in range(500):
+                    if os.path.exists(self.socket_path):
+                        break
+                    time.sleep(0.01)
+                client(server)
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                os.kill(os.getpid(), signal.SIGTERM)
+
+        thread = threading.Thread(target=run_client)
+        with mock.patch.object(OptimizerServer, 'SETTINGS_POLL_INTERVAL', 0.05), \
+                mock.patch.object(engine, '_optimize_content_in_worker', _optimize_or_crash):
+            thread.start()
+            server.run()
+        thread.join()
+        self.assertFalse(os.path.exists(self.socket_path))
+        if len(errors) > 0:
+            raise errors[0]
+
+    def _request(self, lines: list) -> list:
+        """
+        Send the request lines through one connection.
+
+        :param lines: the request lines (bytes, without the line endings).
+        :return: the responses.
+        """
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.connect(self.socket_path)
+            s.sendall(b''.join(line + b'\n' for line in lines))
+            s.shutdown(socket.SHUT_WR)
+            with s.makefile('rb') as f:
+                return [json.loads(line) for line in f]
+
+    def test_requests(self):
+        def client(server):
+            responses = self._request([
+                json.dumps({'id': 1, 'content': 'FROM ubuntu\nRUN apt-get install gcc\n', 'name': 'a'}).encode(),
+                b'',
+                json.dumps({'id': 2, 'content': 'FROM python\nRUN pip install "flask\n'}).encode(),
+                b'not json',
+                json.dumps({'id': 4}).encode(),
+                json.dumps({'id': 5, 'content': 1}).encode(),
+            ])
+            self.assertEqual([response['id'] for response in responses], [1, 2, None, 4, 5])
+
+            self.assertEqual(responses[0]['outcome'], 'successful')
+            self.assertTrue(responses[0]['content'].startswith('# syntax=docker/dockerfile:1.3\n'))
+            self.assertGreater(responses[0]['stats'][0], 0)
+            self.assertEqual(responses[1]['outcome'], 'failed')
+            self.assertEqual(responses[1]['content'], 'FROM python\nRUN pip install "flask\n')
+            self.assertEqual(responses[1]['stats'][0], 0)
+            for response in responses[2:]:
+                self.assertEqual(set(response), {'id', 'error'})
+                self.assertTrue(response['error'].startswith('Invalid request: '))
+
+        self._serve(client)
+
+    def test_worker_crash(self):
+        def client(server):
+            request = {'id': 1, 'content': 'FROM ubuntu\nRUN apt-get install gcc\n'}
+            executor = server.executor
+            responses = self._request([json.dumps(dict(request, name='crash')).encode()])
+            self.assertEqual(responses, [{'id': 1, 'error': 'The worker process died.'}])
+            self.assertIsNot(server.executor, executor)
+
+            # The worker processes are restarted
+            responses = self._request([json.dumps(request).encode()])
+            self.assertEqual(responses[0]['outcome'], 'successful')
+
+        self._serve(client)
+
+    def test_reload_settings(self):
+        def wait_for(condition) -> bool:
+            for _ in range(500):
+                if condition():
+                    return True
+                time.sleep(0.01)
+            return False
+
+        def client(server):
+            executor = server.executor
+            with open(self.settings_path, 'a') as f:
+                f.write('\n# Changed\n')
+            self.assertTrue(wait_for(lambda: server.executor is not executor))
+
+            # Illegal settings are not loaded, and the workers are kept
+            executor = server.executor
+            with self.assertLogs(level='ERROR') as logs:
+                with open(self.settings_path, 'w') as f:
+                    f.write('[')
+                self.assertTrue(wait_for(lambda: any('Cannot reload the settings' in line for line in logs.output)))
+            self.assertIs(server.executor, executor)
+            request = {'id': 1, 'content': 'FROM ubuntu\nRUN apt-get install gcc\n'}
+            self.assertEqual(self._request([json.dumps(request).encode()])[0]['outcome'], 'successful')
+
+        self._serve(client)
+
+
+if __name__ == '__main__':
+    unittest.main()
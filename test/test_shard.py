@@ -0,0 +1,43 @@
+import os
+import unittest
+
+from config.engine_config import engine_settings
+from engine import Engine
+from engine_test_case import EngineTestCase
+from model.stats import Stats, stats
+from util import file_util
+
+
+class TestShard(EngineTestCase):
+
+    def test_in_shard(self):
+        paths = ['a/Dockerfile.{0}'.format(i) for i in range(200)]
+        shards = [[path for path in paths if file_util.in_shard(path, (index, 3))] for index in (1, 2, 3)]
+        self.assertEqual(sorted(sum(shards, [])), sorted(paths))
+        self.assertTrue(all(len(shard) > 0 for shard in shards))
+        self.assertEqual(shards[0], [path for path in paths if file_util.in_shard(path.replace('/', os.sep), (1, 3))])
+
+    def test_merge_shards(self):
+        for i in range(12):
+            content = 'FROM ubuntu\nRUN pip install numpy\n' if i % 3 != 0 else 'FROM ubuntu\nRUN echo hello\n'
+            self.write_input('Dockerfile.{0}'.format(i), content)
+
+        def run(shard) -> Stats:
+            self.reset_settings()
+            engine_settings.shard = shard
+            if shard is not None:
+                engine_settings.stats_dump_file = self.path('stats-{0}.json'.format(shard[0]))
+            Engine().run()
+            return Stats.read_dump(engine_settings.stats_dump_file) if shard is not None else stats
+
+        expected = run(None).total_str()
+        merged = Stats()
+        for index in (1, 2, 3):
+            merged.merge(run((index, 3)))
+        self.assertEqual(merged.total_files(), 12)
+        self.assertEqual(merged.total_str(), expected)
+        self.assertEqual(Stats.from_dump(merged.to_dump()).to_dump(), merged.to_dump())
+
+
+if __name__ == '__main__':
+    unittest.main()
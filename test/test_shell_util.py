@@ -0,0 +1,163 @@
+import unittest
+
+from dockerfile_parse.util import Context
+
+from config.optimization_config import RegexSet
+from model import handle_error
+from model.command_word import CommandWord
+from util import context_util, shell_lexer, shell_util
+
+
+class TestShellUtil(unittest.TestCase):
+
+    def _assert_words(self, commands_str: str, expected: list, expected_connectors: list):
+        commands, connectors = shell_util.process_shell_form(commands_str, None)
+        self.assertEqual([[word.s for word in command] for command in commands], expected)
+        self.assertEqual(connectors, expected_connectors)
+
+        command_strings, connectors = shell_util.split_command_strings(commands_str)
+        self.assertEqual(len(command_strings), len(commands))
+        self.assertEqual(connectors, expected_connectors)
+        self.assertEqual(shell_util.connect_shell_command_string(command_strings, connectors), commands_str)
+
+    def test_connectors(self):
+        self._assert_words(
+            'apt-get update && apt-get install -y gcc || exit 1; echo done',
+            [['apt-get', 'update'], ['apt-get', 'install', '-y', 'gcc'], ['exit', '1'], ['echo', 'done']],
+            ['&&', '||', ';']
+        )
+        self._assert_words(
+            'curl -fsSL https://example.com/install.sh | sh && sleep 1 & wait',
+            [['curl', '-fsSL', 'https://example.com/install.sh'], ['sh'], ['sleep', '1'], ['wait']],
+            ['|', '&&', '&']
+        )
+        self._assert_words(
+            'make 2>&1 | tee log &> /dev/null && make install >/dev/null',
+            [['make', '2>&1'], ['tee', 'log', '&>', '/dev/null'], ['make', 'install', '>/dev/null']],
+            ['|', '&&']
+        )
+        self._assert_words(
+            'echo 1\necho 2',
+            [['echo', '1'], ['echo', '2']],
+            ['\n']
+        )
+
+    def test_quotes(self):
+        self._assert_words(
+            'echo \'a && b\' && echo "c \\" | d" && echo e"f"g',
+            [['echo', 'a && b'], ['echo', 'c \\" | d'], ['echo', 'e', 'f', 'g']],
+            ['&&', '&&']
+        )
+        commands, _ = shell_util.process_shell_form('echo \'a\' "b" c', None)
+        self.assertEqual([word.kind for word in commands[0]], [
+            CommandWord.NORMAL, CommandWord.SINGLE_QUOTED, CommandWord.DOUBLE_QUOTED, CommandWord.NORMAL
+        ])
+        self.assertRaises(handle_error.HandleError, shell_util.process_shell_form, 'echo "a', None)
+
+    def test_substitutions_and_continuations(self):
+        self._assert_words(
+            'cd $(dirname "$(which gcc)") && echo `date; uname` \\\n    && apt-get \\\n install gcc',
+            [['cd', '$(dirname "$(which gcc)")'], ['echo', '`date; uname`'], ['apt-get', 'install', 'gcc']],
+            ['&&', '&&']
+        )
+        self._assert_words(
+            'apt-get update # comment && rm -rf /var/lib/apt/lists/*',
+            [['apt-get', 'update']],
+            []
+        )
+
+    def test_substitute_env(self):
+        # TARGET is "ARG TARGET=" (empty), and UNSET is "ARG UNSET" (without a default value)
+        context = Context(args={'VERSION': '1.0', 'TARGET': '', 'UNSET': None, 'HOME': '/arg', 'FOO': 'arg'},
+                          envs={'HOME': '/root', 'EMPTY': '', 'FOOBAR': 'env'})
+        self.assertEqual(context_util.substitute_env('$HOME/.cache ${HOME}/x $HOMEDIR v$VERSION', context),
+                         '/root/.cache /root/x $HOMEDIR v1.0')
+        self.assertEqual(context_util.substitute_env('$FOO $FOOBAR ${FOO}BAR $FOO_BAR', context),
+                         'arg env argBAR $FOO_BAR')
+        self.assertEqual(context_util.substitute_env('${TARGET:-/tmp} ${EMPTY:-${HOME}/y} ${HOME:-/z}', context),
+                         '/tmp /root/y /root')
+        self.assertEqual(context_util.substitute_env('a${HOME:+-$VERSION} b${EMPTY:+x} c${X:+x}', context),
+                         'a-1.0 b c')
+        self.assertEqual(context_util.substitute_env('[$TARGET] [${TARGET}] $UNSET ${UNSET:-u} ${UNSET:+x}', context),
+                         '[] [] $UNSET u ')
+        self.assertEqual(context_util.substitute_env('\\$HOME $p', context), '\\$HOME $p')
+
+        commands, _ = shell_util.process_shell_form('pip install "$HOME/a b" \'$HOME\' ${HOME}', context)
+        self.assertEqual([word.s for word in commands[0]], ['pip', 'install', '/root/a b', '$HOME', '/root'])
+
+    def test_compound_commands(self):
+        self._assert_words(
+            '(cd /src && make) && { make install; }',
+            [['cd', '/src'], ['make'], ['make', 'install'], []],
+            ['&&', '&&', ';']
+        )
+        self._assert_words(
+            'if [ -f a ]; then apt-get update; else exit 1; fi',
+            [['[', '-f', 'a', ']'], ['apt-get', 'update'], ['exit', '1'], []],
+            [';', ';', ';']
+        )
+        self._assert_words(
+            'for p in a b; do pip install $p; done',
+            [[], ['pip', 'install', '$p'], []],
+            [';', ';']
+        )
+        self._assert_words(
+            'case "$X" in a|b) apk add gcc ;; *) echo no ;; esac',
+            [['apk', 'add', 'gcc'], ['echo', 'no'], []],
+            [';;', ';;']
+        )
+
+    def test_assignments(self):
+        self._assert_words(
+            'DEBIAN_FRONTEND=noninteractive A="1 2" apt-get install -y gcc && CGO_ENABLED=0 go build',
+            [['apt-get', 'install', '-y', 'gcc'], ['go', 'build']],
+            ['&&']
+        )
+
+    def test_spans(self):
+        commands, connectors = shell_util.split_command_strings('apt-get update && echo "a && b" | sh')
+        self.assertEqual(commands, ['apt-get update ', ' echo "a && b" ', ' sh'])
+        self.assertEqual(connectors, ['&&', '|'])
+
+    def test_body_spans(self):
+        for s, bodies in [
+            ('a && if [ -d x ]; then rm x; fi', ['a ', ' [ -d x ]', ' rm x', '']),
+            ('for d in a; do rm x; done', ['', ' rm x', '']),
+            ('{ rm x; } && ( A=1 rm y )', [' rm x', '', ' A=1 rm y ']),
+            ('case $x in a|b) rm x;; esac', [' rm x', '']),
+        ]:
+            commands, _ = shell_lexer.parse_command_list(s)
+            self.assertEqual([s[command.body_start: command.body_end] for command in commands], bodies, s)
+
+    def test_parse_run_instruction(self):
+        content = 'RUN --mount=type=bind,target=/x apt-get update && \\\r\n    apt-get in\\  \nstall gcc\r\n'
+        parsed_instruction, commands = shell_util.parse_run_instruction(content, None)
+        self.assertEqual(parsed_instruction.instruction_type, 'RUN')
+        self.assertEqual(content[parsed_instruction.type_end: parsed_instruction.body_start], ' ')
+        self.assertEqual(parsed_instruction.options, '--mount=type=bind,target=/x')
+        self.assertFalse(parsed_instruction.exec_form)
+        self.assertEqual([content[command.start: command.end] for command in parsed_instruction.commands],
+                         ['apt-get update ', ' \\\r\n    apt-get in\\  \nstall gcc'])
+        self.assertEqual([connector.s for connector in parsed_instruction.connectors], ['&&'])
+        self.assertEqual([[word.s for word in command] for command in commands],
+                         [['apt-get', 'update'], ['apt-get', 'install', 'gcc']])
+
+    def test_regex_set(self):
+        regex_set = RegexSet([r'.*install.*', r'(run|i)\s*', r'x(a|b)\1'])
+        self.assertIsNone(regex_set.combined_re)   # Backreference
+        self.assertEqual(regex_set.match('npm run build'), None)
+        self.assertEqual(regex_set.match('pip install gcc'), r'.*install.*')
+        self.assertEqual(regex_set.match('run build'), r'(run|i)\s*')
+        self.assertEqual(regex_set.match('xaa'), r'x(a|b)\1')
+        self.assertIsNone(regex_set.match('xab'))
+
+        regex_set = RegexSet([r'.*install.*', r'(run|i)\s*', r'(?P<name>up)date'])
+        self.assertIsNotNone(regex_set.combined_re)
+        self.assertEqual(regex_set.match('run build'), r'(run|i)\s*')
+        self.assertEqual(regex_set.match('update'), r'(?P<name>up)date')
+        self.assertIsNone(regex_set.match('upgrade'))
+        self.assertIsNone(RegexSet([]).match('install'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+# Modules which are slow to import, and should only be imported when they are needed
+LAZY_MODULES = ('yaml', 'dockerfile_parse', 'multiprocessing')
+
+
+def _run_python(code: str) -> str:
+    """
+    Run code in a new interpreter with the same sys.path, and return its stderr.
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    return result.stderr
+
+
+def _import_times(importtime_output: str) -> dict:
+    """
+    Parse the output of "python -X importtime".
+
+    :return: a dict. Key: the module; Value: the cumulative import time in microseconds.
+    """
+    times = {}
+    for line in importtime_output.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, module = line[len('import time:'):].split('|')
+            if cumulative.strip().isdigit():
+                times[module.strip()] = int(cumulative)
+    return times
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_lazy_imports(self):
+        times = _import_times(_run_python('import main, engine, config.args_handler'))
+        slowest = sorted(times.items(), key=lambda x: x[1], reverse=True)[:10]
+        message = 'Slowest imports (us): {0}'.format(slowest)
+        for module in LAZY_MODULES:
+            self.assertNotIn(module, times, message)
+
+    def test_settings_snapshot(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            settings_path = os.path.join(tmp_dir, 'settings.yaml')
+            shutil.copyfile('../resources/settings.yaml', settings_path)
+            code = 'from config import engine_config, optimization_config\n' \
+                   'engine_config.global_settings.pm_settings_path = {0!r}\n' \
+                   'optimization_config.load_optimization_settings()\n' \
+                   'print(optimization_config.settings_digest, len(optimization_config.pm_settings), ' \
+                   'file=__import__("sys").stderr)\n'.format(settings_path)
+
+            output = _run_python(code)
+            self.assertIn('yaml', _import_times(output))
+            self.assertTrue(os.path.exists(os.path.join(tmp_dir, '.settings.yaml.snapshot')))
+            loaded = output.splitlines()[-1]
+
+            output = _run_python(code)     # Loaded from the snapshot
+            self.assertNotIn('yaml', _import_times(output))
+            self.assertEqual(output.splitlines()[-1], loaded)
+
+            with open(settings_path, 'a') as f:
+                f.write('# changed\n')
+            output = _run_python(code)     # The snapshot is invalidated
+            self.assertIn('yaml', _import_times(output))
+            self.assertEqual(output.splitlines()[-1], loaded)
+
+
+if __name__ == '__main__':
+    unittest.main()
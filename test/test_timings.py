@@ -0,0 +1,50 @@
+import json
+import os
+import unittest
+from unittest import mock
+
+from config.engine_config import engine_settings
+from engine import Engine
+from engine_test_case import EngineTestCase
+from model.stats import stats
+from util.phase_timer import PhaseTimer
+
+
+class TestTimings(EngineTestCase):
+
+    DOCKERFILES = {
+        'a.Dockerfile': 'FROM ubuntu\nRUN apt-get install gcc\n',
+        'b.Dockerfile': 'FROM python\nRUN pip install "flask\n',
+    }
+
+    def test_timings_file(self):
+        timings_file = self.path('timings.jsonl')
+        engine_settings.timings_file = timings_file
+        with mock.patch.object(PhaseTimer, 'start', autospec=True, side_effect=PhaseTimer.start) as start:
+            Engine().run()
+        self.assertEqual(start.call_count, 2)   # Once per file
+
+        with open(timings_file) as f:
+            records = {os.path.basename(record['path']): record for record in map(json.loads, f)}
+        self.assertEqual(sorted(records), ['a.Dockerfile', 'b.Dockerfile'])
+        self.assertEqual(records['a.Dockerfile']['outcome'], 'successful')
+        self.assertEqual(records['b.Dockerfile']['outcome'], 'failed')
+        for record in records.values():
+            self.assertEqual(set(record), {'path', 'outcome', 'duration'} | set(PhaseTimer.PHASES))
+            self.assertGreaterEqual(record['duration'], sum(record[phase] for phase in PhaseTimer.PHASES) - 1e-5)
+        self.assertGreater(records['a.Dockerfile']['simulate'], 0)
+        self.assertGreater(records['a.Dockerfile']['write'], 0)
+        self.assertEqual(records['b.Dockerfile']['write'], 0)
+
+        self.assertEqual(len(stats.total_durations), 2)
+        self.assertIn('Durations of files: p50 ', stats.total_str())
+        self.assertIn('b.Dockerfile', stats.durations_str())
+
+    def test_no_timings(self):
+        Engine().run()
+        self.assertEqual(len(stats.total_durations), 0)
+        self.assertNotIn('Durations of files', stats.total_str())
+
+
+if __name__ == '__main__':
+    unittest.main()
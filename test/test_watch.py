@@ -0,0 +1,42 @@
+import os
+import unittest
+
+from engine import Engine
+from engine_test_case import EngineTestCase
+from model.stats import Stats, stats
+
+
+class TestWatch(EngineTestCase):
+
+    def _write(self, name: str, content: str):
+        path = self.write_input(name, content)
+        # Make sure the modification is noticed, even with a coarse mtime
+        os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10 ** 9))
+
+    def test_poll_input_directory(self):
+        engine = Engine()
+        watched_files = {}
+        self._write('Dockerfile', 'FROM ubuntu\nRUN apt-get install gcc\n')
+        self._write('Dockerfile.a', 'FROM python\nRUN echo hello\n')
+        self.assertTrue(engine._poll_input_directory(watched_files))
+        self.assertEqual((stats.total_successful_files, stats.total_unchanged_files), (1, 1))
+        self.assertFalse(engine._poll_input_directory(watched_files))
+
+        self._write('Dockerfile.a', 'FROM python\nRUN pip install flask\n')
+        self._write('Dockerfile.b', 'FROM python\nRUN pip install "flask\n')
+        os.remove(os.path.join(self.input_dir, 'Dockerfile'))
+        self.assertTrue(engine._poll_input_directory(watched_files))
+        self.assertEqual(sorted(os.listdir(self.output_dir)), ['Dockerfile.a', 'Dockerfile.b'])
+        self.assertEqual(sorted((os.path.basename(input_file), outcome)
+                                for input_file, (_, _, outcome, _) in watched_files.items()),
+                         [('Dockerfile.a', Stats.SUCCESSFUL), ('Dockerfile.b', Stats.FAILED)])
+        self.assertEqual((stats.total_successful_files, stats.total_failed_files, stats.total_unchanged_files),
+                         (1, 1, 0))
+        self.assertEqual((stats.total_add_cache_num, stats.total_insert_before_num, stats.total_syntax_change_num),
+                         (1, 0, 1))
+        self.assertEqual(list(stats.total_optimization_files.to_dict().values()),
+                         [[os.path.join(self.input_dir, 'Dockerfile.a')]])
+
+
+if __name__ == '__main__':
+    unittest.main()